@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Calibrate the early-exit cascade of the anti-spoof ensemble.
+
+Runs every model on a labelled folder of face images (preprocessed exactly like
+the server: RetinaFace box on the original frame and one warped crop per
+model, or the legacy 3:4 resize with --resize_3_4), orders the models by
+measured forward time and picks, per stage, the smallest margin for which the
+cascade's live/spoof decisions differ from the full ensemble's on at most
+``--target_error`` of the images. The result is written to
+``<model_dir>/cascade.json``, which the server loads with LIVENESS_CASCADE=1.
+
+Expected layout of --data_dir: one sub-folder per label, ``1``/``live``/``real``
+for live faces and anything else (``0``, ``2``, ``spoof``, ...) for attacks.
+"""
+
+import os
+import time
+import argparse
+import warnings
+
+import cv2
+import numpy as np
+
+from src.anti_spoof_predict import AntiSpoofPredict
+from src.generate_patches import CropImage
+from src.cascade import CASCADE_FILE, LIVE_LABEL, model_key, simulate, calibrate_margins, save_cascade
+warnings.filterwarnings('ignore')
+
+LIVE_FOLDERS = ('1', 'live', 'real')
+
+
+def load_images(data_dir):
+    """(image, is_live) for every readable image below ``data_dir``."""
+    samples = []
+    for label in sorted(os.listdir(data_dir)):
+        folder = os.path.join(data_dir, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            image = cv2.imread(os.path.join(folder, name))
+            if image is not None:
+                samples.append((image, label.lower() in LIVE_FOLDERS))
+    return samples
+
+
+def model_probs(model_test, entries, samples, resize_3_4=False):
+    """Softmax outputs {model key: (N, 3)} and mean forward time {model key: ms}."""
+    image_cropper = CropImage()
+    crop = image_cropper.crop if resize_3_4 else image_cropper.warp_crop
+    probs = {model_key(entry['name']): [] for entry in entries}
+    forward_ms = {model_key(entry['name']): 0.0 for entry in entries}
+    for image, _ in samples:
+        # same preprocessing as AntiSpoofDetector.detect_spoof
+        if resize_3_4:
+            image = cv2.resize(image, (int(image.shape[0] * 3 / 4), image.shape[0]))
+        bbox = model_test.get_bbox(image)
+        for entry in entries:
+            h_input, w_input, _, scale = entry['spec']
+            patch = crop(image, bbox, scale, w_input, h_input, crop=scale is not None)
+            start = time.time()
+            probs[model_key(entry['name'])].append(model_test.predict(patch, entry['path'])[0])
+            forward_ms[model_key(entry['name'])] += (time.time() - start) * 1000
+    return ({key: np.array(value) for key, value in probs.items()},
+            {key: value / len(samples) for key, value in forward_ms.items()})
+
+
+if __name__ == "__main__":
+    desc = "calibrate the anti-spoof early-exit cascade"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        "--model_dir",
+        type=str,
+        default="./resources/anti_spoof_models",
+        help="directory with the .pth checkpoints")
+    parser.add_argument(
+        "--data_dir",
+        type=str,
+        required=True,
+        help="labelled images, one sub-folder per label (1/live/real = live)")
+    parser.add_argument(
+        "--order",
+        nargs="+",
+        default=None,
+        help="model names in cascade order (default: fastest first)")
+    parser.add_argument(
+        "--target_error",
+        type=float,
+        default=0.005,
+        help="max fraction of images where the cascade may disagree with the full ensemble")
+    parser.add_argument(
+        "--min_margin",
+        type=float,
+        default=0.8,
+        help="lowest margin considered, so a small calibration set cannot make the cascade trust a coin flip")
+    parser.add_argument(
+        "--resize_3_4",
+        action="store_true",
+        help="calibrate for the legacy pipeline (server runs with LIVENESS_WARP_CROP=0)")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="calibration file (default: <model_dir>/cascade.json)")
+    args = parser.parse_args()
+
+    samples = load_images(args.data_dir)
+    if not samples:
+        raise SystemExit(f"No labelled images in {args.data_dir}")
+    model_test = AntiSpoofPredict(0, model_dir=args.model_dir)
+    entries = model_test.registry.scan(args.model_dir, model_test.model_extensions)
+    probs, forward_ms = model_probs(model_test, entries, samples, args.resize_3_4)
+
+    order = [model_key(name) for name in args.order] if args.order else sorted(forward_ms, key=forward_ms.get)
+    margins, report = calibrate_margins(probs, order, args.target_error, args.min_margin)
+
+    is_live = np.array([live for _, live in samples])
+    full = np.stack([probs[key] for key in order]).sum(axis=0).argmax(axis=1) == LIVE_LABEL
+    labels, models_run = simulate(probs, order, margins)
+    cascade = labels == LIVE_LABEL
+    cost = np.array([sum(forward_ms[key] for key in order[:n]) for n in models_run])
+    report.update({
+        'target_error': args.target_error,
+        'min_margin': args.min_margin,
+        'forward_ms': {key: round(forward_ms[key], 3) for key in order},
+        'full_accuracy': float((full == is_live).mean()),
+        'cascade_accuracy': float((cascade == is_live).mean()),
+        'compute_saved': float(1.0 - cost.mean() / sum(forward_ms.values())),
+    })
+    output = args.output or os.path.join(args.model_dir, CASCADE_FILE)
+    save_cascade(output, order, margins, report)
+
+    for key in order:
+        print(f"{key}: {forward_ms[key]:.2f} ms")
+    print(f"order {order}, margins {margins}")
+    print(f"{report['samples']} images ({int(is_live.sum())} live): "
+          f"disagreement with full ensemble {report['disagreement']:.4f} (target {args.target_error}), "
+          f"accuracy {report['full_accuracy']:.4f} -> {report['cascade_accuracy']:.4f}")
+    print(f"early exit rate {report['early_exit_rate']:.2%}, average models run {report['average_models_run']:.2f}, "
+          f"compute saved {report['compute_saved']:.2%}")
+    print(f"Wrote {output}")
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Compile every MiniFASNet checkpoint for inference: fold BatchNorm into the
+convolutions, trace, freeze with torch.jit.freeze and cache the result as
+``<checkpoint>.jit.pt`` next to the ``.pth``. An artifact is only kept when it
+reproduces the eager model's probabilities.
+"""
+
+import os
+import time
+import argparse
+import warnings
+
+import numpy as np
+import torch
+
+from src.anti_spoof_predict import AntiSpoofPredict
+from src.inference_compile import compile_model, save_compiled, load_compiled, compiled_path
+from src.utility import parse_model_name
+warnings.filterwarnings('ignore')
+
+
+def time_forward(model, batch, repeat):
+    with torch.no_grad():
+        model(batch)
+        start = time.time()
+        for _ in range(repeat):
+            model(batch)
+    return (time.time() - start) / repeat * 1000
+
+
+if __name__ == "__main__":
+    desc = "compile anti-spoof models"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        "--model_dir",
+        type=str,
+        default="./resources/anti_spoof_models",
+        help="directory with the .pth checkpoints")
+    parser.add_argument(
+        "--atol",
+        type=float,
+        default=1e-4,
+        help="max allowed abs difference between eager and compiled probabilities")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=50,
+        help="forward passes used to time eager vs compiled")
+    args = parser.parse_args()
+
+    model_test = AntiSpoofPredict(0)
+    rng = np.random.RandomState(0)
+    failed = 0
+    for model_name in sorted(os.listdir(args.model_dir)):
+        if not model_name.endswith('.pth'):
+            continue
+        model_path = os.path.join(args.model_dir, model_name)
+        h_input, w_input, _, _ = parse_model_name(model_name)
+        try:
+            # compile from a private eager copy; fold_batchnorm works in place
+            compiled = compile_model(model_test._load_model(model_path), h_input, w_input)
+            save_compiled(compiled, model_path)
+            reloaded = load_compiled(model_path, model_test.device)
+
+            crops = list(rng.randint(0, 256, (8, h_input, w_input, 3)).astype(np.uint8))
+            eager = model_test.registry.get(model_path)
+            batch = torch.from_numpy(np.stack(crops).transpose((0, 3, 1, 2))).float().to(model_test.device)
+            with torch.no_grad():
+                expected = torch.softmax(eager(batch), dim=1).cpu().numpy()
+                actual = torch.softmax(reloaded(batch), dim=1).cpu().numpy()
+                single = torch.softmax(reloaded(batch[:1]), dim=1).cpu().numpy()
+            diff = max(np.abs(expected - actual).max(), np.abs(expected[:1] - single).max())
+            if diff > args.atol:
+                raise RuntimeError(f"compiled output differs from eager by {diff:.2e}")
+
+            eager_ms = time_forward(eager, batch[:1], args.repeat)
+            compiled_ms = time_forward(reloaded, batch[:1], args.repeat)
+            print(f"{model_name} -> {os.path.basename(compiled_path(model_path))} "
+                  f"(max diff {diff:.2e}, forward {eager_ms:.2f} ms -> {compiled_ms:.2f} ms)")
+        except Exception as e:
+            failed += 1
+            print(f"Failed to compile {model_name}: {e}")
+            if os.path.exists(compiled_path(model_path)):
+                os.remove(compiled_path(model_path))
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Export every MiniFASNet checkpoint in a model directory to ONNX.
+
+The exported file keeps the checkpoint's parse_model_name naming scheme
+(``2.7_80x80_MiniFASNetV2.pth`` -> ``2.7_80x80_MiniFASNetV2.onnx``), has a
+dynamic batch dimension, and is checked against the PyTorch model before it
+is kept.
+"""
+
+import os
+import inspect
+import argparse
+import warnings
+
+import cv2
+import numpy as np
+import torch
+
+from src.anti_spoof_predict import AntiSpoofPredict
+from src.generate_patches import CropImage
+from src.onnx_predict import OnnxAntiSpoofPredict, ONNX_RUNTIMES
+from src.utility import parse_model_name
+warnings.filterwarnings('ignore')
+
+
+SAMPLE_IMAGE_PATH = "./images/sample/"
+
+
+def sample_crops(model_test, h_input, w_input, scale):
+    """Model-sized crops of the sample images plus a few random inputs."""
+    image_cropper = CropImage()
+    crops = []
+    for name in sorted(os.listdir(SAMPLE_IMAGE_PATH)) if os.path.isdir(SAMPLE_IMAGE_PATH) else []:
+        if not name.endswith('.jpg') or name.endswith('_result.jpg'):
+            continue
+        image = cv2.imread(os.path.join(SAMPLE_IMAGE_PATH, name))
+        if image is None:
+            continue
+        bbox = model_test.get_bbox(image)
+        crops.append(image_cropper.crop(image, bbox, scale, w_input, h_input, crop=scale is not None))
+    rng = np.random.RandomState(0)
+    crops.extend(rng.randint(0, 256, (4, h_input, w_input, 3)).astype(np.uint8))
+    return crops
+
+
+def export(model_test, model_path, output_path, opset):
+    h_input, w_input, _, _ = parse_model_name(os.path.basename(model_path))
+    model = model_test.registry.get(model_path)
+    if model is None:
+        raise RuntimeError(f"could not load {model_path}")
+    dummy = torch.zeros(1, 3, h_input, w_input, device=model_test.device)
+    # newer torch defaults to the dynamo exporter, whose graphs cv2.dnn cannot read
+    legacy = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(
+        model, dummy, output_path,
+        input_names=['input'], output_names=['output'],
+        dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
+        opset_version=opset,
+        do_constant_folding=True,
+        **legacy
+    )
+
+
+def verify(model_test, onnx_test, model_path, output_path, atol):
+    """Compare batched softmax outputs of the ONNX and PyTorch models, return the max abs diff."""
+    h_input, w_input, _, scale = parse_model_name(os.path.basename(model_path))
+    crops = sample_crops(model_test, h_input, w_input, scale)
+    expected = model_test.predict_batch(crops, model_path)
+    actual = onnx_test.predict_batch(crops, output_path)
+    single = np.concatenate([onnx_test.predict(crop, output_path) for crop in crops])
+    diff = max(np.abs(expected - actual).max(), np.abs(expected - single).max())
+    if diff > atol or (expected.argmax(axis=1) != actual.argmax(axis=1)).any():
+        raise RuntimeError(f"ONNX output differs from PyTorch by {diff:.2e} (atol {atol:.0e})")
+    return diff
+
+
+if __name__ == "__main__":
+    desc = "export anti-spoof models to onnx"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        "--model_dir",
+        type=str,
+        default="./resources/anti_spoof_models",
+        help="directory with the .pth checkpoints, .onnx files are written next to them")
+    parser.add_argument(
+        "--opset",
+        type=int,
+        default=11,
+        help="onnx opset version")
+    parser.add_argument(
+        "--runtime",
+        type=str,
+        default="cv2",
+        choices=ONNX_RUNTIMES,
+        help="runtime used to verify the exported models")
+    parser.add_argument(
+        "--atol",
+        type=float,
+        default=1e-4,
+        help="max allowed abs difference between torch and onnx probabilities")
+    args = parser.parse_args()
+
+    model_test = AntiSpoofPredict(0)
+    onnx_test = OnnxAntiSpoofPredict(args.runtime)
+    failed = 0
+    for model_name in sorted(os.listdir(args.model_dir)):
+        if not model_name.endswith('.pth'):
+            continue
+        model_path = os.path.join(args.model_dir, model_name)
+        output_path = os.path.splitext(model_path)[0] + '.onnx'
+        try:
+            export(model_test, model_path, output_path, args.opset)
+            diff = verify(model_test, onnx_test, model_path, output_path, args.atol)
+            print(f"{model_name} -> {os.path.basename(output_path)} (max diff {diff:.2e})")
+        except Exception as e:
+            failed += 1
+            print(f"Failed to export {model_name}: {e}")
+            if os.path.exists(output_path):
+                os.remove(output_path)
+    raise SystemExit(1 if failed else 0)
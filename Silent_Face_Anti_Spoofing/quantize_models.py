@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Post-training static int8 quantization of the liveness models.
+
+Splits a folder of face images (or ready-made model-sized crops) into a
+calibration part and a held-out evaluation part (``--eval_fraction``), crops
+them the way the server does (RetinaFace box on the original frame and a warped
+crop per model, or the legacy 3:4 resize with --resize_3_4), calibrates each
+model on the first part and reports, on the held-out part only, how often the
+argmax of the quantized models and of the quantized ensemble agrees with fp32,
+and how latency changed. The int8 artifact is written as ``<checkpoint>.int8.pt``
+with the report in ``<checkpoint>.int8.json``; the server only loads it when the
+report passes ANTI_SPOOF_INT8_MIN_AGREEMENT.
+"""
+
+import os
+import time
+import argparse
+import warnings
+
+import cv2
+import numpy as np
+import torch
+
+from src.anti_spoof_predict import AntiSpoofPredict
+from src.generate_patches import CropImage
+from src.inference_compile import compile_model, quantize_model, save_quantized, quantized_path, file_sha1
+from src.utility import parse_model_name
+warnings.filterwarnings('ignore')
+
+DEFAULT_MODELS = ['2.7_80x80_MiniFASNetV2.pth', '4_0_0_80x80_MiniFASNetV1SE.pth']
+# images this small are taken as ready-made model crops rather than frames to detect a face in
+MAX_CROP_SIDE = 128
+
+
+def load_images(model_test, image_dir, resize_3_4=False):
+    """(image, bbox) for every readable image in ``image_dir``; bbox is None for model-sized crops."""
+    samples = []
+    for name in sorted(os.listdir(image_dir)):
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is None:
+            continue
+        if image.shape[0] <= MAX_CROP_SIDE and image.shape[1] <= MAX_CROP_SIDE:
+            samples.append((image, None))
+            continue
+        # same preprocessing as AntiSpoofDetector.detect_spoof
+        if resize_3_4:
+            image = cv2.resize(image, (int(image.shape[0] * 3 / 4), image.shape[0]))
+        samples.append((image, model_test.get_bbox(image)))
+    return samples
+
+
+def split_samples(samples, eval_fraction, seed=0):
+    """(calibration, evaluation) parts of ``samples``, disjoint and the same for every model."""
+    order = np.random.RandomState(seed).permutation(len(samples))
+    n_eval = int(round(len(samples) * eval_fraction))
+    if n_eval < 1 or n_eval >= len(samples):
+        raise SystemExit(f"--eval_fraction {eval_fraction} leaves no calibration or no evaluation "
+                         f"images out of {len(samples)}")
+    return [samples[i] for i in order[n_eval:]], [samples[i] for i in order[:n_eval]]
+
+
+def model_crops(samples, h_input, w_input, scale, resize_3_4=False):
+    """Model-sized crops of ``samples``; ready-made crops of that size are used as-is, others skipped."""
+    image_cropper = CropImage()
+    crop = image_cropper.crop if resize_3_4 else image_cropper.warp_crop
+    crops = []
+    for image, bbox in samples:
+        if bbox is None:
+            if image.shape[:2] == (h_input, w_input):
+                crops.append(image)
+            continue
+        crops.append(crop(image, bbox, scale, w_input, h_input, crop=scale is not None))
+    return crops
+
+
+def to_batches(crops, batch_size):
+    data = torch.from_numpy(np.stack(crops).transpose((0, 3, 1, 2))).float()
+    return [data[i:i + batch_size] for i in range(0, len(data), batch_size)]
+
+
+def run(model, batches):
+    with torch.no_grad():
+        return np.concatenate([torch.softmax(model(batch), dim=1).numpy() for batch in batches])
+
+
+def latency_ms(model, sample, repeat):
+    with torch.no_grad():
+        model(sample)
+        start = time.time()
+        for _ in range(repeat):
+            model(sample)
+    return (time.time() - start) / repeat * 1000
+
+
+if __name__ == "__main__":
+    desc = "int8 quantization of anti-spoof models"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        "--model_dir",
+        type=str,
+        default="./resources/anti_spoof_models",
+        help="directory with the .pth checkpoints (all of them form the reference ensemble)")
+    parser.add_argument(
+        "--calib_dir",
+        type=str,
+        required=True,
+        help="folder of face images or model-sized crops, split into calibration and evaluation")
+    parser.add_argument(
+        "--eval_fraction",
+        type=float,
+        default=0.3,
+        help="share of the images held out from calibration to measure agreement on")
+    parser.add_argument(
+        "--resize_3_4",
+        action="store_true",
+        help="preprocess for the legacy pipeline (server runs with LIVENESS_WARP_CROP=0)")
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=DEFAULT_MODELS,
+        help="checkpoints to quantize")
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="auto",
+        help="quantized engine (fbgemm/x86/qnnpack), 'auto' keeps the fastest one")
+    parser.add_argument(
+        "--min_agreement",
+        type=float,
+        default=0.99,
+        help="ensemble argmax agreement the quantized models must reach")
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=32,
+        help="calibration batch size")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=50,
+        help="forward passes used to time fp32 vs int8")
+    args = parser.parse_args()
+
+    engines = [e for e in ('x86', 'fbgemm', 'qnnpack') if e in torch.backends.quantized.supported_engines]
+    if args.engine != "auto":
+        engines = [args.engine]
+
+    model_test = AntiSpoofPredict(0)
+    samples = load_images(model_test, args.calib_dir, args.resize_3_4)
+    calib_samples, eval_samples = split_samples(samples, args.eval_fraction)
+    print(f"{len(calib_samples)} calibration / {len(eval_samples)} held-out evaluation images")
+    model_names = sorted(f for f in os.listdir(args.model_dir) if f.endswith('.pth'))
+    fp32_probs, int8_probs, chosen = {}, {}, {}
+    for model_name in model_names:
+        model_path = os.path.join(args.model_dir, model_name)
+        h_input, w_input, _, scale = parse_model_name(model_name)
+        calib_crops = model_crops(calib_samples, h_input, w_input, scale, args.resize_3_4)
+        eval_crops = model_crops(eval_samples, h_input, w_input, scale, args.resize_3_4)
+        if not calib_crops:
+            raise SystemExit(f"No usable images in {args.calib_dir} for {model_name}")
+        if len(eval_crops) != len(eval_samples):
+            # the ensemble is compared image by image, so every model must score every held-out image
+            raise SystemExit(f"Ready-made crops in {args.calib_dir} must be {w_input}x{h_input} for {model_name}")
+        batches = to_batches(calib_crops, args.batch_size)
+        eval_batches = to_batches(eval_crops, args.batch_size)
+        model = model_test.registry.get(model_path)
+        fp32_probs[model_name] = run(model, eval_batches)
+        if model_name not in args.models:
+            continue
+
+        # baseline is what the server runs by default: the BatchNorm-folded, frozen fp32 graph
+        fp32_ms = latency_ms(compile_model(model_test._load_model(model_path), h_input, w_input),
+                             batches[0][:1], args.repeat)
+        best = None
+        for engine in engines:
+            try:
+                quantized = quantize_model(model, batches, engine)
+            except Exception as e:
+                print(f"{model_name}: {engine} quantization failed: {e}")
+                continue
+            probs = run(quantized, eval_batches)
+            agreement = float((probs.argmax(axis=1) == fp32_probs[model_name].argmax(axis=1)).mean())
+            int8_ms = latency_ms(quantized, batches[0][:1], args.repeat)
+            print(f"{model_name} [{engine}]: argmax agreement {agreement:.4f}, "
+                  f"latency {fp32_ms:.2f} ms -> {int8_ms:.2f} ms")
+            # prefer accurate candidates, then the fastest one
+            key = (agreement >= args.min_agreement, -int8_ms)
+            if best is None or key > best[0]:
+                best = (key, engine, quantized, probs, agreement, int8_ms)
+        if best is None:
+            continue
+        _, engine, quantized, probs, agreement, int8_ms = best
+        int8_probs[model_name] = probs
+        chosen[model_name] = {
+            'engine': engine, 'model': quantized, 'agreement': agreement,
+            'fp32_ms': fp32_ms, 'int8_ms': int8_ms,
+        }
+
+    # the quantized ensemble substitutes every int8 model for its fp32 original
+    fp32_ensemble = sum(fp32_probs.values()).argmax(axis=1)
+    int8_ensemble = sum(int8_probs.get(name, probs) for name, probs in fp32_probs.items()).argmax(axis=1)
+    ensemble_agreement = float((fp32_ensemble == int8_ensemble).mean())
+    print(f"Ensemble argmax agreement: {ensemble_agreement:.4f} over {len(fp32_ensemble)} samples")
+
+    for model_name, result in chosen.items():
+        model_path = os.path.join(args.model_dir, model_name)
+        report = {
+            'source_sha1': file_sha1(model_path),
+            'torch_version': torch.__version__,
+            'engine': result['engine'],
+            'samples': int(len(fp32_ensemble)),
+            'model_agreement': result['agreement'],
+            'ensemble_agreement': ensemble_agreement,
+            'fp32_ms': round(result['fp32_ms'], 3),
+            'int8_ms': round(result['int8_ms'], 3),
+            'speedup': round(result['fp32_ms'] / result['int8_ms'], 3),
+        }
+        save_quantized(result['model'], model_path, result['engine'], report)
+        passed = ensemble_agreement >= args.min_agreement and report['speedup'] >= 1.0
+        print(f"{model_name} -> {os.path.basename(quantized_path(model_path))} "
+              f"({'PASS' if passed else 'FAIL'}: agreement {ensemble_agreement:.4f}, speedup {report['speedup']:.2f}x, "
+              f"{os.path.getsize(model_path) / 1e6:.2f} MB -> {os.path.getsize(quantized_path(model_path)) / 1e6:.2f} MB)")
@@ -6,9 +6,6 @@
 # @Software : PyCharm
 
 import os
-import traceback
-import cv2
-import math
 import torch
 import numpy as np
 import torch.nn.functional as F
@@ -17,6 +14,9 @@ import torch.nn.functional as F
 from .model_lib.MiniFASNet import MiniFASNetV1, MiniFASNetV2, MiniFASNetV1SE, MiniFASNetV2SE
 from .data_io import transform as trans
 from .utility import get_kernel, parse_model_name
+from .detection import Detection
+from .model_registry import ModelRegistry
+from .inference_compile import load_compiled, load_quantized
 
 
 MODEL_MAPPING = {
@@ -27,38 +27,24 @@ MODEL_MAPPING = {
 }
 
 
-class Detection:
-    def __init__(self):
-        stack=traceback.extract_stack()
-        dirname=os.path.dirname(stack[-2].filename)
-        caffemodel = os.path.join(dirname,'..','resources','detection_model','Widerface-RetinaFace.caffemodel') 
-        deploy =os.path.join(dirname,'..','resources','detection_model','deploy.prototxt') 
-        self.detector = cv2.dnn.readNetFromCaffe(deploy, caffemodel)
-        self.detector_confidence = 0.6
-
-    def get_bbox(self, img):
-        height, width = img.shape[0], img.shape[1]
-        aspect_ratio = width / height
-        if img.shape[1] * img.shape[0] >= 192 * 192:
-            img = cv2.resize(img,
-                             (int(192 * math.sqrt(aspect_ratio)),
-                              int(192 / math.sqrt(aspect_ratio))), interpolation=cv2.INTER_LINEAR)
-
-        blob = cv2.dnn.blobFromImage(img, 1, mean=(104, 117, 123))
-        self.detector.setInput(blob, 'data')
-        out = self.detector.forward('detection_out').squeeze()
-        max_conf_index = np.argmax(out[:, 2])
-        left, top, right, bottom = out[max_conf_index, 3]*width, out[max_conf_index, 4]*height, \
-                                   out[max_conf_index, 5]*width, out[max_conf_index, 6]*height
-        bbox = [int(left), int(top), int(right-left+1), int(bottom-top+1)]
-        return bbox
-
-
 class AntiSpoofPredict(Detection):
-    def __init__(self, device_id):
+    model_extensions = ('.pth',)
+
+    def __init__(self, device_id, model_dir=None, use_compiled=False,
+                 use_quantized=False, min_agreement=0.99, min_speedup=1.0):
         super(AntiSpoofPredict, self).__init__()
         self.device = torch.device("cuda:{}".format(device_id)
                                    if torch.cuda.is_available() else "cpu")
+        # prefer the BatchNorm-folded, frozen TorchScript artifact written by compile_models.py
+        self.use_compiled = use_compiled
+        # int8 variants from quantize_models.py, only when their report passes the accuracy gate
+        self.use_quantized = use_quantized and self.device.type == 'cpu'
+        self.min_agreement = min_agreement
+        self.min_speedup = min_speedup
+        self.registry = ModelRegistry(self._load_model)
+        if model_dir is not None and os.path.isdir(model_dir):
+            # warm the registry so the first request only pays the forward pass
+            self.registry.scan(model_dir, self.model_extensions)
 
     def _load_model(self, model_path):
         try:
@@ -66,12 +52,22 @@ class AntiSpoofPredict(Detection):
             if not os.path.exists(model_path):
                 print(f"Model file {model_path} not found")
                 return None
+
+            if self.use_quantized:
+                quantized = load_quantized(model_path, self.min_agreement, self.min_speedup)
+                if quantized is not None:
+                    return quantized
+
+            if self.use_compiled:
+                compiled = load_compiled(model_path, self.device)
+                if compiled is not None:
+                    return compiled
                 
             # define model
             model_name = os.path.basename(model_path)
             h_input, w_input, model_type, _ = parse_model_name(model_name)
-            self.kernel_size = get_kernel(h_input, w_input,)
-            self.model = MODEL_MAPPING[model_type](conv6_kernel=self.kernel_size).to(self.device)
+            kernel_size = get_kernel(h_input, w_input,)
+            model = MODEL_MAPPING[model_type](conv6_kernel=kernel_size).to(self.device)
 
             # load model weight
             state_dict = torch.load(model_path, map_location=self.device)
@@ -83,44 +79,36 @@ class AntiSpoofPredict(Detection):
                 for key, value in state_dict.items():
                     name_key = key[7:]
                     new_state_dict[name_key] = value
-                self.model.load_state_dict(new_state_dict)
+                model.load_state_dict(new_state_dict)
             else:
-                self.model.load_state_dict(state_dict)
-            return None
+                model.load_state_dict(state_dict)
+            model.eval()
+            return model
         except Exception as e:
             print(f"Error loading model {model_path}: {e}")
             return None
 
     def predict(self, img, model_path):
+        return self.predict_batch([img], model_path)
+
+    def predict_batch(self, imgs, model_path):
+        """Run one forward pass over a list of crops, returning an (N, 3) softmax array."""
         try:
             test_transform = trans.Compose([
                 trans.ToTensor(),
             ])
-            img = test_transform(img)
-            img = img.unsqueeze(0).to(self.device)
+            batch = torch.stack([test_transform(img) for img in imgs]).to(self.device)
             
-            # Load model and check if successful
-            self._load_model(model_path)
-            if self.model is None:
+            # Fetch the resident model, only loading it on first use or file change
+            model = self.registry.get(model_path)
+            if model is None:
                 print(f"Failed to load model {model_path}")
-                return np.zeros((1, 3))  # Return neutral prediction
+                return np.zeros((len(imgs), 3))  # Return neutral prediction
                 
-            self.model.eval()
             with torch.no_grad():
-                result = self.model.forward(img)
-                result = F.softmax(result).cpu().numpy()
+                result = model.forward(batch)
+                result = F.softmax(result, dim=1).cpu().numpy()
             return result
         except Exception as e:
             print(f"Error in prediction: {e}")
-            return np.zeros((1, 3))  # Return neutral prediction
-
-
-
-
-
-
-
-
-
-
-
+            return np.zeros((len(imgs), 3))  # Return neutral prediction
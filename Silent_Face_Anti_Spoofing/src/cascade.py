@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Early-exit cascade over the anti-spoof ensemble. Models run in a fixed order
+(cheapest first); after each stage the averaged softmax of the models run so
+far is compared with that stage's margin, and the remaining models are skipped
+when the live or the spoof probability is past it. Margins are chosen by
+calibrate_cascade.py and stored as ``cascade.json`` in the model directory.
+Shared by the server and the calibration tool so both apply the same rule.
+"""
+
+import os
+import json
+import numpy as np
+
+CASCADE_FILE = 'cascade.json'
+LIVE_LABEL = 1
+MODEL_EXTENSIONS = ('.pth', '.onnx')
+
+
+def model_key(model_name):
+    """``2.7_80x80_MiniFASNetV2.pth`` -> ``2.7_80x80_MiniFASNetV2`` (same key for .pth/.onnx/...)"""
+    name = os.path.basename(model_name)
+    stem, ext = os.path.splitext(name)
+    # model names contain dots themselves ("2.7_..."), so only strip known extensions
+    return stem if ext in MODEL_EXTENSIONS else name
+
+
+def early_exit_label(prediction, models_run, margin):
+    """
+    Label decided by the first ``models_run`` models, or None if the cascade must go on.
+    ``prediction`` is the (1, 3) sum of their softmax outputs.
+    """
+    if margin is None:
+        return None
+    average = prediction[0] / models_run
+    if average[LIVE_LABEL] >= margin:
+        return LIVE_LABEL
+    if 1.0 - average[LIVE_LABEL] >= margin:
+        # spoof: keep whichever spoof class the models lean to, like the full ensemble would
+        spoof = average.copy()
+        spoof[LIVE_LABEL] = -1.0
+        return int(np.argmax(spoof))
+    return None
+
+
+def order_entries(entries, order):
+    """Registry entries sorted by the cascade order; models missing from it run last."""
+    rank = {key: i for i, key in enumerate(order)}
+    return sorted(entries, key=lambda entry: (rank.get(model_key(entry['name']), len(rank)), entry['name']))
+
+
+def load_cascade(path):
+    """``{'order': [...], 'margins': [...]}`` from a calibration file, or None if it is missing/invalid."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            cascade = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not read cascade calibration {path}: {e}")
+        return None
+    if not cascade.get('order') or not isinstance(cascade.get('margins'), list):
+        print(f"Cascade calibration {path} has no order/margins")
+        return None
+    return cascade
+
+
+def simulate(probs, order, margins):
+    """
+    Run the cascade over precomputed per-model probabilities.
+
+    Args:
+        probs: {model key: (N, 3) softmax outputs}
+        order: model keys, cheapest first
+        margins: one margin (or None) per stage except the last
+
+    Returns:
+        (labels, models_run): cascade decision and number of models used per sample
+    """
+    n = len(next(iter(probs.values())))
+    labels = np.zeros(n, dtype=int)
+    models_run = np.zeros(n, dtype=int)
+    for i in range(n):
+        prediction = np.zeros((1, 3))
+        label = None
+        for stage, key in enumerate(order):
+            prediction += probs[key][i]
+            margin = margins[stage] if stage < len(margins) else None
+            label = early_exit_label(prediction, stage + 1, margin)
+            if label is not None:
+                models_run[i] = stage + 1
+                break
+        if label is None:
+            label = int(np.argmax(prediction))
+            models_run[i] = len(order)
+        labels[i] = label
+    return labels, models_run
+
+
+def calibrate_margins(probs, order, target_error, min_margin=0.5):
+    """
+    Greedily pick, stage by stage, the smallest margin (not below ``min_margin``)
+    that keeps the cascade's live/spoof decisions within ``target_error`` of the
+    full ensemble's. A stage that cannot meet it gets None (never exits).
+    """
+    candidates = np.round(np.arange(min_margin, 1.0, 0.005), 3).tolist() + [None]
+    reference = np.stack([probs[key] for key in order]).sum(axis=0).argmax(axis=1) == LIVE_LABEL
+    margins = []
+    for _ in order[:-1]:
+        chosen = None
+        for margin in candidates:
+            labels, _ = simulate(probs, order, margins + [margin])
+            disagreement = float(((labels == LIVE_LABEL) != reference).mean())
+            if disagreement <= target_error:
+                chosen = margin
+                break
+        margins.append(chosen)
+    labels, models_run = simulate(probs, order, margins)
+    report = {
+        'samples': int(len(reference)),
+        'disagreement': float(((labels == LIVE_LABEL) != reference).mean()),
+        'average_models_run': float(models_run.mean()),
+        'early_exit_rate': float((models_run < len(order)).mean()),
+    }
+    return margins, report
+
+
+def save_cascade(path, order, margins, report):
+    with open(path, 'w') as f:
+        json.dump({'order': list(order), 'margins': margins, **report}, f, indent=2)
+    return path
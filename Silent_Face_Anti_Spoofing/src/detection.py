@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+RetinaFace face detector (moved out of anti_spoof_predict.py so that the ONNX
+backend can use it without importing torch)
+"""
+
+import os
+import threading
+import traceback
+import cv2
+import math
+import numpy as np
+
+
+class Detection:
+    def __init__(self):
+        stack=traceback.extract_stack()
+        dirname=os.path.dirname(stack[-2].filename)
+        caffemodel = os.path.join(dirname,'..','resources','detection_model','Widerface-RetinaFace.caffemodel') 
+        deploy =os.path.join(dirname,'..','resources','detection_model','deploy.prototxt') 
+        self.detector = cv2.dnn.readNetFromCaffe(deploy, caffemodel)
+        self.detector_confidence = 0.6
+        # setInput/forward share state on the net, so concurrent callers must serialize
+        self._detector_lock = threading.Lock()
+
+    def get_bbox(self, img):
+        return self.get_bbox_with_confidence(img)[0]
+
+    def get_bbox_with_confidence(self, img, detections=None):
+        """``detections`` is a previous ``detect_raw(img)`` result to reuse."""
+        out, width, height = detections if detections is not None else self._detect(img)
+        max_conf_index = np.argmax(out[:, 2])
+        return self._to_bbox(out[max_conf_index], width, height), float(out[max_conf_index, 2])
+
+    def get_bboxes(self, img, confidence=None, nms_threshold=0.4, detections=None):
+        """
+        Every face scoring at least ``confidence`` (default ``detector_confidence``)
+        after non-maximum suppression, best first, as ``[(bbox, score), ...]``.
+        """
+        if confidence is None:
+            confidence = self.detector_confidence
+        out, width, height = detections if detections is not None else self._detect(img)
+        out = out[out[:, 2] >= confidence]
+        if len(out) == 0:
+            return []
+        bboxes = [self._to_bbox(row, width, height) for row in out]
+        scores = [float(score) for score in out[:, 2]]
+        keep = np.array(cv2.dnn.NMSBoxes(bboxes, scores, confidence, nms_threshold)).flatten()
+        keep = sorted(keep, key=lambda i: -scores[i])
+        return [(bboxes[i], scores[i]) for i in keep]
+
+    @staticmethod
+    def detector_input(img):
+        """The image the detector network sees: about 192x192 px, same aspect ratio."""
+        height, width = img.shape[0], img.shape[1]
+        aspect_ratio = width / height
+        if img.shape[1] * img.shape[0] >= 192 * 192:
+            img = cv2.resize(img,
+                             (int(192 * math.sqrt(aspect_ratio)),
+                              int(192 / math.sqrt(aspect_ratio))), interpolation=cv2.INTER_LINEAR)
+        return img
+
+    def detect_raw(self, img, resized=None):
+        """
+        ``(rows, width, height)`` for the get_bbox* methods' ``detections``;
+        ``resized`` is a previous ``detector_input(img)`` to reuse.
+        """
+        return self._detect(img, resized)
+
+    def _detect(self, img, resized=None):
+        """Raw detection_out rows ``[_, _, score, left, top, right, bottom]`` (relative coordinates)."""
+        height, width = img.shape[0], img.shape[1]
+        if resized is None:
+            resized = self.detector_input(img)
+
+        blob = cv2.dnn.blobFromImage(resized, 1, mean=(104, 117, 123))
+        with self._detector_lock:
+            self.detector.setInput(blob, 'data')
+            out = self.detector.forward('detection_out')
+        return out.reshape(-1, 7), width, height
+
+    @staticmethod
+    def _to_bbox(row, width, height):
+        left, top, right, bottom = row[3]*width, row[4]*height, \
+                                   row[5]*width, row[6]*height
+        return [int(left), int(top), int(right-left+1), int(bottom-top+1)]
@@ -63,3 +63,24 @@ class CropImage:
                           left_top_x: right_bottom_x+1]
             dst_img = cv2.resize(img, (out_w, out_h))
         return dst_img
+
+    def warp_crop(self, org_img, bbox, scale, out_w, out_h, crop=True):
+        """
+        Same patch as ``crop`` taken with a single affine warp: no intermediate
+        copy of the frame or of the box region, whatever the frame size.
+        """
+        src_h, src_w = org_img.shape[:2]
+        if not crop:
+            left_top_x, left_top_y, right_bottom_x, right_bottom_y = 0, 0, src_w-1, src_h-1
+        else:
+            left_top_x, left_top_y, \
+                right_bottom_x, right_bottom_y = self._get_new_box(src_w, src_h, bbox, scale)
+
+        # dst -> src mapping with cv2.resize's pixel-center convention
+        scale_x = (right_bottom_x-left_top_x+1) / out_w
+        scale_y = (right_bottom_y-left_top_y+1) / out_h
+        matrix = np.array([[scale_x, 0, left_top_x+0.5*scale_x-0.5],
+                           [0, scale_y, left_top_y+0.5*scale_y-0.5]], dtype=np.float32)
+        return cv2.warpAffine(org_img, matrix, (out_w, out_h),
+                              flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_REPLICATE)
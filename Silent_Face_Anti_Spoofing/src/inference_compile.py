@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Inference-only compilation of MiniFASNet models: BatchNorm is folded into the
+preceding convolution / linear layer, then the model is traced and frozen with
+torch.jit.freeze. The compiled artifact is cached next to its checkpoint.
+Static int8 variants (quantize_models.py) are stored the same way, together
+with the accuracy report that gates their use.
+"""
+
+import os
+import copy
+import json
+import hashlib
+import torch
+from torch.nn import Identity, Linear, PReLU
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from .model_lib.MiniFASNet import Conv_block, Linear_block, SEModule, MiniFASNet
+
+COMPILED_SUFFIX = '.jit.pt'
+QUANTIZED_SUFFIX = '.int8.pt'
+REPORT_SUFFIX = '.int8.json'
+
+
+def compiled_path(model_path):
+    """``2.7_80x80_MiniFASNetV2.pth`` -> ``2.7_80x80_MiniFASNetV2.jit.pt``"""
+    return os.path.splitext(model_path)[0] + COMPILED_SUFFIX
+
+
+def quantized_path(model_path):
+    """``2.7_80x80_MiniFASNetV2.pth`` -> ``2.7_80x80_MiniFASNetV2.int8.pt``"""
+    return os.path.splitext(model_path)[0] + QUANTIZED_SUFFIX
+
+
+def report_path(model_path):
+    """Accuracy/latency report written by quantize_models.py for the int8 variant."""
+    return os.path.splitext(model_path)[0] + REPORT_SUFFIX
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _fuse_linear_bn(linear, bn):
+    """bn(linear(x)) as a single Linear with bias."""
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    fused = Linear(linear.in_features, linear.out_features, bias=True)
+    fused.weight.data = linear.weight * scale[:, None]
+    bias = linear.bias if linear.bias is not None else torch.zeros_like(bn.running_mean)
+    fused.bias.data = (bias - bn.running_mean) * scale + bn.bias
+    return fused.to(linear.weight.device)
+
+
+@torch.no_grad()
+def fold_batchnorm(model):
+    """Fold every BatchNorm of an eval-mode MiniFASNet into the layer before it, in place."""
+    model.eval()
+    for module in model.modules():
+        if isinstance(module, (Conv_block, Linear_block)):
+            module.conv = fuse_conv_bn_eval(module.conv, module.bn)
+            module.bn = Identity()
+        elif isinstance(module, SEModule):
+            module.fc1 = fuse_conv_bn_eval(module.fc1, module.bn1)
+            module.bn1 = Identity()
+            module.fc2 = fuse_conv_bn_eval(module.fc2, module.bn2)
+            module.bn2 = Identity()
+    if isinstance(model, MiniFASNet) and model.embedding_size != 512:
+        # the head runs linear -> bn -> dropout (a no-op in eval) -> prob
+        model.linear = _fuse_linear_bn(model.linear, model.bn)
+        model.bn = Identity()
+    return model
+
+
+@torch.no_grad()
+def compile_model(model, h_input, w_input):
+    """Fold BatchNorm, trace and freeze. Returns a ScriptModule usable for any batch size."""
+    model = fold_batchnorm(model)
+    example = torch.zeros(1, 3, h_input, w_input, device=next(model.parameters()).device)
+    traced = torch.jit.trace(model, example)
+    # optimize_for_inference is skipped: its prepacked MKLDNN constants cannot be saved
+    return torch.jit.freeze(traced)
+
+
+def save_compiled(compiled, model_path):
+    """Write the artifact next to ``model_path``, stamped with the checkpoint hash and torch version."""
+    path = compiled_path(model_path)
+    extra_files = {'source_sha1': file_sha1(model_path), 'torch_version': torch.__version__}
+    torch.jit.save(compiled, path, _extra_files=extra_files)
+    return path
+
+
+def _load_stamped(path, model_path, device):
+    """torch.jit.load ``path`` if it was built from ``model_path`` with this torch version."""
+    extra_files = {'source_sha1': '', 'torch_version': '', 'engine': ''}
+    model = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    stamp = {key: value.decode() if isinstance(value, bytes) else value for key, value in extra_files.items()}
+    if stamp['source_sha1'] != file_sha1(model_path):
+        print(f"{os.path.basename(path)} is stale, ignoring it")
+        return None
+    if stamp['torch_version'] != torch.__version__:
+        print(f"{os.path.basename(path)} was built with torch {stamp['torch_version']}, ignoring it")
+        return None
+    model.eval()
+    return model
+
+
+def load_compiled(model_path, device):
+    """
+    Load the cached artifact for ``model_path`` if it exists and was built from the same
+    checkpoint with the same torch version, otherwise return None.
+    """
+    path = compiled_path(model_path)
+    if not os.path.exists(path):
+        return None
+    return _load_stamped(path, model_path, device)
+
+
+class FloatPReLU(PReLU):
+    """
+    PReLU that FX quantization leaves in float: the quantized PReLU kernel adds
+    ~40% relative error on MiniFASNet, and a ``None`` qconfig for PReLU is
+    ignored when the graph is lowered. Module mappings match on exact type.
+    """
+
+
+def _keep_prelu_float(module):
+    for name, child in module.named_children():
+        if type(child) is PReLU:
+            replacement = FloatPReLU(child.num_parameters)
+            replacement.weight = child.weight
+            setattr(module, name, replacement)
+        else:
+            _keep_prelu_float(child)
+    return module
+
+
+@torch.no_grad()
+def quantize_model(model, calibration, engine):
+    """
+    Static post-training int8 quantization (FX graph mode) of an eval-mode model.
+    ``calibration`` is a list of NCHW float batches. Returns a frozen ScriptModule.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = engine
+    model = _keep_prelu_float(copy.deepcopy(model).cpu().eval())
+    example = calibration[0][:1]
+    # prepare_fx also fuses Conv-BN(-ReLU) patterns before inserting observers
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), (example,))
+    for batch in calibration:
+        prepared(batch)
+    quantized = convert_fx(prepared)
+    return torch.jit.freeze(torch.jit.trace(quantized, example))
+
+
+def save_quantized(quantized, model_path, engine, report):
+    """Write the int8 artifact and its report next to ``model_path``."""
+    path = quantized_path(model_path)
+    extra_files = {'source_sha1': file_sha1(model_path), 'torch_version': torch.__version__, 'engine': engine}
+    torch.jit.save(quantized, path, _extra_files=extra_files)
+    with open(report_path(model_path), 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def load_quantized(model_path, min_agreement, min_speedup=1.0):
+    """
+    Load the int8 variant of ``model_path`` only if its report shows the quantized
+    ensemble agrees with the fp32 ensemble at least ``min_agreement`` of the time and
+    that it is at least ``min_speedup`` times faster. Returns None otherwise.
+    """
+    path = quantized_path(model_path)
+    if not os.path.exists(path) or not os.path.exists(report_path(model_path)):
+        return None
+    with open(report_path(model_path)) as f:
+        report = json.load(f)
+    if report.get('source_sha1') != file_sha1(model_path):
+        print(f"{os.path.basename(path)} report is stale, ignoring it")
+        return None
+    if report.get('ensemble_agreement', 0.0) < min_agreement:
+        print(f"{os.path.basename(path)} rejected: ensemble agreement "
+              f"{report.get('ensemble_agreement', 0.0):.4f} < {min_agreement}")
+        return None
+    if report.get('speedup', 0.0) < min_speedup:
+        print(f"{os.path.basename(path)} rejected: speedup {report.get('speedup', 0.0):.2f}x < {min_speedup}x")
+        return None
+    engine = report.get('engine')
+    if engine not in torch.backends.quantized.supported_engines:
+        print(f"{os.path.basename(path)} rejected: quantized engine {engine} not supported here")
+        return None
+    torch.backends.quantized.engine = engine
+    return _load_stamped(path, model_path, 'cpu')
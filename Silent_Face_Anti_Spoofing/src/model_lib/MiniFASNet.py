@@ -17,7 +17,8 @@ class L2Norm(Module):
 
 class Flatten(Module):
     def forward(self, input):
-        return input.view(input.size(0), -1)
+        # exports as a single ONNX Flatten op, which cv2.dnn handles with a dynamic batch
+        return torch.flatten(input, 1)
 
 
 class Conv_block(Module):
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Resident model registry shared by the torch and ONNX predictors
+"""
+
+import os
+import time
+import hashlib
+import threading
+
+from .utility import parse_model_name
+
+
+class ModelRegistry:
+    """
+    Keeps every anti-spoof model resident in eval mode, keyed by its parsed
+    spec (h_input, w_input, model_type, scale). A weight file is only reloaded
+    when its mtime/size changes *and* its content hash differs.
+    """
+
+    def __init__(self, loader, check_interval=2.0):
+        self.loader = loader
+        self.check_interval = check_interval
+        self._models = {}
+        self._paths = {}
+        self._dir_state = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _file_digest(model_path):
+        sha1 = hashlib.sha1()
+        with open(model_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def _load(self, model_path, spec, stat):
+        digest = self._file_digest(model_path)
+        entry = self._models.get(spec)
+        if entry is not None and entry['digest'] == digest:
+            # touched but identical weights, keep the resident model
+            entry.update(mtime=stat.st_mtime, size=stat.st_size, checked_at=time.time())
+            return entry
+        model = self.loader(model_path)
+        if model is None:
+            return None
+        entry = {
+            'name': os.path.basename(model_path),
+            'path': model_path,
+            'spec': spec,
+            'model': model,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'digest': digest,
+            'checked_at': time.time(),
+        }
+        self._models[spec] = entry
+        self._paths[model_path] = spec
+        print(f"Loaded anti-spoof model {entry['name']} (sha1 {digest[:8]})")
+        return entry
+
+    def _entry(self, model_path):
+        spec = self._paths.get(model_path)
+        if spec is None:
+            spec = parse_model_name(os.path.basename(model_path))
+        entry = self._models.get(spec)
+        now = time.time()
+        if entry is not None and entry['path'] == model_path \
+                and now - entry['checked_at'] < self.check_interval:
+            return entry
+        stat = os.stat(model_path)
+        if entry is not None and entry['path'] == model_path \
+                and (stat.st_mtime, stat.st_size) == (entry['mtime'], entry['size']):
+            entry['checked_at'] = now
+            return entry
+        return self._load(model_path, spec, stat)
+
+    def get(self, model_path):
+        """Return the resident model for ``model_path``, (re)loading it if needed."""
+        with self._lock:
+            try:
+                entry = self._entry(model_path)
+            except OSError as e:
+                print(f"Model file {model_path} not available: {e}")
+                return None
+            return entry['model'] if entry is not None else None
+
+    def scan(self, model_dir, extensions=('.pth',)):
+        """
+        Return the registry entries for every model file in ``model_dir``.
+        The directory is only re-listed when its mtime changes.
+        """
+        with self._lock:
+            now = time.time()
+            state = self._dir_state.get(model_dir)
+            if state is None or now - state['checked_at'] >= self.check_interval:
+                dir_mtime = os.stat(model_dir).st_mtime
+                if state is None or state['mtime'] != dir_mtime:
+                    names = sorted(f for f in os.listdir(model_dir) if f.endswith(extensions))
+                    state = {'mtime': dir_mtime, 'names': names}
+                state['checked_at'] = now
+                self._dir_state[model_dir] = state
+
+            entries = []
+            for name in state['names']:
+                try:
+                    entry = self._entry(os.path.join(model_dir, name))
+                except (OSError, ValueError, IndexError) as e:
+                    print(f"Skipping model {name}: {e}")
+                    continue
+                if entry is not None:
+                    entries.append(entry)
+            return entries
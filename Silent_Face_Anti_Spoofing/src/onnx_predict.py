@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Torch-free anti-spoof predictor running the exported MiniFASNet ONNX files
+through cv2.dnn or onnxruntime
+"""
+
+import os
+import threading
+import cv2
+import numpy as np
+
+from .detection import Detection
+from .model_registry import ModelRegistry
+
+ONNX_RUNTIMES = ('cv2', 'onnxruntime')
+
+
+def softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def to_blob(imgs):
+    """Same layout as ``transform.ToTensor`` (CHW float, no 0-1 scaling), stacked to NCHW."""
+    return np.ascontiguousarray(np.stack(imgs).transpose((0, 3, 1, 2)), dtype=np.float32)
+
+
+class OnnxAntiSpoofPredict(Detection):
+    model_extensions = ('.onnx',)
+
+    def __init__(self, runtime='cv2', model_dir=None):
+        super(OnnxAntiSpoofPredict, self).__init__()
+        if runtime not in ONNX_RUNTIMES:
+            raise ValueError(f"Unknown ONNX runtime {runtime!r}, expected one of {ONNX_RUNTIMES}")
+        self.runtime = runtime
+        # cv2.dnn nets keep their input on the net object, so forward passes are serialized
+        self._net_lock = threading.Lock()
+        self.registry = ModelRegistry(self._load_model)
+        if model_dir is not None and os.path.isdir(model_dir):
+            self.registry.scan(model_dir, self.model_extensions)
+
+    def _load_model(self, model_path):
+        try:
+            if self.runtime == 'onnxruntime':
+                import onnxruntime as ort
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = int(os.environ.get('OMP_NUM_THREADS', '1'))
+                return ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+            return cv2.dnn.readNetFromONNX(model_path)
+        except Exception as e:
+            print(f"Error loading ONNX model {model_path}: {e}")
+            return None
+
+    def _forward(self, model, blob):
+        if self.runtime == 'onnxruntime':
+            return model.run(None, {model.get_inputs()[0].name: blob})[0]
+        with self._net_lock:
+            model.setInput(blob)
+            return model.forward().copy()
+
+    def predict(self, img, model_path):
+        return self.predict_batch([img], model_path)
+
+    def predict_batch(self, imgs, model_path):
+        """Run one forward pass over a list of crops, returning an (N, 3) softmax array."""
+        try:
+            model = self.registry.get(model_path)
+            if model is None:
+                print(f"Failed to load model {model_path}")
+                return np.zeros((len(imgs), 3))  # Return neutral prediction
+            return softmax(self._forward(model, to_blob(imgs)))
+        except Exception as e:
+            print(f"Error in prediction: {e}")
+            return np.zeros((len(imgs), 3))  # Return neutral prediction
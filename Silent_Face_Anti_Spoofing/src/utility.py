@@ -27,7 +27,8 @@ def get_width_height(patch_info):
 def parse_model_name(model_name):
     info = model_name.split('_')[0:-1]
     h_input, w_input = info[-1].split('x')
-    model_type = model_name.split('.pth')[0].split('_')[-1]
+    # strip any extension (.pth, .onnx, ...) from the trailing model type
+    model_type = model_name.split('_')[-1].split('.')[0]
 
     if info[0] == "org":
         scale = None
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Deadline-aware admission control for the face endpoints.
+
+Every face request gets a Deadline: a time budget (REQUEST_DEADLINE_S, kept
+under gunicorn's --timeout) counted from when the request reached the
+server (X-Request-Start from the proxy when present, else when the app saw
+it; in the asyncio mode, from when the upload has been read). Before any
+work starts, the AdmissionController estimates when the new
+request would finish, from:
+
+* the work already admitted and not finished (in-flight requests, each
+  counted at its endpoint's expected work), shared by ``concurrency``
+  worker threads;
+* the expected work of the new request, an EWMA of the recent per-stage
+  latencies (decode, liveness, encode) its endpoint actually used.
+
+If that lands past the deadline, the request is refused straight away with
+503 and a Retry-After of about the time the in-flight work needs to drain,
+instead of queueing until the worker is killed mid-request and the client
+gets a 502 anyway.
+
+The controller only sees requests the server has accepted. Under gunicorn
+the app therefore runs more threads than ``concurrency`` and admitted
+requests wait for one of ``concurrency`` work slots (``wait_for_slot``),
+so a class-start burst queues where it is counted instead of in the
+listen backlog. Requests still in the backlog when every thread is busy
+are only accounted for through X-Request-Start, so deployments behind a
+proxy should have it set the header.
+
+Admitted requests carry their Deadline into the pipeline (app.g and the
+request Frame). Each stage starts only if its expected latency still fits
+in the remaining budget, and the liveness cascade re-checks between
+models, so a request that falls behind stops early instead of finishing
+work nobody will receive.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+# Expected work (s) of an endpoint before any request of it has been measured
+DEFAULT_WORK_S = 1.0
+STAGES = ("decode", "liveness", "encode")
+
+
+class DeadlineExceeded(Exception):
+    """The request's budget ran out (or would run out) at ``stage``."""
+
+    def __init__(self, stage: str, remaining: float):
+        super().__init__(f"deadline exceeded before {stage} ({remaining * 1000:.0f} ms left)")
+        self.stage = stage
+        self.remaining = remaining
+
+
+class Deadline:
+    """
+    Time budget of one request and the stage latencies it used.
+
+    Args:
+        budget_s: seconds allowed from ``started_at``.
+        started_at: time.time() the request reached the server (default now).
+        estimates: expected seconds per stage name, to refuse starting a stage that cannot finish.
+    """
+
+    __slots__ = ("started_at", "expires_at", "estimates", "stages", "exceeded", "_active")
+
+    def __init__(self, budget_s: float, started_at: Optional[float] = None, estimates: Optional[dict] = None):
+        self.started_at = started_at if started_at is not None else time.time()
+        self.expires_at = self.started_at + budget_s
+        self.estimates = estimates or {}
+        self.stages = {}
+        self.exceeded = None
+        self._active = set()
+
+    def elapsed(self) -> float:
+        return time.time() - self.started_at
+
+    def remaining(self) -> float:
+        return self.expires_at - time.time()
+
+    def check(self, stage: str, needed: float = 0.0):
+        """Raise DeadlineExceeded (and remember the stage) unless ``needed`` seconds are still left."""
+        remaining = self.remaining()
+        if remaining <= needed:
+            self.exceeded = self.exceeded or stage
+            raise DeadlineExceeded(stage, remaining)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a pipeline stage; refuses to start it when its expected latency no longer fits."""
+        if name in self._active:  # nested call of the same stage (e.g. a fallback): timed by the outer one
+            yield
+            return
+        self.check(name, self.estimates.get(name, 0.0))
+        self._active.add(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active.discard(name)
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def work(self) -> float:
+        """Seconds spent in the timed stages."""
+        return sum(self.stages.values())
+
+
+class AdmissionController:
+    """
+    Admit or shed face requests by predicted completion time.
+
+    Args:
+        concurrency (int): requests the server works on in parallel (worker threads).
+        budget_s (float): deadline of a request, from arrival.
+        alpha (float): EWMA weight of the newest latency sample.
+    """
+
+    def __init__(self, concurrency: int = 1, budget_s: float = 25.0, alpha: float = 0.2):
+        self.concurrency = max(1, int(concurrency))
+        self.budget_s = budget_s
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._stage_ewma = {}  # (endpoint, stage) -> seconds
+        self._in_flight = {}  # id(deadline) -> expected work
+        self._slots = threading.Semaphore(self.concurrency)
+        self._working = set()  # id(deadline) of the requests holding a slot
+        self._admitted = 0
+        self._shed = 0
+        self._expired = 0
+
+    def _expected(self, endpoint) -> dict:
+        return {stage: self._stage_ewma[(endpoint, stage)] for stage in STAGES
+                if (endpoint, stage) in self._stage_ewma}
+
+    def expected_work(self, endpoint) -> float:
+        with self._lock:
+            estimates = self._expected(endpoint)
+        return sum(estimates.values()) if estimates else DEFAULT_WORK_S
+
+    def admit(self, endpoint, started_at: Optional[float] = None) -> Tuple[Optional[Deadline], int]:
+        """
+        (Deadline, 0) if ``endpoint`` can be served within the budget, else (None, Retry-After seconds).
+        An admitted request must be passed to ``release`` when it ends.
+        """
+        now = time.time()
+        started_at = min(started_at or now, now)
+        with self._lock:
+            estimates = self._expected(endpoint)
+            work = sum(estimates.values()) if estimates else DEFAULT_WORK_S
+            queued = sum(self._in_flight.values())
+            wait = queued / self.concurrency
+            if (now - started_at) + wait + work > self.budget_s:
+                self._shed += 1
+                return None, max(1, math.ceil(wait))
+            deadline = Deadline(self.budget_s, started_at, estimates)
+            self._in_flight[id(deadline)] = work
+            self._admitted += 1
+            return deadline, 0
+
+    def wait_for_slot(self, deadline: Deadline) -> bool:
+        """
+        Block an admitted request until one of the ``concurrency`` work slots is free.
+        False (and the deadline marked exceeded) if its budget runs out first; ``release`` frees the slot.
+        """
+        remaining = deadline.remaining()
+        if remaining <= 0 or not self._slots.acquire(timeout=remaining):
+            deadline.exceeded = deadline.exceeded or "queue"
+            return False
+        with self._lock:
+            self._working.add(id(deadline))
+        return True
+
+    def retry_after(self) -> int:
+        """Seconds until the work in flight now should have drained (Retry-After)."""
+        with self._lock:
+            return max(1, math.ceil(sum(self._in_flight.values()) / self.concurrency))
+
+    def release(self, endpoint, deadline: Deadline):
+        """Finish an admitted request and fold its stage latencies into the estimates."""
+        with self._lock:
+            self._in_flight.pop(id(deadline), None)
+            if id(deadline) in self._working:
+                self._working.discard(id(deadline))
+                self._slots.release()
+            if deadline.exceeded:
+                self._expired += 1
+            for stage, seconds in deadline.stages.items():
+                key = (endpoint, stage)
+                previous = self._stage_ewma.get(key)
+                self._stage_ewma[key] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "budget_s": self.budget_s,
+                "in_flight": len(self._in_flight),
+                "working": len(self._working),
+                "queued_work_s": round(sum(self._in_flight.values()), 3),
+                "admitted": self._admitted,
+                "shed": self._shed,
+                "deadline_exceeded": self._expired,
+                "stage_ms": {f"{endpoint}.{stage}": round(seconds * 1000, 1)
+                             for (endpoint, stage), seconds in sorted(self._stage_ewma.items())},
+            }
+
+
+def request_start(header_value: Optional[str]) -> Optional[float]:
+    """
+    Arrival time from an ``X-Request-Start`` header (``t=<epoch>`` in seconds,
+    milliseconds or microseconds, as proxies write it), or None.
+    """
+    if not header_value:
+        return None
+    value = header_value.strip()
+    if value.startswith("t="):
+        value = value[2:]
+    try:
+        stamp = float(value)
+    except ValueError:
+        return None
+    for divisor in (1.0, 1e3, 1e6):
+        if stamp / divisor < 1e11:
+            return stamp / divisor
+    return None
@@ -7,17 +7,43 @@ import os
 import cv2
 import numpy as np
 import warnings
-from typing import Tuple
+import threading
+from typing import List, Optional, Tuple
 import time
 
+from admission import DeadlineExceeded
+from face_frame import Frame
+
 # Suppress warnings
 warnings.filterwarnings("ignore")
 
+# "torch" runs the .pth checkpoints, "onnx" runs the files written by
+# Silent_Face_Anti_Spoofing/export_onnx.py without importing torch at all
+ANTI_SPOOF_BACKEND = os.environ.get("ANTI_SPOOF_BACKEND", "torch").lower()
+# "cv2" (cv2.dnn, no extra dependency) or "onnxruntime"
+ANTI_SPOOF_ONNX_RUNTIME = os.environ.get("ANTI_SPOOF_ONNX_RUNTIME", "cv2").lower()
+# Load the BatchNorm-folded, frozen TorchScript artifacts (*.jit.pt) when present
+ANTI_SPOOF_COMPILED = os.environ.get("ANTI_SPOOF_COMPILED", "1") == "1"
+# Load int8 variants (quantize_models.py) only if their report passes this agreement gate
+ANTI_SPOOF_INT8 = os.environ.get("ANTI_SPOOF_INT8", "0") == "1"
+ANTI_SPOOF_INT8_MIN_AGREEMENT = float(os.environ.get("ANTI_SPOOF_INT8_MIN_AGREEMENT", "0.99"))
+# Early-exit cascade: run models cheapest first and stop once past the calibrated
+# margins (Silent_Face_Anti_Spoofing/calibrate_cascade.py writes <model_dir>/cascade.json)
+LIVENESS_CASCADE = os.environ.get("LIVENESS_CASCADE", "0") == "1"
+# Detect on the original frame and take each model's crop with one affine warp from it;
+# "0" restores the legacy whole-frame 3:4 resize before detection and cropping
+LIVENESS_WARP_CROP = os.environ.get("LIVENESS_WARP_CROP", "1") == "1"
+
 # Try importing Silent Face Anti-Spoofing libraries
 try:
-    from Silent_Face_Anti_Spoofing.src.anti_spoof_predict import AntiSpoofPredict
+    if ANTI_SPOOF_BACKEND == "onnx":
+        from Silent_Face_Anti_Spoofing.src.onnx_predict import OnnxAntiSpoofPredict
+    else:
+        from Silent_Face_Anti_Spoofing.src.anti_spoof_predict import AntiSpoofPredict
     from Silent_Face_Anti_Spoofing.src.generate_patches import CropImage
     from Silent_Face_Anti_Spoofing.src.utility import parse_model_name
+    from Silent_Face_Anti_Spoofing.src.cascade import CASCADE_FILE, load_cascade, model_key, order_entries, early_exit_label
+    from inference_scheduler import InferenceScheduler
     ANTI_SPOOF_AVAILABLE = True
     print("✅ Anti-spoof detection libraries loaded successfully")
 except ImportError as e:
@@ -25,6 +51,14 @@ except ImportError as e:
     ANTI_SPOOF_AVAILABLE = False
 
 
+def _onnxruntime_installed() -> bool:
+    try:
+        import onnxruntime  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
 class AntiSpoofDetector:
     """
     Anti-spoof detection using Silent Face Anti-Spoofing models.
@@ -40,6 +74,10 @@ class AntiSpoofDetector:
         self.device_id = device_id
         self.model_test = None
         self.image_cropper = None
+        self.scheduler = None
+        self.cascade = None
+        self.cascade_stats = {"requests": 0, "early_exits": 0, "models_run": 0}
+        self._stats_lock = threading.Lock()
         self.initialized = False
 
         if ANTI_SPOOF_AVAILABLE:
@@ -64,14 +102,196 @@ class AntiSpoofDetector:
                 print("❌ No model files (.onnx or .pth) found!")
                 return
 
-            self.model_test = AntiSpoofPredict(self.device_id)
+            # Loads every model once up front; later requests reuse them
+            self.model_test = self._create_predictor(files)
+            if not self.model_test.registry.scan(self.model_dir, self.model_test.model_extensions):
+                # Stay initialized: liveness checks then deny access instead of being skipped
+                print("❌ None of the anti-spoof models could be loaded, liveness checks will deny access")
             self.image_cropper = CropImage()
+            if os.environ.get("LIVENESS_BATCHING", "0") == "1":
+                self.scheduler = InferenceScheduler(
+                    self.model_test,
+                    window_ms=float(os.environ.get("LIVENESS_BATCH_WINDOW_MS", "8")),
+                    max_batch=int(os.environ.get("LIVENESS_MAX_BATCH", "16")),
+                )
+                print(f"✅ Liveness micro-batching enabled: {self.scheduler.get_stats()}")
+            if LIVENESS_CASCADE:
+                self.cascade = self._load_cascade()
             self.initialized = True
             print("✅ Anti-spoof detection initialized successfully")
         except Exception as e:
             print(f"❌ Failed to initialize anti-spoof detection: {e}")
             self.initialized = False
 
+    def _create_predictor(self, files):
+        """Pick the configured backend, falling back to torch when no .onnx export exists."""
+        torch_options = {
+            "model_dir": self.model_dir,
+            "use_compiled": ANTI_SPOOF_COMPILED,
+            "use_quantized": ANTI_SPOOF_INT8,
+            "min_agreement": ANTI_SPOOF_INT8_MIN_AGREEMENT,
+        }
+        if ANTI_SPOOF_BACKEND == "onnx":
+            if any(f.endswith(".onnx") for f in files):
+                runtime = ANTI_SPOOF_ONNX_RUNTIME
+                if runtime == "onnxruntime" and not _onnxruntime_installed():
+                    # not in requirements.txt; cv2.dnn runs the same files with no extra dependency
+                    print("⚠️ ANTI_SPOOF_ONNX_RUNTIME=onnxruntime but onnxruntime is not installed, using cv2")
+                    runtime = "cv2"
+                print(f"🧠 Using ONNX anti-spoof backend ({runtime})")
+                return OnnxAntiSpoofPredict(runtime, model_dir=self.model_dir)
+            print("⚠️ No .onnx models found (run Silent_Face_Anti_Spoofing/export_onnx.py), falling back to torch")
+            from Silent_Face_Anti_Spoofing.src.anti_spoof_predict import AntiSpoofPredict as TorchPredict
+            return TorchPredict(self.device_id, **torch_options)
+        return AntiSpoofPredict(self.device_id, **torch_options)
+
+    def _load_cascade(self):
+        """
+        Calibrated cascade order/margins. The margins only hold for the order they were
+        calibrated in, so a LIVENESS_CASCADE_ORDER (comma-separated model names) that differs
+        from the calibrated one disables the cascade until it is recalibrated for that order.
+        """
+        path = os.environ.get("LIVENESS_CASCADE_FILE", os.path.join(self.model_dir, CASCADE_FILE))
+        cascade = load_cascade(path)
+        if cascade is None:
+            print(f"⚠️ No cascade calibration at {path} (run Silent_Face_Anti_Spoofing/calibrate_cascade.py), running the full ensemble")
+            return None
+        order = os.environ.get("LIVENESS_CASCADE_ORDER")
+        if order:
+            requested = [model_key(name.strip()) for name in order.split(",") if name.strip()]
+            if requested != [model_key(name) for name in cascade["order"]]:
+                print(f"⚠️ LIVENESS_CASCADE_ORDER {requested} differs from the calibrated order {cascade['order']}; "
+                      f"recalibrate with calibrate_cascade.py --order {' '.join(requested)}. Running the full ensemble")
+                return None
+        print(f"✅ Liveness cascade enabled: order={cascade['order']}, margins={cascade['margins']}")
+        return cascade
+
+    def _crop_for_models(self, frame: Frame, bbox, model_entries) -> dict:
+        """
+        Model-sized crop of the face for each model entry, keyed by model path.
+        Crops are kept on the frame, so a face box that is scored twice is cropped once.
+        """
+        crops = {}
+        for entry in model_entries:
+            h_input, w_input, model_type, scale = entry["spec"]
+
+            # Create parameters like in the working test
+            param = {
+                "org_img": frame.bgr,
+                "bbox": bbox,
+                "scale": scale,
+                "out_w": w_input,
+                "out_h": h_input,
+                "crop": True,  # Boolean like in working test, not the cropper object
+            }
+
+            # Handle scale None case like in working test
+            if scale is None:
+                param["crop"] = False
+
+            cropper = self.image_cropper.warp_crop if LIVENESS_WARP_CROP else self.image_cropper.crop
+            key = ("liveness_crop", tuple(bbox), scale, w_input, h_input, LIVENESS_WARP_CROP)
+            try:
+                crops[entry["path"]] = frame.cached(key, lambda: cropper(**param))
+            except Exception as crop_error:
+                print(f"❌ Error cropping for {entry['name']}: {crop_error}")
+        return crops
+
+    def _predict_faces(self, face_crops: List[dict]) -> List[dict]:
+        """
+        Softmax output per model path for each face, one batched forward per model
+        (shared with concurrent requests when micro-batching is enabled).
+        """
+        if self.scheduler is not None:
+            try:
+                return self.scheduler.predict_many(face_crops)
+            except Exception as batch_error:
+                print(f"❌ Batched liveness prediction failed: {batch_error}")
+                return [{} for _ in face_crops]
+        by_model = {}
+        for index, crops in enumerate(face_crops):
+            for model_path, cropped_img in crops.items():
+                by_model.setdefault(model_path, []).append((index, cropped_img))
+        model_predictions = [{} for _ in face_crops]
+        for model_path, items in by_model.items():
+            probs = self.model_test.predict_batch([cropped_img for _, cropped_img in items], model_path)
+            for row, (index, _) in enumerate(items):
+                model_predictions[index][model_path] = probs[row:row + 1]
+        return model_predictions
+
+    def _score_faces(self, frame: Frame, bboxes: list, model_entries: list):
+        """
+        Run the ensemble (or the cascade) for every face box in ``frame``.
+
+        Returns:
+            (predictions, models_run, early_labels, seconds): per face the summed (1, 3)
+            softmax, how many models ran and the cascade's early label (or None).
+        """
+        predictions = [np.zeros((1, 3)) for _ in bboxes]
+        models_run = [0] * len(bboxes)
+        early_labels = [None] * len(bboxes)
+        test_speed = 0
+
+        # The full ensemble is a single stage; the cascade runs one model per stage
+        cascade = self.cascade
+        if cascade is not None:
+            stages = [[entry] for entry in order_entries(model_entries, cascade["order"])]
+        else:
+            stages = [model_entries]
+
+        pending = list(range(len(bboxes)))
+        for stage, stage_entries in enumerate(stages):
+            # Stop between models once the request can no longer be answered in time
+            if frame.deadline is not None:
+                frame.deadline.check("liveness")
+            # Crop once per model (following the working test pattern)
+            face_crops = [self._crop_for_models(frame, bboxes[i], stage_entries) for i in pending]
+            start_time = time.time()
+            face_predictions = self._predict_faces(face_crops)
+            test_speed += time.time() - start_time
+
+            # Sum the prediction from each single model's result
+            for i, model_predictions in zip(pending, face_predictions):
+                for model_prediction in model_predictions.values():
+                    predictions[i] += model_prediction
+                    models_run[i] += 1
+
+            # Skip the remaining models for faces the models run so far are clear about
+            if cascade is not None and stage < len(stages) - 1:
+                margin = cascade["margins"][stage] if stage < len(cascade["margins"]) else None
+                for i in pending:
+                    if models_run[i]:
+                        early_labels[i] = early_exit_label(predictions[i], models_run[i], margin)
+                pending = [i for i in pending if early_labels[i] is None]
+                if not pending:
+                    break
+
+        if cascade is not None:
+            with self._stats_lock:
+                self.cascade_stats["requests"] += len(bboxes)
+                self.cascade_stats["early_exits"] += sum(label is not None for label in early_labels)
+                self.cascade_stats["models_run"] += sum(models_run)
+        return predictions, models_run, early_labels, test_speed
+
+    @staticmethod
+    def _decide(prediction: np.ndarray, models_run: int, early_label) -> Tuple[bool, float, str]:
+        """Final (is_real, confidence, message) from the summed model outputs."""
+        if early_label is not None:
+            # Average over the models the cascade actually ran
+            label = early_label
+            confidence = prediction[0][label] / models_run
+        else:
+            label = np.argmax(prediction)
+            confidence = prediction[0][label] / 2  # Divide by 2 like in working test
+        is_real = label == 1
+
+        message = (
+            f"Real face detected (score: {confidence:.2f})"
+            if is_real
+            else "Бодит хүн биш байна, Хуурах гэж оролдох хэрэггүй шүү"
+        )
+        return is_real, confidence, message
+
     def check_image_aspect_ratio(self, image: np.ndarray) -> bool:
         """Check if the image has the correct 3:4 aspect ratio."""
         height, width = image.shape[:2]
@@ -87,171 +307,244 @@ class AntiSpoofDetector:
         resized_image = cv2.resize(image, (new_width, height))
         return resized_image
 
-    def detect_spoof(self, image: np.ndarray) -> Tuple[bool, float, str]:
+    def _detection_frame(self, frame: Frame) -> Tuple[Frame, float]:
+        """
+        Frame to detect and crop on, and the factor mapping its x coordinates back to ``frame``.
+        With warp crops that is the original frame itself (the detector downsizes its own copy).
+        """
+        if LIVENESS_WARP_CROP:
+            return frame, 1.0
+        # Resize image to 3:4 aspect ratio (like in the working test)
+        resized = frame.cached("liveness_3x4", lambda: Frame(self.prepare_image_for_detection(frame.bgr), deadline=frame.deadline))
+        return resized, frame.width / resized.width
+
+    def _detections(self, frame: Frame):
+        """
+        Raw detector output for ``frame``, computed once per frame: the multi-face check
+        and its single-face fallback share the detector-sized copy and the forward pass.
+        """
+        def detect():
+            resized = frame.cached("detector_input", lambda: self.model_test.detector_input(frame.bgr))
+            return self.model_test.detect_raw(frame.bgr, resized)
+        return frame.cached("face_detections", detect)
+
+    def detect_spoof(self, image) -> Tuple[bool, float, str]:
         """
         Detect if a face image is real or spoofed.
 
         Args:
-            image (np.ndarray): OpenCV image.
+            image (Frame | np.ndarray): request frame or BGR image.
 
         Returns:
             Tuple[bool, float, str]: (is_real, confidence, message)
         """
+        return self.detect_spoof_with_bbox(image)[:3]
+
+    def detect_spoof_with_bbox(self, image) -> Tuple[bool, float, str, Optional[List[int]]]:
+        """
+        Same as detect_spoof, but also returns the face box found by the liveness
+        detector so recognition can reuse it instead of detecting the face again.
+
+        Args:
+            image (Frame | np.ndarray): request frame or BGR image.
+
+        Returns:
+            Tuple[bool, float, str, Optional[List[int]]]: (is_real, confidence, message, bbox)
+            where bbox is [x, y, w, h] in ``image`` coordinates, or None when no face was located.
+        """
         if not self.is_available():
             print("⚠️ Anti-spoof detection not available, allowing access")
-            return True, 0.5, "Anti-spoof detection not available - access granted"
+            return True, 0.5, "Anti-spoof detection not available - access granted", None
 
         try:
-            # Ensure image is numpy array
-            if not isinstance(image, np.ndarray):
+            # Ensure image is a frame or numpy array
+            if not isinstance(image, (Frame, np.ndarray)):
                 print(f"❌ Invalid image type: {type(image)}")
-                return True, 0.5, "Invalid image format - access granted"
+                return True, 0.5, "Invalid image format - access granted", None
+            frame = Frame.wrap(image)
 
             # Ensure image has correct shape
-            if len(image.shape) != 3 or image.shape[2] != 3:
-                print(f"❌ Invalid image shape: {image.shape}")
-                return True, 0.5, "Invalid image shape - access granted"
+            if len(frame.shape) != 3 or frame.shape[2] != 3:
+                print(f"❌ Invalid image shape: {frame.shape}")
+                return True, 0.5, "Invalid image shape - access granted", None
 
-            # Resize image to 3:4 aspect ratio (like in the working test)
-            height, width = image.shape[:2]
-            new_width = int(height * 3 / 4)
-            resized_image = cv2.resize(image, (new_width, height))
+            detection_frame, x_scale = self._detection_frame(frame)
 
             # Check aspect ratio after resize
-            if not self.check_image_aspect_ratio(resized_image):
+            if not LIVENESS_WARP_CROP and not self.check_image_aspect_ratio(detection_frame.bgr):
                 print("⚠️ Image aspect ratio is not 3:4 after resize")
-                return True, 0.6, "Image aspect ratio warning - access granted"
+                return True, 0.6, "Image aspect ratio warning - access granted", None
 
             # Get face bounding box
             try:
-                image_bbox = self.model_test.get_bbox(resized_image)
+                image_bbox, bbox_confidence = self.model_test.get_bbox_with_confidence(
+                    detection_frame.bgr, detections=self._detections(detection_frame))
                 if image_bbox is None:
                     print("⚠️ No face detected, denying access")
-                    return False, 0.0, "No face detected"
+                    return False, 0.0, "No face detected", None
+                # Only hand confident boxes to recognition; it re-detects otherwise
+                face_location = None
+                if bbox_confidence >= self.model_test.detector_confidence:
+                    # Map the box back from the detection frame to the caller's image
+                    face_location = [
+                        int(round(image_bbox[0] * x_scale)),
+                        int(image_bbox[1]),
+                        int(round(image_bbox[2] * x_scale)),
+                        int(image_bbox[3]),
+                    ]
             except Exception as bbox_error:
                 print(f"❌ Error getting face bbox: {bbox_error}")
-                return True, 0.5, "Face detection error - access granted"
+                return True, 0.5, "Face detection error - access granted", None
 
-            # Load model files
-            model_files = [
-                f for f in os.listdir(self.model_dir)
-                if f.endswith(".pth")  # Only .pth files like in the working test
-            ]
-            if not model_files:
-                print(f"⚠️ No .pth model files found in {self.model_dir}")
+            # Resident models, keyed by their parsed spec; the registry only
+            # re-lists the directory / reloads weights when files change
+            model_entries = self.model_test.registry.scan(self.model_dir, self.model_test.model_extensions)
+            if not model_entries:
+                print(f"⚠️ No {'/'.join(self.model_test.model_extensions)} model files found in {self.model_dir}")
                 print("Available files:", os.listdir(self.model_dir) if os.path.exists(self.model_dir) else "Directory not found")
-                return True, 0.5, "No model files found - access granted"
-
-            print(f"🔍 Found {len(model_files)} model files: {model_files}")
-
-            # Initialize prediction like in the working test
-            prediction = np.zeros((1, 3))
-            test_speed = 0
-            successful_predictions = 0
-
-            # Process each model (following the working test pattern)
-            for model_name in model_files:
-                try:
-                    print(f"🔄 Processing model: {model_name}")
-
-                    # Parse model name to get parameters
-                    parsed_result = parse_model_name(model_name)
-                    if len(parsed_result) == 4:
-                        h_input, w_input, model_type, scale = parsed_result
-                    else:
-                        print(f"❌ Unexpected parse result length: {len(parsed_result)}")
-                        continue
-
-                    # Create parameters like in the working test
-                    param = {
-                        "org_img": resized_image,
-                        "bbox": image_bbox,
-                        "scale": scale,
-                        "out_w": w_input,
-                        "out_h": h_input,
-                        "crop": True,  # Boolean like in working test, not the cropper object
-                    }
-
-                    # Handle scale None case like in working test
-                    if scale is None:
-                        param["crop"] = False
-
-                    # Crop the image first (like in working test)
-                    try:
-                        cropped_img = self.image_cropper.crop(**param)
-                        print(f"📏 Cropped image shape: {cropped_img.shape}")
-
-                        # Make prediction with cropped image and model path (like working test)
-                        model_path = os.path.join(self.model_dir, model_name)
-                        start_time = time.time()
-
-                        # Pass cropped image and model path (like working test)
-                        model_prediction = self.model_test.predict(cropped_img, model_path)
-                        test_speed += time.time() - start_time
-
-                        # Add to total prediction (like working test)
-                        prediction += model_prediction
-                        successful_predictions += 1
-                        print(f"✅ Processed model {model_name} successfully")
-
-                    except Exception as crop_error:
-                        print(f"❌ Error cropping/predicting for {model_name}: {crop_error}")
-                        continue
-
-                except Exception as e:
-                    print(f"❌ Error processing model {model_name}: {e}")
-                    continue
+                return False, 0.0, "No anti-spoof model loaded - access denied", face_location
+
+            # Score the face with every model (or the cascade)
+            predictions, models_run, early_labels, test_speed = self._score_faces(
+                detection_frame, [image_bbox], model_entries
+            )
 
-            if successful_predictions == 0:
-                print("⚠️ No successful model predictions, allowing access")
-                return True, 0.5, "Model prediction failed - access granted"
+            if models_run[0] == 0:
+                print("⚠️ No successful model predictions, denying access")
+                return False, 0.0, "Model prediction failed - access denied", face_location
 
             # Process final prediction (like working test)
             try:
-                label = np.argmax(prediction)
-                confidence = prediction[0][label] / 2  # Divide by 2 like in working test
-                is_real = label == 1
-
-                message = (
-                    f"Real face detected (score: {confidence:.2f})"
-                    if is_real
-                    else "Бодит хүн биш байна, Хуурах гэж оролдох хэрэггүй шүү"
-                )
+                is_real, confidence, message = self._decide(predictions[0], models_run[0], early_labels[0])
 
                 print(f"✅ Anti-spoof detection: {message}")
                 print(f"Prediction cost {test_speed:.2f} s")
-                return is_real, confidence, message
+                return is_real, confidence, message, face_location
 
             except Exception as pred_error:
                 print(f"❌ Error processing prediction: {pred_error}")
-                return True, 0.5, "Prediction processing error - access granted"
+                return True, 0.5, "Prediction processing error - access granted", face_location
 
+        except DeadlineExceeded:
+            # Out of time is not a detection error: never let it grant access
+            raise
         except Exception as e:
             print(f"❌ Error in anti-spoof detection: {e}")
-            return True, 0.5, f"Detection error - access granted: {str(e)}"
+            return True, 0.5, f"Detection error - access granted: {str(e)}", None
+
+    def detect_spoof_faces(self, image) -> List[dict]:
+        """
+        Liveness for every face in the image (all boxes above ``detector_confidence``
+        after NMS), scored in one batched forward per model.
+
+        Args:
+            image (Frame | np.ndarray): request frame or BGR image.
+
+        Returns:
+            List[dict]: best detection first, each with ``bbox`` ([x, y, w, h] in ``image``
+            coordinates), ``detection_confidence``, ``is_real``, ``confidence`` and ``message``.
+            Empty when anti-spoofing is unavailable, no face is found or scoring failed.
+        """
+        if not self.is_available():
+            return []
+        if not isinstance(image, (Frame, np.ndarray)) or len(image.shape) != 3 or image.shape[2] != 3:
+            return []
+        frame = Frame.wrap(image)
+
+        try:
+            # Same detection frame (and detector output) as detect_spoof
+            detection_frame, x_scale = self._detection_frame(frame)
+
+            detections = self.model_test.get_bboxes(detection_frame.bgr, detections=self._detections(detection_frame))
+            model_entries = self.model_test.registry.scan(self.model_dir, self.model_test.model_extensions)
+            if not detections or not model_entries:
+                return []
+
+            bboxes = [bbox for bbox, _ in detections]
+            predictions, models_run, early_labels, test_speed = self._score_faces(detection_frame, bboxes, model_entries)
+
+            faces = []
+            for (bbox, score), prediction, runs, early_label in zip(detections, predictions, models_run, early_labels):
+                if runs == 0:
+                    continue
+                is_real, confidence, message = self._decide(prediction, runs, early_label)
+                faces.append({
+                    "bbox": [int(round(bbox[0] * x_scale)), int(bbox[1]), int(round(bbox[2] * x_scale)), int(bbox[3])],
+                    "detection_confidence": score,
+                    "is_real": bool(is_real),
+                    "confidence": float(confidence),
+                    "message": message,
+                })
+            print(f"✅ Anti-spoof detection: {sum(face['is_real'] for face in faces)}/{len(faces)} live faces, "
+                  f"prediction cost {test_speed:.2f} s")
+            return faces
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"❌ Error in multi-face anti-spoof detection: {e}")
+            return []
 
     def is_available(self) -> bool:
         """Check if anti-spoof detection is available."""
         return self.initialized and ANTI_SPOOF_AVAILABLE
 
+    def get_stats(self) -> dict:
+        """Micro-batching queue/batch-size stats (empty when batching is off) and cascade exit rate."""
+        if self.scheduler is None:
+            stats = {"batching": False}
+        else:
+            stats = {"batching": True, **self.scheduler.get_stats()}
+        if self.cascade is not None:
+            with self._stats_lock:
+                requests = self.cascade_stats["requests"]
+                stats["cascade"] = {
+                    **self.cascade_stats,
+                    "early_exit_rate": self.cascade_stats["early_exits"] / requests if requests else 0.0,
+                    "average_models_run": self.cascade_stats["models_run"] / requests if requests else 0.0,
+                }
+        return stats
+
 
 # Global instance
 anti_spoof_detector = AntiSpoofDetector()
 
 
-def check_face_liveness(image: np.ndarray) -> Tuple[bool, float, str]:
+def check_face_liveness(image, return_bbox: bool = False):
     """
     Check if a face image is live (real) or spoofed.
 
     Args:
-        image (np.ndarray): OpenCV image.
+        image (Frame | np.ndarray): request frame or OpenCV image.
+        return_bbox (bool): Also return the detected face box ([x, y, w, h] or None).
 
     Returns:
-        Tuple[bool, float, str]: (is_live, confidence, message)
+        Tuple[bool, float, str]: (is_live, confidence, message), with the bbox
+        appended when ``return_bbox`` is True.
     """
+    if return_bbox:
+        return anti_spoof_detector.detect_spoof_with_bbox(image)
     return anti_spoof_detector.detect_spoof(image)
 
 
+def check_faces_liveness(image) -> List[dict]:
+    """
+    Check liveness of every face in the image.
+
+    Args:
+        image (Frame | np.ndarray): request frame or OpenCV image.
+
+    Returns:
+        List[dict]: per face, best detection first: bbox, detection_confidence,
+        is_real, confidence and message (empty if no face was scored).
+    """
+    return anti_spoof_detector.detect_spoof_faces(image)
+
+
 def is_anti_spoof_available() -> bool:
     """Check if anti-spoof detection is available."""
     return anti_spoof_detector.is_available()
+
+
+def get_liveness_stats() -> dict:
+    """Get liveness inference stats for tuning under burst load."""
+    return anti_spoof_detector.get_stats()
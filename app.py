@@ -1,12 +1,13 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 import os
 from pymongo import MongoClient
 import numpy as np
-import base64
 from flask_cors import CORS
 import traceback
 import datetime
-from math import radians, cos, sin, sqrt, atan2
+import threading
+import time
+import hmac
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'FACE')
@@ -48,6 +49,8 @@ try:
     if 'logs' not in db.list_collection_names():
         db.create_collection("logs")
 
+    # 1:1 verification looks students up by id: the unique studentId_1 index is created by the
+    # backend's user schema, so it is not (re)declared here with different options
     users_collection = db["users"]
     logs_collection = db["logs"]
     teachers_collection = db["teachers"]
@@ -67,9 +70,126 @@ import face_recognition
 FACE_RECOGNITION_AVAILABLE = True
 print("✅ Face recognition libraries loaded successfully")
 
+from face_index import CollectionGallery, CollectionWatch, EmbeddingIndex, MATCH_THRESHOLD, EMBEDDING_BINARY_FIELD, EMBEDDING_UPDATED_FIELD, FACE_ENCODER_MODEL, FACE_ENCODER_JITTERS, decode_embedding, embedding_document_fields
+from performance_optimizations import TTLCache, cached_face_encoding, store_face_encoding, get_face_encoding_cache_stats
+from face_upload import UploadError, read_face_upload
+from face_frame import Frame
+from admission import AdmissionController, DeadlineExceeded, request_start
+from contextlib import nullcontext
+import face_requests
+from face_requests import run_sync
+
+# Indexes this service relies on, created outside the connect block so that an options conflict with an
+# index the backend already declared cannot take the database connection down with it
+SERVICE_INDEXES = [
+    ('users', EMBEDDING_UPDATED_FIELD),  # student gallery signature: newest re-embedding
+    ('teachers', 'teacherName'),  # teacher login looks teachers up by name
+    ('teachers', EMBEDDING_UPDATED_FIELD),  # teacher gallery signature
+]
+if db is not None:
+    for collection_name, field in SERVICE_INDEXES:
+        try:
+            db[collection_name].create_index(field)
+        except Exception as e:
+            print(f"⚠️ Could not create index {collection_name}.{field}: {e}")
+
+# Face galleries for 1:N matching: loaded once per process, grown on registration,
+# and rebuilt when the collection changes behind our back (checked at most every N seconds)
+STUDENT_INDEX_CHECK_S = float(os.environ.get('STUDENT_INDEX_CHECK_S', '60'))
+TEACHER_GALLERY_CHECK_S = float(os.environ.get('TEACHER_GALLERY_CHECK_S', '30'))
+student_gallery = CollectionGallery(users_collection, 'studentId', 'name', check_s=STUDENT_INDEX_CHECK_S,
+                                    updated_field=EMBEDDING_UPDATED_FIELD, label="Student")
+# Teacher login verifies the face against the named teacher only; set to 1 to search all teachers
+# (1:N) and report a name mismatch separately
+TEACHER_LOGIN_IDENTIFY = os.environ.get('TEACHER_LOGIN_IDENTIFY', '0') == '1'
+teacher_gallery = CollectionGallery(teachers_collection, 'teacherName', 'teacherName',
+                                    check_s=TEACHER_GALLERY_CHECK_S, updated_field=EMBEDDING_UPDATED_FIELD,
+                                    label="Teacher")
+
+# Registration duplicate checks go through a persistent IVF index saved under db/
+# instead of scanning every stored embedding
+DUPLICATE_INDEX = os.environ.get('DUPLICATE_INDEX', '1') == '1'
+DUPLICATE_INDEX_DIR = os.environ.get('DUPLICATE_INDEX_DIR', 'db')
+DUPLICATE_INDEX_NPROBE = int(os.environ.get('DUPLICATE_INDEX_NPROBE', '8'))
+student_duplicates = None
+teacher_duplicates = None
+if DUPLICATE_INDEX:
+    from duplicate_index import DuplicateIndex
+    student_duplicates = DuplicateIndex(users_collection, os.path.join(DUPLICATE_INDEX_DIR, 'students.npz'),
+                                        'studentId', 'name', nprobe=DUPLICATE_INDEX_NPROBE,
+                                        updated_field=EMBEDDING_UPDATED_FIELD, label="Student")
+    teacher_duplicates = DuplicateIndex(teachers_collection, os.path.join(DUPLICATE_INDEX_DIR, 'teachers.npz'),
+                                        'teacherName', 'teacherName', nprobe=DUPLICATE_INDEX_NPROBE,
+                                        updated_field=EMBEDDING_UPDATED_FIELD, label="Teacher")
+
+# Classroom rosters cached per attendance session, so /student/attend can send just the studentId
+CLASSROOM_CACHE = os.environ.get('CLASSROOM_CACHE', '1') == '1'
+classroom_cache = None
+if CLASSROOM_CACHE:
+    from classroom_cache import ClassroomGalleryCache
+    classroom_cache = ClassroomGalleryCache(
+        db,
+        check_s=float(os.environ.get('CLASSROOM_CACHE_CHECK_S', '15')),
+        max_sessions=int(os.environ.get('CLASSROOM_CACHE_MAX', '256')),
+    )
+
+# studentId -> stored template for 1:1 verification (/student/attend, /student/join), so repeat
+# attendees skip the database read. The cache is cleared when the users collection changes
+# (inserts, deletes, re-embeddings: the gallery signature, checked as often as the gallery's),
+# and entries expire after the TTL in any case
+STUDENT_TEMPLATE_CACHE = os.environ.get('STUDENT_TEMPLATE_CACHE', '1') == '1'
+student_templates = TTLCache(
+    maxsize=int(os.environ.get('STUDENT_TEMPLATE_CACHE_SIZE', '4096')),
+    ttl=float(os.environ.get('STUDENT_TEMPLATE_TTL_S', '600')),
+)
+student_template_watch = CollectionWatch(users_collection, check_s=STUDENT_INDEX_CHECK_S,
+                                         updated_field=EMBEDDING_UPDATED_FIELD, label="Student template")
+# teacherName -> stored template for 1:1 teacher login, same policy
+teacher_templates = TTLCache(
+    maxsize=int(os.environ.get('TEACHER_TEMPLATE_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('TEACHER_TEMPLATE_TTL_S', '600')),
+)
+teacher_template_watch = CollectionWatch(teachers_collection, check_s=TEACHER_GALLERY_CHECK_S,
+                                         updated_field=EMBEDDING_UPDATED_FIELD, label="Teacher template")
+
+# Also store embeddings as one float32 Binary blob; readers prefer it over the list of doubles,
+# which is still written for the Node backend (see migrate_embeddings.py)
+EMBEDDING_BINARY_WRITE = os.environ.get('EMBEDDING_BINARY_WRITE', '1') == '1'
+
+def embedding_fields(embedding):
+    """Stored embedding fields of a new registration."""
+    return embedding_document_fields(embedding, binary=EMBEDDING_BINARY_WRITE)
+
+# Keep a small face chip of every registration (off|gridfs|local) so reembed.py can recompute
+# the embeddings when the model or encoding settings change, without asking anyone to re-register
+FACE_CHIP_STORE = os.environ.get('FACE_CHIP_STORE', 'off')
+face_chip_store = None
+if FACE_CHIP_STORE != 'off':
+    from face_chips import CHIP_FIELD, open_chip_store, store_chip
+    face_chip_store = open_chip_store(FACE_CHIP_STORE, db, os.environ.get('FACE_CHIP_DIR', 'db/face_chips'))
+    if face_chip_store is not None:
+        print(f"✅ Face chips stored in {face_chip_store.name}")
+
+def face_chip_fields(collection_name, key, frame, face_location):
+    """``faceChip`` field of a new registration (empty if chips are off or saving fails)."""
+    if face_chip_store is None or face_location is None:
+        return {}
+    try:
+        chip = store_chip(face_chip_store, collection_name, key, Frame.wrap(frame).bgr, face_location)
+        return {CHIP_FIELD: chip} if chip else {}
+    except Exception as e:
+        print(f"⚠️ Could not save face chip for {key}: {e}")
+        return {}
+
+def find_duplicate_face(duplicates, gallery, embedding):
+    """Closest registered face within MATCH_THRESHOLD, from the duplicate index if enabled."""
+    if duplicates is not None:
+        return duplicates.find_duplicate(embedding, MATCH_THRESHOLD)
+    return gallery.get().best_match(embedding, MATCH_THRESHOLD)
+
 # Import anti-spoof detection
 try:
-    from anti_spoof_detector import check_face_liveness, is_anti_spoof_available
+    from anti_spoof_detector import check_face_liveness, check_faces_liveness, is_anti_spoof_available, get_liveness_stats
     ANTI_SPOOF_AVAILABLE = is_anti_spoof_available()
     if ANTI_SPOOF_AVAILABLE:
         print("✅ Anti-spoof detection loaded successfully")
@@ -79,120 +199,246 @@ except ImportError as e:
     print(f"⚠️ Anti-spoof detection not available: {e}")
     ANTI_SPOOF_AVAILABLE = False
 
-def verify_liveness_first(frame):
+# Reuse the liveness detector's face box for recognition instead of running dlib's HOG detector again
+SHARED_FACE_DETECTION = os.environ.get('SHARED_FACE_DETECTION', '1') == '1'
+# Score liveness for every face in the frame and match all live ones (kiosks, group photos)
+MULTI_FACE_DETECTION = os.environ.get('MULTI_FACE_DETECTION', '1') == '1'
+
+def deadline_stage(frame, name):
+    """Timed, deadline-checked stage of the request owning ``frame`` (no-op without a deadline)."""
+    deadline = getattr(frame, 'deadline', None)
+    return deadline.stage(name) if deadline is not None else nullcontext()
+
+def verify_liveness_first(frame, return_face_location=False):
     """
     Check liveness first before any face recognition
-    Returns: (is_live, confidence, message) or raises exception
+    Returns: (is_live, confidence, message) or raises exception.
+    With return_face_location, a face_recognition (top, right, bottom, left)
+    location (or None) is appended for encode_faces.
     """
     if ANTI_SPOOF_AVAILABLE:
         try:
-            is_live, confidence, message = check_face_liveness(frame)
+            with deadline_stage(frame, "liveness"):
+                is_live, confidence, message, bbox = check_face_liveness(frame, return_bbox=True)
             print(f"Liveness check: is_live={is_live}, confidence={confidence:.2f}, message={message}")
+            if return_face_location:
+                return is_live, confidence, message, face_location_from_bbox(frame, bbox)
             return is_live, confidence, message
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Liveness detection error: {e}")
             raise Exception(f"Liveness check failed: {str(e)}")
     else:
         print("Anti-spoof detection not available, skipping liveness check")
+        if return_face_location:
+            return True, 0.5, "Liveness check skipped - not available", None
         return True, 0.5, "Liveness check skipped - not available"
 
-def recognize_face_with_liveness(frame, filter_student_ids=None, check_liveness=True):
+FACE_TOO_SMALL_MESSAGE = "Царай хэт жижиг байна. Камерт ойртож дахин оролдоно уу"
+
+def verify_liveness_faces(frame):
+    """
+    Liveness first, for every face in the frame.
+    Returns: (liveness_result, face_locations) where liveness_result is the
+    (is_live, confidence, message) of the best live face (or of the best face if
+    none is live) and face_locations are the live faces for encode_faces, or
+    None to let face_recognition detect them. Detection over the whole frame is
+    only allowed when no face was scored as a spoof. Raises like verify_liveness_first.
+    """
+    if ANTI_SPOOF_AVAILABLE and MULTI_FACE_DETECTION and SHARED_FACE_DETECTION:
+        with deadline_stage(frame, "liveness"):
+            faces = check_faces_liveness(frame)
+        if faces:
+            live_faces = [face for face in faces if face['is_real']]
+            best = live_faces[0] if live_faces else faces[0]
+            print(f"Liveness check: {len(live_faces)}/{len(faces)} live faces, best confidence={best['confidence']:.2f}")
+            face_locations = [face_location_from_bbox(frame, face['bbox']) for face in live_faces]
+            face_locations = [location for location in face_locations if location is not None]
+            if live_faces and not face_locations and len(live_faces) < len(faces):
+                # Re-detecting over the whole frame would also encode the faces just scored as spoofs
+                print("⚠️ Live faces too small to encode next to non-live faces, rejecting")
+                return (False, best['confidence'], FACE_TOO_SMALL_MESSAGE), None
+            return (best['is_real'], best['confidence'], best['message']), face_locations or None
+    # No confident face (or multi-face off): fall back to the single best box
+    is_live, confidence, message, face_location = verify_liveness_first(frame, return_face_location=True)
+    return (is_live, confidence, message), [face_location] if face_location is not None else None
+
+def face_location_from_bbox(frame, bbox):
+    """
+    Convert the liveness detector's [x, y, w, h] box into face_recognition's
+    (top, right, bottom, left). RetinaFace boxes run from the hairline to the
+    chin, dlib's HOG boxes are square around the eyes, nose and mouth, so the
+    box is squared around its center to keep the landmark fit (and therefore
+    the 0.3 distance threshold) close to what HOG-based enrolment produced.
     """
-    Recognize face with mandatory liveness check first
+    if not SHARED_FACE_DETECTION or bbox is None:
+        return None
+    x, y, w, h = bbox
+    side = (w + h) / 2.0
+    center_x, center_y = x + w / 2.0, y + h / 2.0
+    height, width = frame.shape[:2]
+    top = max(0, int(round(center_y - side / 2)))
+    left = max(0, int(round(center_x - side / 2)))
+    bottom = min(height, int(round(center_y + side / 2)))
+    right = min(width, int(round(center_x + side / 2)))
+    if bottom - top < 20 or right - left < 20:
+        return None
+    return (top, right, bottom, left)
+
+# Memoize face encodings by frame content, so a retried upload skips the dlib encode
+FACE_ENCODING_CACHE = os.environ.get('FACE_ENCODING_CACHE', '1') == '1'
+
+def encode_faces(frame, face_locations=None, return_locations=False):
+    """
+    Face encodings for a Frame (or BGR array), one per face, in a single pass. With known
+    face locations dlib only fits landmarks and computes the embeddings; without
+    them it runs the HOG detector. Results are cached by frame content.
+    With return_locations, returns (encodings, face locations they were computed at).
+    """
+    frame = Frame.wrap(frame)
+    key = frame.hash if FACE_ENCODING_CACHE else None
+    if key is not None:
+        cached = cached_face_encoding(key, face_locations)
+        if cached is not None:
+            return (list(cached[0]), list(cached[1])) if return_locations else list(cached[0])
+
+    with deadline_stage(frame, "encode"):
+        rgb_frame = frame.rgb
+        locations = face_locations or face_recognition.face_locations(rgb_frame)
+        encodings = face_recognition.face_encodings(rgb_frame, known_face_locations=locations,
+                                                    num_jitters=FACE_ENCODER_JITTERS, model=FACE_ENCODER_MODEL)
+    if key is not None:
+        store_face_encoding(key, face_locations, encodings, locations)
+    return (encodings, list(locations)) if return_locations else encodings
+
+def recognize_face_with_liveness(frame, filter_student_ids=None, check_liveness=True, classroom_gallery=None):
+    """
+    Recognize face with mandatory liveness check first.
+    With ``classroom_gallery`` the face is matched against that classroom's cached roster.
     """
     liveness_result = None
+    face_locations = None
     
-    # Always check liveness first if requested
+    # Always check liveness first if requested; only live faces go on to recognition
     if check_liveness:
         try:
-            is_live, confidence, message = verify_liveness_first(frame)
-            liveness_result = (is_live, confidence, message)
+            liveness_result, face_locations = verify_liveness_faces(frame)
+            is_live = liveness_result[0]
             
             # If spoof detected, return early - don't proceed with face recognition
             if not is_live:
                 return "spoof_detected", None, liveness_result
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Liveness detection error: {e}")
             liveness_result = (False, 0.0, f"Liveness check failed: {str(e)}")
             return "spoof_detected", None, liveness_result
     
     # Only proceed with face recognition if liveness passed
-    name, user_data = recognize_face(frame, filter_student_ids)
+    if classroom_gallery is not None:
+        name, user_data = recognize_classroom_face(frame, classroom_gallery, face_locations, filter_student_ids)
+    elif STUDENT_TEMPLATE_CACHE and filter_student_ids and len(filter_student_ids) == 1:
+        name, user_data = verify_student_face(frame, filter_student_ids[0], face_locations)
+    else:
+        name, user_data = recognize_face(frame, filter_student_ids, face_locations)
     return name, user_data, liveness_result
 
-def recognize_teacher_with_liveness(frame, check_liveness=True):
+def recognize_teacher_with_liveness(frame, check_liveness=True, teacher_name=None):
     """
-    Recognize teacher face with mandatory liveness check first
+    Recognize teacher face with mandatory liveness check first.
+    With ``teacher_name`` the face is only verified against that teacher (1:1).
     """
     liveness_result = None
+    face_locations = None
     
-    # Always check liveness first if requested
+    # Always check liveness first if requested; only live faces go on to recognition
     if check_liveness:
         try:
-            is_live, confidence, message = verify_liveness_first(frame)
-            liveness_result = (is_live, confidence, message)
+            liveness_result, face_locations = verify_liveness_faces(frame)
+            is_live = liveness_result[0]
             
             # If spoof detected, return early
             if not is_live:
                 return "spoof_detected", None, liveness_result
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Liveness detection error: {e}")
             liveness_result = (False, 0.0, f"Liveness check failed: {str(e)}")
             return "spoof_detected", None, liveness_result
     
     # Only proceed with teacher recognition if liveness passed
-    name, teacher_data = recognize_teacher_face(frame)
+    if teacher_name is not None:
+        name, teacher_data = verify_teacher_face(frame, teacher_name, face_locations)
+    else:
+        name, teacher_data = recognize_teacher_face(frame, face_locations)
     return name, teacher_data, liveness_result
 
-def recognize_face(frame, filter_student_ids=None):
-    name = "unknown_person"
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    face_encodings = face_recognition.face_encodings(rgb_frame)
+def recognize_face(frame, filter_student_ids=None, face_locations=None):
+    face_encodings = encode_faces(frame, face_locations)
     
     if not face_encodings:
         return "no_persons_found", None
 
-    encoding = face_encodings[0]
-    best_match_user = None
-    best_match_distance = 0.3
+    index = student_gallery.get()
+    if filter_student_ids:
+        # students registered through another process since the index was built
+        student_gallery.fetch_missing(filter_student_ids)
 
-    users = []
-    if users_collection is not None:
-        try:
-            if filter_student_ids:
-                users = list(users_collection.find({
-                    "studentId": { "$in": filter_student_ids }
-                }))
-            else:
-                users = list(users_collection.find())
-        except Exception as e:
-            print(f"Database error during user fetch: {e}")
-    else:
-        print("User collection not available")
-
-    # Compare input face encoding with each user's stored encoding
-    for user in users:
-        try:
-            stored_encoding = np.array(user['embedding'])
-            distance = face_recognition.face_distance([stored_encoding], encoding)[0]
-            
-            if distance < best_match_distance:
-                best_match_distance = distance
-                best_match_user = user
-                name = user['name']
-        except Exception as e:
-            print(f"Error processing user {user.get('name', 'unknown')}: {e}")
-            continue
+    # One vectorized distance computation over every face in the frame and every candidate
+    best_match_user = index.best_match(face_encodings, MATCH_THRESHOLD, keys=filter_student_ids or None)
 
     if best_match_user is None:
         return "unknown_person", None
 
-    return name, best_match_user
+    return best_match_user['name'], best_match_user
+
+def get_student_template(student_id):
+    """(embedding, user fields) of one student from the template cache or the database, or None."""
+    if student_template_watch.changed():
+        student_templates.clear()
+    template = student_templates.get(student_id)
+    if template is not None:
+        return template
+    if users_collection is None:
+        return None
+    try:
+        user = users_collection.find_one(
+            {"studentId": student_id},
+            {"studentId": 1, "name": 1, "embedding": 1, EMBEDDING_BINARY_FIELD: 1})
+    except Exception as e:
+        print(f"Database error during user fetch: {e}")
+        return None
+    embedding = decode_embedding(user) if user else None
+    if embedding is None:
+        # not cached, so a registration right after is seen immediately
+        return None
+    template = (embedding, {"studentId": user["studentId"], "name": user.get("name"), "_id": user["_id"]})
+    student_templates.put(student_id, template)
+    return template
+
+def verify_student_face(frame, student_id, face_locations=None):
+    """1:1 check of the frame's faces against one student's stored template."""
+    face_encodings = encode_faces(frame, face_locations)
+
+    if not face_encodings:
+        return "no_persons_found", None
+
+    template = get_student_template(student_id)
+    if template is None:
+        return "unknown_person", None
+
+    embedding, user = template
+    distance = float(np.linalg.norm(np.asarray(face_encodings, dtype=np.float32) - embedding, axis=1).min())
+    if distance >= MATCH_THRESHOLD:
+        return "unknown_person", None
+
+    return user['name'], dict(user, distance=distance)
 
-def recognize_teacher_face(frame):
-    name = "unknown_teacher"
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    face_encodings = face_recognition.face_encodings(rgb_frame)
+def recognize_teacher_face(frame, face_locations=None):
+    face_encodings = encode_faces(frame, face_locations)
     
     print(f"🔍 Face encodings found: {len(face_encodings)}")
     
@@ -200,81 +446,163 @@ def recognize_teacher_face(frame):
         print("❌ No face encodings found")
         return "no_persons_found", None
 
-    encoding = face_encodings[0]
-    best_match_teacher = None
-    best_match_distance = 0.3
+    index = teacher_gallery.get()
+    best_match_teacher = index.best_match(face_encodings, MATCH_THRESHOLD)
+    print(f"🔍 Matched against {len(index)} teachers")
+
+    if best_match_teacher is None:
+        print("🔍 Final result - no teacher within threshold")
+        return "unknown_teacher", None
+
+    print(f"🔍 Final result - name: {best_match_teacher['teacherName']}, distance: {best_match_teacher['distance']:.4f}")
+    return best_match_teacher['teacherName'], best_match_teacher
+
+def get_teacher_template(teacher_name):
+    """(embedding, teacher fields) of one teacher from the template cache or the database, or None."""
+    if teacher_template_watch.changed():
+        teacher_templates.clear()
+    template = teacher_templates.get(teacher_name)
+    if template is not None:
+        return template
+    if teachers_collection is None:
+        return None
+    try:
+        teacher = teachers_collection.find_one(
+            {"teacherName": teacher_name},
+            {"teacherName": 1, "embedding": 1, EMBEDDING_BINARY_FIELD: 1})
+    except Exception as e:
+        print(f"Database error during teacher fetch: {e}")
+        return None
+    embedding = decode_embedding(teacher) if teacher else None
+    if embedding is None:
+        # not cached, so a registration right after is seen immediately
+        return None
+    template = (embedding, {"teacherName": teacher["teacherName"], "_id": teacher["_id"]})
+    teacher_templates.put(teacher_name, template)
+    return template
+
+def verify_teacher_face(frame, teacher_name, face_locations=None):
+    """1:1 check of the frame's faces against the embedding of ``teacher_name`` only."""
+    face_encodings = encode_faces(frame, face_locations)
 
-    if teachers_collection is not None:
-        try:
-            teachers = list(teachers_collection.find())
-            print(f"🔍 Found {len(teachers)} teachers in database")
-        except Exception as e:
-            print(f"❌ Database error during teacher fetch: {e}")
-            teachers = []
-    else:
-        print("❌ Teachers collection is None")
-        teachers = []
+    if not face_encodings:
+        print("❌ No face encodings found")
+        return "no_persons_found", None
 
-    for i, teacher in enumerate(teachers):
-        try:
-            if 'embedding' not in teacher:
-                print(f"⚠️ Teacher {i} has no embedding")
-                continue
-                
-            stored_encoding = np.array(teacher['embedding'])
-            distance = face_recognition.face_distance([stored_encoding], encoding)[0]
-            print(f"🔍 Teacher {teacher.get('teacherName', 'unknown')} - Distance: {distance:.4f}")
-
-            if distance < best_match_distance:
-                best_match_distance = distance
-                best_match_teacher = teacher
-                name = teacher.get('teacherName', 'unknown_teacher')
-                print(f"✅ New best match: {name} with distance {distance:.4f}")
-                
-        except Exception as e:
-            print(f"❌ Error processing teacher record {i}: {e}")
-            continue
+    # a single indexed lookup of the named teacher (cached), never the whole collection
+    template = get_teacher_template(teacher_name)
+    if template is None:
+        print(f"🔍 No stored face for teacher {teacher_name}")
+        return "unknown_teacher", None
+
+    embedding, teacher = template
+    distance = float(np.linalg.norm(np.asarray(face_encodings, dtype=np.float32) - embedding, axis=1).min())
+    if distance >= MATCH_THRESHOLD:
+        print(f"🔍 Face does not match teacher {teacher_name}")
+        return "unknown_teacher", None
 
-    print(f"🔍 Final result - name: {name}, distance: {best_match_distance:.4f}")
-    return name, best_match_teacher
+    print(f"🔍 Verified teacher {teacher_name} - distance: {distance:.4f}")
+    return teacher['teacherName'], dict(teacher, distance=distance)
 
-def recognize_classroom_face(frame, classroom_students):
+def recognize_classroom_face(frame, classroom_students, face_locations=None, filter_student_ids=None):
     """
-    Recognize face against ONLY the provided classroom students
-    No database queries - uses the student data directly from frontend
+    Recognize face against ONLY the classroom students.
+    ``classroom_students`` is a cached classroom EmbeddingIndex or the student list sent by the frontend.
     """
-    name = "unknown_person"
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    face_encodings = face_recognition.face_encodings(rgb_frame)
+    face_encodings = encode_faces(frame, face_locations)
     
     if not face_encodings:
         return "no_persons_found", None
 
-    encoding = face_encodings[0]
-    best_match_user = None
-    best_match_distance = 0.3
+    gallery = classroom_students
+    if not isinstance(gallery, EmbeddingIndex):
+        gallery = EmbeddingIndex(key_field='studentId', name_field='name').build(
+            student for student in classroom_students if isinstance(student, dict))
 
-    # Work directly with the classroom students data (no database query)
-    for student in classroom_students:
-        try:
-            if not isinstance(student, dict) or 'embedding' not in student:
-                continue
-                
-            stored_encoding = np.array(student['embedding'])
-            distance = face_recognition.face_distance([stored_encoding], encoding)[0]
-            
-            if distance < best_match_distance:
-                best_match_distance = distance
-                best_match_user = student
-                name = student.get('name', student.get('studentId', 'unknown'))
-        except Exception as e:
-            print(f"Error processing student {student.get('studentId', 'unknown')}: {e}")
-            continue
+    best_match_user = gallery.best_match(face_encodings, MATCH_THRESHOLD, keys=filter_student_ids or None)
 
     if best_match_user is None:
         return "unknown_person", None
 
-    return name, best_match_user
+    return best_match_user.get('name') or best_match_user['studentId'], best_match_user
+
+# Face endpoints take the image as a JSON data URL, a multipart ``image`` part or a raw image/jpeg
+# body (see face_upload.py); larger payloads are refused before they are read
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(8 * 1024 * 1024)))
+FACE_ENDPOINTS = {'attend_class', 'student_join', 'register', 'register_teacher', 'login_teacher'}
+
+# Deadline-aware admission (admission.py): a face request that cannot finish within REQUEST_DEADLINE_S
+# of its arrival, given the work already in flight, is refused with 503 + Retry-After before its body
+# is read, and admitted requests stop between stages once they run out of time. Keep the deadline
+# under gunicorn's --timeout. ADMISSION_CONCURRENCY face requests are worked on at a time; the other
+# admitted ones wait in their gunicorn thread (GUNICORN_THREADS, more than this) where the controller
+# counts them. Behind a proxy, have it set X-Request-Start so time spent in the listen backlog counts too.
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '1') == '1'
+REQUEST_DEADLINE_S = float(os.environ.get('REQUEST_DEADLINE_S', '25'))
+admission = AdmissionController(
+    concurrency=int(os.environ.get('ADMISSION_CONCURRENCY', '1')),
+    budget_s=REQUEST_DEADLINE_S,
+) if ADMISSION_CONTROL else None
+OVERLOADED_MESSAGE = "Сервер ачаалалтай байна. Түр хүлээгээд дахин оролдоно уу"
+
+def overloaded_response(retry_after):
+    response = jsonify({"success": False, "message": OVERLOADED_MESSAGE, "retry_after": retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.before_request
+def read_face_request():
+    """Admit face requests and parse their body once, in whichever upload mode the client used."""
+    if request.method != 'POST' or request.endpoint not in FACE_ENDPOINTS:
+        return None
+    if admission is not None:
+        deadline, retry_after = admission.admit(request.endpoint, request_start(request.headers.get('X-Request-Start')))
+        if deadline is None:
+            print(f"🚦 Shedding {request.path}: cannot finish within {REQUEST_DEADLINE_S:.0f}s, retry after {retry_after}s")
+            return overloaded_response(retry_after)
+        g.deadline = deadline
+    try:
+        g.face_upload = read_face_upload(request, MAX_UPLOAD_BYTES)
+    except UploadError as e:
+        print(f"❌ Rejected upload to {request.path}: {e}")
+        return jsonify({"success": False, "message": str(e)}), e.status
+    # the upload is read concurrently; the face work waits for a free slot (shed_expired_request answers 503)
+    deadline = g.get('deadline')
+    if deadline is not None and not admission.wait_for_slot(deadline):
+        return overloaded_response(admission.retry_after())
+    return None
+
+@app.after_request
+def shed_expired_request(response):
+    """The views turn errors into 4xx/5xx answers; a request that ran out of time gets the 503 instead."""
+    deadline = g.get('deadline')
+    if deadline is not None and deadline.exceeded:
+        print(f"⏱️ {request.path} ran out of time at {deadline.exceeded} after {deadline.elapsed():.1f}s")
+        return overloaded_response(admission.retry_after())
+    return response
+
+@app.teardown_request
+def release_admission(exc=None):
+    deadline = g.pop('deadline', None)
+    if deadline is not None:
+        admission.release(request.endpoint, deadline)
+
+# Large JPEGs (phone photos) are decoded at 1/2, 1/4 or 1/8 scale in the DCT domain, keeping the longer
+# side at or above this many pixels; 0 decodes at full resolution
+DECODE_TARGET_SIDE = int(os.environ.get('DECODE_TARGET_SIDE', '960'))
+
+def decode_request_frame(image_data):
+    """
+    Decode the uploaded image once into the Frame every stage of the request shares
+    (Frame.scale is the reduction, original px per frame px). None if undecodable.
+    """
+    deadline = g.get('deadline')
+    with deadline.stage("decode") if deadline is not None else nullcontext():
+        frame = Frame.from_upload(image_data, DECODE_TARGET_SIDE, deadline)
+    if frame is not None and frame.scale > 1:
+        print(f"📉 Decoded at 1/{frame.scale} scale: {frame.width}x{frame.height}")
+    return frame
 
 @app.route('/')
 def index():
@@ -294,649 +622,268 @@ def health():
         "timestamp": datetime.datetime.now().isoformat()
     })
 
-@app.route('/student/attend', methods=['POST', 'OPTIONS'])
-def attend_class():
+@app.route('/stats')
+def stats():
+    return jsonify({
+        "liveness": get_liveness_stats() if ANTI_SPOOF_AVAILABLE else {"batching": False},
+        "classroom_cache": classroom_cache.get_stats() if classroom_cache is not None else None,
+        "student_templates": student_templates.get_stats() if STUDENT_TEMPLATE_CACHE else None,
+        "teacher_templates": teacher_templates.get_stats(),
+        "face_encodings": get_face_encoding_cache_stats() if FACE_ENCODING_CACHE else None,
+        "admission": admission.get_stats() if admission is not None else None,
+        "timestamp": datetime.datetime.now().isoformat()
+    })
+
+@app.route('/attendance/prepare', methods=['POST', 'OPTIONS'])
+def prepare_attendance():
+    """Pre-warm the classroom gallery of a session the teacher just started."""
     if request.method == 'OPTIONS':
         return '', 204
-    try:
-        data = request.get_json()
-        studentId = data.get('studentId')
-        image_base64 = data.get('image_base64')
-        classroom_students = data.get('classroom_students') 
-        attendance_id = data.get('attendance_id')  # NEW: Get attendance session ID
-        
-        # Student location
-        longitude = data.get('longitude')
-        latitude = data.get('latitude')
-        
-        # Fetch teacher location from attendance record in database
-        teacher_latitude = None
-        teacher_longitude = None
-        
-        if attendance_id and db is not None:
-            try:
-                from bson import ObjectId
-                attendance_record = db["attendances"].find_one({"_id": ObjectId(attendance_id)})
-                if attendance_record:
-                    teacher_latitude = attendance_record.get('latitude')
-                    teacher_longitude = attendance_record.get('longitude')
-                    print(f"✅ Retrieved teacher location from attendance record: lat={teacher_latitude}, lon={teacher_longitude}")
-                else:
-                    print(f"⚠️ Attendance record not found for ID: {attendance_id}")
-            except Exception as e:
-                print(f"❌ Error fetching attendance record: {e}")
-        
-        # Fallback: Try to get from request if not in database
-        if teacher_latitude is None or teacher_longitude is None:
-            teacher_latitude = data.get('teacher_latitude')
-            teacher_longitude = data.get('teacher_longitude')
-            print(f"ℹ️ Using teacher location from request: lat={teacher_latitude}, lon={teacher_longitude}")
-
-        # Check for required fields with detailed error messages
-        missing_fields = []
-        if not studentId:
-            missing_fields.append("studentId")
-        if not image_base64:
-            missing_fields.append("image_base64")
-        if not classroom_students:
-            missing_fields.append("classroom_students")
-        if latitude is None:
-            missing_fields.append("student latitude")
-        if longitude is None:
-            missing_fields.append("student longitude")
-        if teacher_latitude is None:
-            missing_fields.append("teacher latitude")
-        if teacher_longitude is None:
-            missing_fields.append("teacher longitude")
-        
-        if missing_fields:
-            print(f"❌ Missing fields: {missing_fields}")
-            if "teacher latitude" in missing_fields or "teacher longitude" in missing_fields:
-                return jsonify({
-                    "success": False, 
-                    "message": "Багшийн байршил олдсонгүй. Багш анги эхлүүлсэн эсэхээ шалгана уу"
-                }), 400
-            elif "student latitude" in missing_fields or "student longitude" in missing_fields:
-                return jsonify({
-                    "success": False, 
-                    "message": "Байршлын мэдээллийн зөвшөөрлийг өгнө үү"
-                }), 400
-            else:
-                return jsonify({
-                    "success": False, 
-                    "message": f"Дутуу мэдээлэл: {', '.join(missing_fields)}"
-                }), 400
-
-        # Extract student IDs for membership check
-        student_ids = [student.get('studentId') for student in classroom_students if isinstance(student, dict)]
-        
-        # Check if student is part of the classroom
-        if studentId not in student_ids:
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": f"Та ангид байхгүй байна. Та эхлээд ангидаа элсээрэй"
-            }), 403
-
-        # Location check with dynamic teacher location
-        def haversine(lat1, lon1, lat2, lon2):
-            R = 6371000  # Earth radius in meters
-            try:
-                phi1, phi2 = radians(lat1), radians(lat2)
-                delta_phi = radians(lat2 - lat1)
-                delta_lambda = radians(lon2 - lon1)
-                a = sin(delta_phi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(delta_lambda / 2) ** 2
-                c = 2 * atan2(sqrt(a), sqrt(1 - a))
-                return R * c
-            except Exception:
-                return float('inf')
-
-        distance = haversine(teacher_latitude, teacher_longitude, latitude, longitude)
-        
-        # Allow 100 meter radius from teacher's location
-        if distance > 100:
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": f"Та одоогоор ангидаа байхгүй байна. Сургуульдаа яваарай (Settings-ээсээ location зөвшөөрөл өгсөн эсэхээ шалгана уу)"
-            }), 403
-
-        # Decode image
-        try:
-            header, encoded = image_base64.split(",", 1)
-            image_bytes = base64.b64decode(encoded)
-            np_arr = np.frombuffer(image_bytes, np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        except Exception:
-            return jsonify({"success": False, "message": "Failed to decode image"}), 400
-
-        if frame is None:
-            return jsonify({"success": False, "message": "Failed to decode image"}), 400
-
-        # Face Recognition with Liveness Detection (liveness checked first)
-        name, matched_user, liveness_result = recognize_face_with_liveness(
-            frame, 
-            filter_student_ids=[studentId], 
-            check_liveness=True
-        )
-        
-        # Check for spoof detection
-        if name == 'spoof_detected':
-            is_live, confidence, message = liveness_result
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": f"{message}",
-                "liveness_check": {
-                    "is_live": bool(is_live),
-                    "confidence": float(confidence),
-                    "message": str(message)
-                }
-            }), 401
-            
-        # No recognizable face in frame
-        if name in ['unknown_person', 'no_persons_found'] or not matched_user:
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": "Ангийн сурагчдын дунд царай танигдаагүй байна"
-            }), 401
-
-        # Face mismatch
-        if matched_user.get('studentId') != studentId:
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": f"Таны бүртгүүлсэн царай болон дугаар таарахгүй байна"
-            }), 403
-
-        # Success
-        response_data = {
-            "success": True,
-            "verified": True,
-            "message": "Student verified successfully",
-            "studentId": studentId,
-            "name": matched_user.get('name', name),
-            "distance_from_teacher": round(distance, 2)  # Optional: include distance in response
-        }
-        
-        # Add liveness check results if available
-        if liveness_result:
-            is_live, confidence, message = liveness_result
-            response_data["liveness_check"] = {
-                "is_live": bool(is_live),
-                "confidence": float(confidence),
-                "message": str(message)
-            }
-        
-        return jsonify(response_data), 200
+    data = request.get_json(force=True, silent=True) or {}
+    attendance_id = data.get('attendance_id')
+    if not attendance_id:
+        return jsonify({"success": False, "message": "Missing attendance_id"}), 400
+    if classroom_cache is None:
+        return jsonify({"success": False, "message": "Classroom cache disabled"}), 404
+
+    session = classroom_cache.prepare(attendance_id)
+    if session is None:
+        return jsonify({"success": False, "message": "Attendance not found"}), 404
+    return jsonify({
+        "success": True,
+        "attendance_id": attendance_id,
+        "students": len(session),
+        "ended": session.ended
+    })
 
+def attendance_location(attendance_id):
+    """Teacher (latitude, longitude) from the attendance record, (None, None) if unknown."""
+    if db is None:
+        return None, None
+    try:
+        from bson import ObjectId
+        attendance_record = db["attendances"].find_one({"_id": ObjectId(attendance_id)}, {"latitude": 1, "longitude": 1})
+        if attendance_record:
+            print(f"✅ Retrieved teacher location from attendance record: lat={attendance_record.get('latitude')}, lon={attendance_record.get('longitude')}")
+            return attendance_record.get('latitude'), attendance_record.get('longitude')
+        print(f"⚠️ Attendance record not found for ID: {attendance_id}")
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            "success": False, 
-            "message": f"Internal Server Error: {str(e)}"
-        }), 500
+        print(f"❌ Error fetching attendance record: {e}")
+    return None, None
 
-@app.route('/student/join', methods=['POST', 'OPTIONS'])
-def student_join():
-    if request.method == 'OPTIONS':
-        return '', 204
-        
-    try:
-        data = request.json
-        studentId = data.get('studentId')
-        image_base64 = data.get('image_base64')
-
-        if not studentId:
-            return jsonify({
-                "success": False,
-                "message": "Missing studentId"
-            }), 400
-            
-        if not image_base64:
-            return jsonify({
-                "success": False,
-                "message": "Missing face image for verification"
-            }), 400
-
-        # Check if student exists in the database
-        existing = users_collection.find_one({"studentId": studentId})
-        if not existing:
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": "Та хараахан бүртгүүлээгүй байна"
-            }), 404
-
-        # Decode the face image from base64
-        try:
-            header, encoded = image_base64.split(",", 1)
-            image_bytes = base64.b64decode(encoded)
-            np_arr = np.frombuffer(image_bytes, np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        except Exception as e:
-            print(f"Image decoding error: {e}")
-            return jsonify({"success": False, "message": f"Failed to decode image: {str(e)}"}), 400
-
-        if frame is None:
-            return jsonify({"success": False, "message": "Decoded image is empty or invalid"}), 400
-
-        # Verify face with liveness check first
-        name, matched_user, liveness_result = recognize_face_with_liveness(frame, filter_student_ids=[studentId], check_liveness=True)
-
-        # Check for spoof detection
-        if name == 'spoof_detected':
-            is_live, confidence, message = liveness_result
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": f"{message}",
-                "liveness_check": {
-                    "is_live": bool(is_live),
-                    "confidence": float(confidence),
-                    "message": str(message)
-                }
-            }), 401
-
-        # If no face is detected or recognized, handle the failure
-        if name == 'no_persons_found':
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": "Өгөгдсөн зурагнаас царай олдсонгүй"
-            }), 400
-        elif name == 'unknown_person':
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": "Царайг таньсангүй"
-            }), 401
-
-        # If face is detected, but the user does not match, handle the mismatch
-        if not matched_user or matched_user.get('studentId') != studentId:
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": "Илэрсэн царай нь өгсөн оюутны дугаартай таарахгүй байна"
-            }), 403
-
-        # If the face matches, return success
-        return jsonify({
-            "success": True,
-            "verified": True,
-            "message": f"Та ангидаа амжилттай элслээ",
-            "name": matched_user.get('name', name)
-        })
+def recognize_student(frame, student_id, classroom_gallery=None):
+    return recognize_face_with_liveness(frame, filter_student_ids=[student_id], check_liveness=True,
+                                        classroom_gallery=classroom_gallery)
 
-    except Exception as e:
-        print(f"General error: {str(e)}")
-        return jsonify({
-            "success": False,
-            "message": f"An error occurred: {str(e)}"
-        }), 500
+def recognize_teacher(frame, teacher_name):
+    # 1:1 against the named teacher unless identify mode is on
+    return recognize_teacher_with_liveness(frame, check_liveness=True,
+                                           teacher_name=None if TEACHER_LOGIN_IDENTIFY else teacher_name)
 
-@app.route('/student/register', methods=['POST', 'OPTIONS'])
-def register():
-    if request.method == 'OPTIONS':
-        return '', 204
-        
-    try:
-        print("Register endpoint called")
-        if not FACE_RECOGNITION_AVAILABLE:
-            print("Face recognition not available")
-            return jsonify({
-                "success": False,
-                "message": "Царай таних боломжгүй. Админтай холбогдоно уу."
-            }), 503
-
-        data = request.get_json(force=True, silent=True)
-        if not data:
-            return jsonify({"success": False, "message": "Invalid or missing JSON data"}), 400
-
-        studentId = data.get('studentId')
-        studentName = data.get('studentName')
-        classrooms = data.get('Classrooms', [])
-        image_base64 = data.get('image_base64')
-
-        if not studentId or not studentName or not image_base64:
-            print("Missing fields in request")
-            return jsonify({"success": False, "message": "Missing required fields"}), 400
-
-        # Check if studentId already exists
-        if users_collection is not None:
-            try:
-                existing_user = users_collection.find_one({"studentId": studentId})
-                if existing_user:
-                    print("User already exists:", studentId)
-                    return jsonify({"success": False, "message": "Өгөгдсөн ID-тай хэрэглэгч аль хэдийн байна"}), 409
-            except Exception as e:
-                print(f"Database error during user check: {e}")
-                return jsonify({"success": False, "message": "Database connection error"}), 500
-
-        # Decode and prepare the image
-        if ',' not in image_base64:
-            print("Invalid image format, missing comma")
-            return jsonify({"success": False, "message": "Invalid image format"}), 400
+def verify_registration_liveness(frame):
+    return verify_liveness_first(frame, return_face_location=True)
 
-        try:
-            header, encoded = image_base64.split(",", 1)
-            image_bytes = base64.b64decode(encoded)
-            np_arr = np.frombuffer(image_bytes, np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        except Exception as e:
-            print(f"Error decoding image: {e}")
-            return jsonify({"success": False, "message": "Failed to decode image"}), 400
+def encode_registration(frame, face_location):
+    """Encodings at the liveness box and the locations they were computed at."""
+    return encode_faces(frame, [face_location] if face_location else None, return_locations=True)
 
-        if frame is None:
-            print("Failed to decode image into frame")
-            return jsonify({"success": False, "message": "Failed to decode image"}), 400
+def find_registration_duplicate(kind, embedding):
+    if kind == 'teacher':
+        return find_duplicate_face(teacher_duplicates, teacher_gallery, embedding)
+    return find_duplicate_face(student_duplicates, student_gallery, embedding)
 
-        # Check for liveness FIRST during registration
-        print(f"Frame shape: {frame.shape}")
-        try:
-            is_live, confidence, message = verify_liveness_first(frame)
-            if not is_live:
-                print(f"Liveness check failed: {message}")
-                return jsonify({
-                    "success": False,
-                    "message": f"{message}",
-                    "liveness_check": {
-                        "is_live": bool(is_live),
-                        "confidence": float(confidence),
-                        "message": str(message)
-                    }
-                }), 400
-            else:
-                print(f"Liveness check passed: {message}")
-        except Exception as e:
-            print(f"Liveness detection error during registration: {e}")
-            return jsonify({
-                "success": False,
-                "message": "Liveness detection failed. Please try again with a live camera feed.",
-                "error": str(e)
-            }), 500
-
-        # Only proceed with face encoding if liveness passed
-        try:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face_encodings = face_recognition.face_encodings(rgb_frame)
-        except Exception as e:
-            print(f"Error during face encoding: {e}")
-            return jsonify({"success": False, "message": "Face recognition failed"}), 500
-
-        if not face_encodings:
-            print("No face detected in image")
-            return jsonify({"success": False, "message": "Зураг дээр ямар ч царай илэрсэнгүй"}), 400
-
-        new_face_encoding = face_encodings[0]
-
-        # Check for duplicate face (find closest match)
-        if users_collection is not None:
-            try:
-                all_users = list(users_collection.find())
-                closest_match = None
-                min_distance = float('inf')
-        
-                for user in all_users:
-                    try:
-                        existing_encoding = np.array(user['embedding'])
-                        distance = face_recognition.face_distance([existing_encoding], new_face_encoding)[0]
-                        if distance < 0.3 and distance < min_distance:
-                            min_distance = distance
-                            closest_match = user
-                    except Exception as inner_e:
-                        print(f"Error comparing face for user {user.get('studentId', 'unknown')}: {inner_e}")
-                        continue
-        
-                if closest_match:
-                    print(f"Duplicate face detected. Closest match with studentId: {closest_match['studentId']} (distance: {min_distance})")
-                    return jsonify({
-                        "success": False,
-                        "message": f"Таны царайг {closest_match['studentId']} дор аль хэдийн бүртгүүлсэн байна."
-                    }), 409
-            except Exception as e:
-                print(f"Error checking duplicate faces: {e}")
-                return jsonify({"success": False, "message": "Error checking duplicate faces"}), 500
-
-        # Save user
-        user_data = {
-            "studentId": studentId,
-            "name": studentName,
-            "Classrooms": [],
-            "embedding": new_face_encoding.tolist(),
-            "created_at": datetime.datetime.now()
-        }
-
-        if users_collection is not None:
-            try:
-                result = users_collection.insert_one(user_data)
-                if not result.inserted_id:
-                    print(f"User {studentName} save returned no inserted_id")
-                    return jsonify({"success": False, "message": "Failed to save user to database"}), 500
-            except Exception as e:
-                print(f"Database error during user save: {e}")
-                return jsonify({"success": False, "message": "Failed to save user to database"}), 500
-        else:
-            print(f"No database connection, user {studentName} not saved")
-            return jsonify({"success": False, "message": "Database not connected"}), 500
-
-        print(f"User {studentName} registered successfully")
-        return jsonify({
-            "success": True,
-            "message": f"Хэрэглэгч {studentName} та амжилттай бүртгүүллээ!"
-        })
+def registered_student(student_id, name, embedding, inserted_id):
+    """Add a saved registration to this process's galleries and caches."""
+    student_gallery.add(student_id, name, embedding, inserted_id)
+    if student_duplicates is not None:
+        student_duplicates.add(student_id, name, embedding, inserted_id)
 
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({"success": False, "message": "Internal Server Error"}), 500
+def registered_teacher(teacher_name, embedding, inserted_id):
+    teacher_gallery.add(teacher_name, teacher_name, embedding, inserted_id)
+    if teacher_duplicates is not None:
+        teacher_duplicates.add(teacher_name, teacher_name, embedding, inserted_id)
 
-@app.route('/teacher/register', methods=['POST','OPTIONS'])
-def register_teacher():
-    if request.method == 'OPTIONS':
-        return '', 204
-    try:
-        data = request.get_json(force=True, silent=True)
-        teacherName = data.get("teacherName")
-        classrooms = data.get("Classrooms", [])
-        image_base64 = data.get("image_base64")
+class FaceIO(face_requests.FaceIO):
+    """I/O of the shared face request handlers (face_requests.py) in the Flask request thread."""
 
-        if not teacherName or not image_base64:
-            return jsonify({"success": False, "message": "Missing required fields"}), 400
+    @property
+    def has_database(self):
+        return users_collection is not None
 
-        if ',' not in image_base64:
-            return jsonify({"success": False, "message": "Invalid image format"}), 400
+    async def decode(self, image_data):
+        return decode_request_frame(image_data)
 
-        try:
-            header, encoded = image_base64.split(",", 1)
-            image_bytes = base64.b64decode(encoded)
-            np_arr = np.frombuffer(image_bytes, np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        except Exception as e:
-            print(f"Image decoding error: {e}")
-            return jsonify({"success": False, "message": "Failed to decode image"}), 400
+    async def classroom_session(self, attendance_id):
+        return classroom_cache.get(attendance_id) if classroom_cache is not None else None
 
-        if frame is None:
-            return jsonify({"success": False, "message": "Failed to decode image"}), 400
+    async def refresh_roster(self, session):
+        return classroom_cache.refresh_roster(session)
 
-        # Check for liveness FIRST during teacher registration
-        try:
-            is_live, confidence, message = verify_liveness_first(frame)
-            if not is_live:
-                print(f"Teacher registration - Liveness check failed: {message}")
-                return jsonify({
-                    "success": False,
-                    "message": f"{message}",
-                    "liveness_check": {
-                        "is_live": bool(is_live),
-                        "confidence": float(confidence),
-                        "message": str(message)
-                    }
-                }), 400
-            else:
-                print(f"Teacher registration - Liveness check passed: {message}")
-        except Exception as e:
-            print(f"Teacher registration - Liveness detection error: {e}")
-            return jsonify({
-                "success": False,
-                "message": "Liveness detection failed. Please try again with a live camera feed.",
-                "error": str(e)
-            }), 500
+    async def attendance_location(self, attendance_id):
+        return attendance_location(attendance_id)
 
-        # Only proceed with face encoding if liveness passed
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        face_encodings = face_recognition.face_encodings(rgb_frame)
+    async def student_exists(self, student_id):
+        return users_collection.find_one({"studentId": student_id}, {"_id": 1}) is not None
 
-        if not face_encodings:
-            return jsonify({"success": False, "message": "Зураг дээр ямар ч царай илэрсэнгүй"}), 400
+    async def teacher_exists(self, teacher_name):
+        return teachers_collection.find_one({"teacherName": teacher_name}, {"_id": 1}) is not None
 
-        new_face_encoding = face_encodings[0]
+    async def recognize_student(self, frame, student_id, classroom_gallery=None):
+        return recognize_student(frame, student_id, classroom_gallery)
 
-        # Check if teacher name already exists
-        if teachers_collection.find_one({"teacherName": teacherName}):
-            return jsonify({"success": False, "message": "Багшийн нэр аль хэдийн бүртгэгдсэн байна"}), 409
+    async def recognize_teacher(self, frame, teacher_name):
+        return recognize_teacher(frame, teacher_name)
 
-        try:
-            existing_teachers = list(teachers_collection.find())
-            closest_match = None
-            min_distance = float('inf')
-            
-            for teacher in existing_teachers:
-                try:
-                    existing_encoding = np.array(teacher['embedding'])
-                    distance = face_recognition.face_distance([existing_encoding], new_face_encoding)[0]
-                    if distance < 0.3 and distance < min_distance:
-                        min_distance = distance
-                        closest_match = teacher
-                except Exception as inner_e:
-                    print(f"Error comparing face for teacher {teacher.get('teacherName', 'unknown')}: {inner_e}")
-                    continue
-            
-            if closest_match:
-                print(f"Duplicate face detected. Closest match with teacher: {closest_match['teacherName']} (distance: {min_distance})")
-                return jsonify({
-                    "success": False,
-                    "message": f"{closest_match['teacherName']} багшийн нэрээр царай бүртгэлтэй байна. Давхар бүртгэл хийх боломжгүй."
-                }), 409
-                
-        except Exception as e:
-            print(f"Error during face duplication check: {e}")
-            return jsonify({"success": False, "message": "Face duplication check failed"}), 500
-            
-        now = datetime.datetime.utcnow()
-        teacher_data = {
-            "teacherName": teacherName,
-            "embedding": new_face_encoding.tolist(),
-            "Classrooms": [],
-            "attendanceHistory": [],
-            "createdAt": now,
-            "updatedAt": now
-        }
+    async def verify_liveness(self, frame):
+        return verify_registration_liveness(frame)
 
-        result = teachers_collection.insert_one(teacher_data)
-        if not result.inserted_id:
-            return jsonify({"success": False, "message": "Failed to save teacher"}), 500
+    async def encode(self, frame, face_location):
+        return encode_registration(frame, face_location)
 
-        return jsonify({
-            "success": True,
-            "message": f"{teacherName} та багшаар амжилттай бүртгүүллээ!"
-        })
+    async def find_duplicate(self, kind, embedding):
+        return find_registration_duplicate(kind, embedding)
 
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({"success": False, "message": "Internal Server Error"}), 500
+    async def save_student(self, student_id, name, embedding, frame, face_location):
+        user_data = face_requests.new_student_document(
+            student_id, name, embedding_fields(embedding), face_chip_fields('users', student_id, frame, face_location))
+        result = users_collection.insert_one(user_data)
+        if result.inserted_id:
+            registered_student(student_id, name, embedding, result.inserted_id)
+        return result.inserted_id
 
-@app.route('/teacher/login', methods=['POST', 'OPTIONS'])
-def login_teacher():
+    async def save_teacher(self, teacher_name, embedding, frame, face_location):
+        teacher_data = face_requests.new_teacher_document(
+            teacher_name, embedding_fields(embedding), face_chip_fields('teachers', teacher_name, frame, face_location))
+        result = teachers_collection.insert_one(teacher_data)
+        if result.inserted_id:
+            registered_teacher(teacher_name, embedding, result.inserted_id)
+        return result.inserted_id
+
+def face_response(handler, *args):
+    """Run a shared face request handler in this thread and answer with its (body, status)."""
+    body, status = run_sync(handler(g.face_upload, FaceIO(), *args))
+    return jsonify(body), status
+
+@app.route('/student/attend', methods=['POST', 'OPTIONS'])
+def attend_class():
     if request.method == 'OPTIONS':
         return '', 204
-    try:
-        data = request.get_json()
-        teacherName = data.get("teacherName")
-        image_base64 = data.get("image_base64")
+    return face_response(face_requests.attend_class)
 
-        if not teacherName or not image_base64:
-            print(f"❌ Missing fields - teacherName: {bool(teacherName)}, image: {bool(image_base64)}")
-            return jsonify({"success": False, "message": "Missing required fields"}), 400
+@app.route('/student/join', methods=['POST', 'OPTIONS'])
+def student_join():
+    if request.method == 'OPTIONS':
+        return '', 204
+    return face_response(face_requests.student_join)
 
-        # Decode image
-        try:
-            header, encoded = image_base64.split(",", 1)
-            image_bytes = base64.b64decode(encoded)
-            np_arr = np.frombuffer(image_bytes, np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        except Exception as e:
-            print(f"❌ Image decoding error: {e}")
-            return jsonify({"success": False, "message": "Failed to decode image"}), 400
-
-        if frame is None:
-            print("❌ Frame is None after decoding")
-            return jsonify({"success": False, "message": "Failed to decode image"}), 400
-
-        # Teacher login with liveness check first
-        print("👤 Running teacher login with liveness check...")
-        name, matched_teacher, liveness_result = recognize_teacher_with_liveness(frame, check_liveness=True)
-        print(f"👤 Teacher recognition result - name: {name}, matched_teacher: {bool(matched_teacher)}")
-
-        # Check for spoof detection
-        if name == 'spoof_detected':
-            is_live, confidence, message = liveness_result
-            print(f"❌ Teacher login - spoof detected")
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": f"{message}",
-                "liveness_check": {
-                    "is_live": bool(is_live),
-                    "confidence": float(confidence),
-                    "message": str(message)
-                }
-            }), 401
-
-        if name in ['unknown_teacher', 'no_persons_found']:
-            print(f"❌ Face not recognized - returning 401")
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": "Ийм царай олдсонгүй"
-            }), 401
-
-        # Check teacher name match
-        print(f"🔍 Checking teacher name match: provided={teacherName}, matched={matched_teacher.get('teacherName', 'None')}")
-        if matched_teacher['teacherName'] != teacherName:
-            print(f"❌ Teacher name mismatch - returning 403")
-            return jsonify({
-                "success": False,
-                "verified": False,
-                "message": "Царай нь заасан багшийн нэртэй таарахгүй байна"
-            }), 403
-
-        print(f"✅ Login successful for {teacherName}")
-        response_data = {
-            "success": True,
-            "verified": True,
-            "teacherId": str(matched_teacher['_id']), 
-            "teacherName": matched_teacher['teacherName'],
-            "message": f"Тавтай морил, {matched_teacher['teacherName']}!"
-        }
-
-        # Add liveness check results
-        if liveness_result:
-            is_live, confidence, message = liveness_result
-            response_data["liveness_check"] = {
-                "is_live": bool(is_live),
-                "confidence": float(confidence),
-                "message": str(message)
-            }
-
-        return jsonify(response_data)
+@app.route('/student/register', methods=['POST', 'OPTIONS'])
+def register():
+    if request.method == 'OPTIONS':
+        return '', 204
+    print("Register endpoint called")
+    return face_response(face_requests.register_student, FACE_RECOGNITION_AVAILABLE)
+
+# Bulk enrolment (semester onboarding) is admin-only: set BULK_ENROLL_TOKEN and send it as X-Admin-Token
+BULK_ENROLL_TOKEN = os.environ.get('BULK_ENROLL_TOKEN')
+BULK_ENROLL_WORKERS = int(os.environ.get('BULK_ENROLL_WORKERS', str(os.cpu_count() or 1)))
+# finished jobs (and their reports) are kept this long for polling, then dropped
+BULK_JOB_TTL_S = float(os.environ.get('BULK_JOB_TTL_S', '3600'))
+_bulk_jobs = {}
+_bulk_jobs_finished = {}  # job_id -> time.time() the job ended
+_bulk_jobs_lock = threading.Lock()
+
+def _is_bulk_admin():
+    token = request.headers.get('X-Admin-Token', '')
+    # constant-time comparison, so the token cannot be guessed byte by byte from response times
+    return bool(BULK_ENROLL_TOKEN) and hmac.compare_digest(token.encode('utf-8'), BULK_ENROLL_TOKEN.encode('utf-8'))
+
+def _prune_bulk_jobs():
+    """Forget jobs that finished more than BULK_JOB_TTL_S ago."""
+    cutoff = time.time() - BULK_JOB_TTL_S
+    with _bulk_jobs_lock:
+        for job_id in [job_id for job_id, finished in _bulk_jobs_finished.items() if finished < cutoff]:
+            _bulk_jobs_finished.pop(job_id, None)
+            _bulk_jobs.pop(job_id, None)
+
+def _run_bulk_enrolment(job_id, roster_path, images_path, dry_run):
+    import shutil
+    from bulk_enroll import enroll, load_roster, summarize
+    job = _bulk_jobs[job_id]
+
+    def progress(stage, done, total):
+        job.update(stage=stage, done=done, total=total)
 
+    try:
+        report = enroll(load_roster(roster_path), images_path, users_collection, BULK_ENROLL_WORKERS,
+                        dry_run=dry_run, binary_embeddings=EMBEDDING_BINARY_WRITE, progress=progress)
+        job.update(status="done", stage="done", summary=summarize(report), report=report)
+        # the galleries pick the new students up on their next check
+        student_gallery.invalidate()
     except Exception as e:
-        print(f"❌ Exception in teacher login: {e}")
         traceback.print_exc()
-        return jsonify({"success": False, "message": "Internal Server Error"}), 500
+        job.update(status="failed", error=str(e))
+    finally:
+        job["finished_at"] = datetime.datetime.now().isoformat()
+        with _bulk_jobs_lock:
+            _bulk_jobs_finished[job_id] = time.time()
+        shutil.rmtree(os.path.dirname(roster_path), ignore_errors=True)
+
+@app.route('/student/register/bulk', methods=['POST', 'OPTIONS'])
+def register_students_bulk():
+    """
+    multipart/form-data: ``roster`` (CSV studentId,name[,image]) and ``images`` (ZIP).
+    Runs in the background; poll GET /student/register/bulk/<job_id> for the per-row report.
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+    if not _is_bulk_admin():
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+    if users_collection is None:
+        return jsonify({"success": False, "message": "Database not connected"}), 500
+
+    roster = request.files.get('roster')
+    images = request.files.get('images')
+    if roster is None or images is None:
+        return jsonify({"success": False, "message": "Missing roster or images"}), 400
+
+    import tempfile
+    import uuid
+    workdir = tempfile.mkdtemp(prefix="bulk_enroll_")
+    roster_path = os.path.join(workdir, "roster.csv")
+    images_path = os.path.join(workdir, "images.zip")
+    roster.save(roster_path)
+    images.save(images_path)
+
+    _prune_bulk_jobs()
+    job_id = uuid.uuid4().hex
+    dry_run = request.form.get('dry_run', '0') == '1'
+    _bulk_jobs[job_id] = {"status": "running", "stage": "queued", "done": 0, "total": 0,
+                          "dry_run": dry_run, "started_at": datetime.datetime.now().isoformat()}
+    threading.Thread(target=_run_bulk_enrolment, args=(job_id, roster_path, images_path, dry_run),
+                     name=f"bulk-enroll-{job_id[:8]}", daemon=True).start()
+    return jsonify({"success": True, "job_id": job_id}), 202
+
+@app.route('/student/register/bulk/<job_id>', methods=['GET'])
+def register_students_bulk_status(job_id):
+    if not _is_bulk_admin():
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+    _prune_bulk_jobs()
+    job = _bulk_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Unknown job"}), 404
+    return jsonify({"success": job["status"] != "failed", "job_id": job_id, **job})
+
+@app.route('/teacher/register', methods=['POST','OPTIONS'])
+def register_teacher():
+    if request.method == 'OPTIONS':
+        return '', 204
+    return face_response(face_requests.register_teacher)
+
+@app.route('/teacher/login', methods=['POST', 'OPTIONS'])
+def login_teacher():
+    if request.method == 'OPTIONS':
+        return '', 204
+    return face_response(face_requests.login_teacher)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
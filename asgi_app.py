@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio serving mode for the face endpoints.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 8080      (or SERVER_MODE=asgi ./start.sh)
+
+Same endpoints as the Flask app (app.py), whose galleries, caches, liveness
+and recognition code it reuses. The request logic itself (validation, messages,
+status codes) is the shared face_requests.py; this module only supplies its
+I/O (AsyncFaceIO). The difference is where a request waits:
+
+* the upload is read by the event loop, so a student on a slow connection
+  costs a socket, not a worker thread;
+* per-request MongoDB reads and writes go through Motor (async pymongo);
+* decoding, liveness, encoding and matching run on a bounded thread pool
+  (FACE_EXECUTOR_WORKERS, default one per CPU); dlib, OpenCV and the model
+  runtimes release the GIL, so they overlap like gunicorn threads would;
+* cache refreshes that may hit MongoDB through the shared sync galleries run on
+  the loop's default executor.
+
+Uploads use the same parser as app.py (face_upload.py), fed from a body read
+asynchronously with the MAX_UPLOAD_BYTES limit applied while reading.
+
+Admission control (admission.py) works as in app.py, with the executor
+threads as the concurrency, except that a request is admitted once its body
+has been read: an upload only costs a socket here, so its transfer time does
+not count against the deadline and uploads still arriving are not counted as
+queued work.
+"""
+
+import asyncio
+import datetime
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from functools import partial
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.wrappers import Request as WerkzeugRequest
+
+import app as core
+import face_requests
+from admission import AdmissionController
+from face_frame import Frame
+from face_upload import UploadError, read_face_upload
+
+FACE_EXECUTOR_WORKERS = int(os.environ.get('FACE_EXECUTOR_WORKERS', str(os.cpu_count() or 1)))
+face_executor = ThreadPoolExecutor(max_workers=FACE_EXECUTOR_WORKERS, thread_name_prefix="face")
+admission = AdmissionController(
+    concurrency=FACE_EXECUTOR_WORKERS, budget_s=core.REQUEST_DEADLINE_S) if core.ADMISSION_CONTROL else None
+
+CORS_ORIGINS = [
+    "http://localhost:3000",
+    "http://127.0.0.1:3000",
+    "https://myrmidons-pinequest-frontend-delta.vercel.app",
+    "https://myrmidons-pinequest-production.up.railway.app"
+]
+
+mongo = None
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global mongo
+    if core.db is not None:
+        client = AsyncIOMotorClient(core.mongodb_uri, tls=True, tlsAllowInvalidCertificates=True,
+                                    tlsAllowInvalidHostnames=True, serverSelectionTimeoutMS=5000)
+        mongo = client[core.db.name]
+        print(f"✅ Async MongoDB client ready, {FACE_EXECUTOR_WORKERS} face executor threads")
+    yield
+    if mongo is not None:
+        mongo.client.close()
+    face_executor.shutdown(wait=False)
+
+
+async def run_face(fn, *args, **kwargs):
+    """Run a CPU stage (decode, liveness, encoding, matching) on the face executor."""
+    return await asyncio.get_running_loop().run_in_executor(face_executor, partial(fn, *args, **kwargs))
+
+
+async def run_io(fn, *args, **kwargs):
+    """Run a sync call that may wait on MongoDB (shared caches) on the default executor."""
+    return await asyncio.get_running_loop().run_in_executor(None, partial(fn, *args, **kwargs))
+
+
+def json_response(content, status=200):
+    return JSONResponse(content, status_code=status)
+
+
+async def read_upload(request):
+    """
+    Read the body without blocking a thread, enforcing MAX_UPLOAD_BYTES as it arrives,
+    then parse it with the same code as the Flask app.
+    """
+    max_bytes = core.MAX_UPLOAD_BYTES
+    length = request.headers.get('content-length')
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        raise UploadError(f"Upload exceeds {max_bytes // 1024} KB", 413)
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise UploadError(f"Upload exceeds {max_bytes // 1024} KB", 413)
+
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'PATH_INFO': request.url.path,
+        'QUERY_STRING': request.url.query,
+        'CONTENT_TYPE': request.headers.get('content-type', ''),
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_NAME': 'asgi',
+        'SERVER_PORT': '0',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.url_scheme': request.url.scheme,
+    }
+    for name, value in request.headers.items():
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+            environ[key] = value
+    return read_face_upload(WerkzeugRequest(environ), max_bytes)
+
+
+def overloaded_response(retry_after):
+    return JSONResponse({"success": False, "message": core.OVERLOADED_MESSAGE, "retry_after": retry_after},
+                        status_code=503, headers={"Retry-After": str(retry_after)})
+
+
+def face_endpoint(handler):
+    """
+    OPTIONS preflight, admission and upload parsing shared by the face endpoints
+    (app.read_face_request and app.shed_expired_request).
+    """
+    async def endpoint(request):
+        if request.method == 'OPTIONS':
+            return Response(status_code=204)
+        try:
+            upload = await read_upload(request)
+        except UploadError as e:
+            print(f"❌ Rejected upload to {request.url.path}: {e}")
+            return json_response({"success": False, "message": str(e)}, e.status)
+        # the deadline starts with the face work, not with the upload
+        deadline = None
+        if admission is not None:
+            deadline, retry_after = admission.admit(handler.__name__)
+            if deadline is None:
+                print(f"🚦 Shedding {request.url.path}: cannot finish within {core.REQUEST_DEADLINE_S:.0f}s, retry after {retry_after}s")
+                return overloaded_response(retry_after)
+        request.state.deadline = deadline
+        try:
+            body, status = await handler(request, upload)
+            if deadline is not None and deadline.exceeded:
+                print(f"⏱️ {request.url.path} ran out of time at {deadline.exceeded} after {deadline.elapsed():.1f}s")
+                return overloaded_response(admission.retry_after())
+            return json_response(body, status)
+        finally:
+            if deadline is not None:
+                admission.release(handler.__name__, deadline)
+    return endpoint
+
+
+def decode_frame(image_data, deadline):
+    with deadline.stage("decode") if deadline is not None else nullcontext():
+        return Frame.from_upload(image_data, core.DECODE_TARGET_SIDE, deadline)
+
+
+class AsyncFaceIO(face_requests.FaceIO):
+    """
+    I/O of the shared face request handlers (face_requests.py) for one asyncio request:
+    Motor for per-request reads and writes, the face executor for the CPU stages.
+    """
+
+    def __init__(self, request):
+        self.deadline = request.state.deadline
+
+    @property
+    def has_database(self):
+        return mongo is not None
+
+    async def decode(self, image_data):
+        """The request Frame (decoded on the face executor, carrying the request deadline), or None."""
+        frame = await run_face(decode_frame, image_data, self.deadline)
+        if frame is not None and frame.scale > 1:
+            print(f"📉 Decoded at 1/{frame.scale} scale: {frame.width}x{frame.height}")
+        return frame
+
+    async def classroom_session(self, attendance_id):
+        if core.classroom_cache is None:
+            return None
+        return await run_io(core.classroom_cache.get, attendance_id)
+
+    async def refresh_roster(self, session):
+        return await run_io(core.classroom_cache.refresh_roster, session)
+
+    async def attendance_location(self, attendance_id):
+        if mongo is None:
+            return None, None
+        try:
+            attendance_record = await mongo["attendances"].find_one(
+                {"_id": ObjectId(attendance_id)}, {"latitude": 1, "longitude": 1})
+            if attendance_record:
+                return attendance_record.get('latitude'), attendance_record.get('longitude')
+            print(f"⚠️ Attendance record not found for ID: {attendance_id}")
+        except Exception as e:
+            print(f"❌ Error fetching attendance record: {e}")
+        return None, None
+
+    async def student_exists(self, student_id):
+        return await mongo["users"].find_one({"studentId": student_id}, {"_id": 1}) is not None
+
+    async def teacher_exists(self, teacher_name):
+        return await mongo["teachers"].find_one({"teacherName": teacher_name}, {"_id": 1}) is not None
+
+    async def recognize_student(self, frame, student_id, classroom_gallery=None):
+        return await run_face(core.recognize_student, frame, student_id, classroom_gallery)
+
+    async def recognize_teacher(self, frame, teacher_name):
+        return await run_face(core.recognize_teacher, frame, teacher_name)
+
+    async def verify_liveness(self, frame):
+        return await run_face(core.verify_registration_liveness, frame)
+
+    async def encode(self, frame, face_location):
+        return await run_face(core.encode_registration, frame, face_location)
+
+    async def find_duplicate(self, kind, embedding):
+        return await run_face(core.find_registration_duplicate, kind, embedding)
+
+    async def save_student(self, student_id, name, embedding, frame, face_location):
+        chip = await run_io(core.face_chip_fields, 'users', student_id, frame, face_location)
+        user_data = face_requests.new_student_document(student_id, name, core.embedding_fields(embedding), chip)
+        result = await mongo["users"].insert_one(user_data)
+        if result.inserted_id:
+            await run_io(core.registered_student, student_id, name, embedding, result.inserted_id)
+        return result.inserted_id
+
+    async def save_teacher(self, teacher_name, embedding, frame, face_location):
+        chip = await run_io(core.face_chip_fields, 'teachers', teacher_name, frame, face_location)
+        teacher_data = face_requests.new_teacher_document(teacher_name, core.embedding_fields(embedding), chip)
+        result = await mongo["teachers"].insert_one(teacher_data)
+        if result.inserted_id:
+            await run_io(core.registered_teacher, teacher_name, embedding, result.inserted_id)
+        return result.inserted_id
+
+
+async def health(request):
+    return json_response({
+        "status": "healthy",
+        "face_recognition": core.FACE_RECOGNITION_AVAILABLE,
+        "anti_spoof_detection": core.ANTI_SPOOF_AVAILABLE,
+        "database": "connected" if core.mongo_client else "disconnected",
+        "timestamp": datetime.datetime.now().isoformat()
+    })
+
+
+@face_endpoint
+async def attend_class(request, upload):
+    return await face_requests.attend_class(upload, AsyncFaceIO(request))
+
+
+@face_endpoint
+async def student_join(request, upload):
+    return await face_requests.student_join(upload, AsyncFaceIO(request))
+
+
+@face_endpoint
+async def register(request, upload):
+    return await face_requests.register_student(upload, AsyncFaceIO(request), core.FACE_RECOGNITION_AVAILABLE)
+
+
+@face_endpoint
+async def register_teacher(request, upload):
+    return await face_requests.register_teacher(upload, AsyncFaceIO(request))
+
+
+@face_endpoint
+async def login_teacher(request, upload):
+    return await face_requests.login_teacher(upload, AsyncFaceIO(request))
+
+
+FACE_METHODS = ['POST', 'OPTIONS']
+
+app = Starlette(
+    routes=[
+        Route('/health', health),
+        Route('/student/attend', attend_class, methods=FACE_METHODS),
+        Route('/student/join', student_join, methods=FACE_METHODS),
+        Route('/student/register', register, methods=FACE_METHODS),
+        Route('/teacher/register', register_teacher, methods=FACE_METHODS),
+        Route('/teacher/login', login_teacher, methods=FACE_METHODS),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_credentials=True,
+                           allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Compare latency and memory of the torch and ONNX anti-spoof backends.
+
+Each backend runs in its own subprocess so that its RSS is not polluted by the
+others (importing torch once is enough to dominate a worker's footprint).
+
+Usage: python benchmark_backends.py [--repeat 20] [--images DIR]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+SAMPLE_DIR = "Silent_Face_Anti_Spoofing/images/sample"
+BACKENDS = [("torch", "cv2"), ("onnx", "cv2"), ("onnx", "onnxruntime")]
+
+
+def _rss_mb():
+    """Current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_child(image_dir, repeat):
+    """Runs inside the subprocess: initialize the configured backend and time detect_spoof."""
+    import cv2
+    import numpy as np
+
+    rss_before = _rss_mb()
+    start = time.time()
+    from anti_spoof_detector import anti_spoof_detector
+    init_time = time.time() - start
+    rss_after_init = _rss_mb()
+
+    images = []
+    for name in sorted(os.listdir(image_dir)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")) and "_result" not in name:
+            image = cv2.imread(os.path.join(image_dir, name))
+            if image is not None:
+                images.append(image)
+
+    # warm-up pass, then timed passes
+    for image in images:
+        anti_spoof_detector.detect_spoof(image)
+    timings = []
+    for _ in range(repeat):
+        for image in images:
+            start = time.time()
+            anti_spoof_detector.detect_spoof(image)
+            timings.append(time.time() - start)
+
+    timings_ms = np.array(timings) * 1000.0
+    return {
+        "torch_imported": "torch" in sys.modules,
+        "init_s": round(init_time, 3),
+        "rss_before_mb": round(rss_before, 1),
+        "rss_after_init_mb": round(rss_after_init, 1),
+        "rss_final_mb": round(_rss_mb(), 1),
+        "calls": len(timings),
+        "mean_ms": round(float(timings_ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(timings_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(timings_ms, 95)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="anti-spoof backend benchmark")
+    parser.add_argument("--images", default=SAMPLE_DIR, help="directory of test images")
+    parser.add_argument("--repeat", type=int, default=20, help="timed passes over the images")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # keep detector prints off stdout so the parent can read the JSON line
+        real_stdout = sys.stdout
+        sys.stdout = sys.stderr
+        result = run_child(args.images, args.repeat)
+        real_stdout.write(json.dumps(result) + "\n")
+        return
+
+    results = {}
+    for backend, runtime in BACKENDS:
+        env = dict(os.environ, ANTI_SPOOF_BACKEND=backend, ANTI_SPOOF_ONNX_RUNTIME=runtime)
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", "--images", args.images, "--repeat", str(args.repeat)],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        label = backend if backend == "torch" else f"{backend}/{runtime}"
+        if proc.returncode != 0 or not proc.stdout.strip():
+            print(f"❌ {label}: benchmark failed (exit {proc.returncode})")
+            continue
+        results[label] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    print(f"{'backend':<18}{'init s':>8}{'RSS MB':>9}{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}  torch")
+    for label, r in results.items():
+        print(f"{label:<18}{r['init_s']:>8}{r['rss_final_mb']:>9}{r['mean_ms']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}  {r['torch_imported']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Stage-level micro-benchmark of the liveness pipeline.
+
+Times every stage of detect_spoof separately (legacy 3:4 frame resize, detector
+input preparation and forward, get_bbox, per-model crop / warp crop, tensor
+conversion, model load and forward) plus the whole ensemble, over the sample
+images and synthetic frames of several resolutions. Results (p50/p95/mean in
+ms) are written as JSON so that two runs can be compared:
+
+    python benchmark_liveness_stages.py --output before.json
+    ... change something ...
+    python benchmark_liveness_stages.py --output after.json --compare before.json
+
+The detector is configured from the environment as in production
+(ANTI_SPOOF_BACKEND, ANTI_SPOOF_COMPILED, LIVENESS_WARP_CROP, ...).
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+SAMPLE_DIR = "Silent_Face_Anti_Spoofing/images/sample"
+# width x height, portrait like phone selfies
+SYNTHETIC_SIZES = ["480x640", "960x1280", "1440x1920", "3024x4032", "1080x1920"]
+CONFIG_ENV = [
+    "ANTI_SPOOF_BACKEND", "ANTI_SPOOF_ONNX_RUNTIME", "ANTI_SPOOF_COMPILED", "ANTI_SPOOF_INT8",
+    "LIVENESS_WARP_CROP", "LIVENESS_CASCADE", "LIVENESS_BATCHING", "OMP_NUM_THREADS",
+]
+
+
+def time_stage(fn, repeat, warmup=1):
+    """p50/p95/mean of ``fn()`` in ms over ``repeat`` calls."""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000.0)
+    timings = np.array(timings)
+    return {
+        "n": int(repeat),
+        "p50_ms": round(float(np.percentile(timings, 50)), 4),
+        "p95_ms": round(float(np.percentile(timings, 95)), 4),
+        "mean_ms": round(float(timings.mean()), 4),
+    }
+
+
+def load_inputs(image_dir, sizes):
+    """(label, frame) for the sample images and synthetic frames built from the first sample."""
+    inputs = []
+    for name in sorted(os.listdir(image_dir)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")) and "_result" not in name:
+            image = cv2.imread(os.path.join(image_dir, name))
+            if image is not None:
+                inputs.append((f"sample:{name}", image))
+    if not inputs:
+        raise SystemExit(f"No images in {image_dir}")
+    # prefer the live sample as the source of synthetic frames so they contain a real face
+    source = dict(inputs).get("sample:image_T1.jpg", inputs[0][1])
+    for size in sizes:
+        width, height = (int(v) for v in size.lower().split("x"))
+        inputs.append((f"synthetic:{width}x{height}", cv2.resize(source, (width, height))))
+    return inputs
+
+
+def detector_stages(model_test, frame, repeat):
+    """Split Detection.get_bbox into input preparation (resize + blob) and the forward pass."""
+    height, width = frame.shape[:2]
+    aspect_ratio = width / height
+
+    def prepare():
+        img = frame
+        if width * height >= 192 * 192:
+            img = cv2.resize(frame, (int(192 * math.sqrt(aspect_ratio)), int(192 / math.sqrt(aspect_ratio))),
+                             interpolation=cv2.INTER_LINEAR)
+        return cv2.dnn.blobFromImage(img, 1, mean=(104, 117, 123))
+
+    blob = prepare()
+
+    def forward():
+        with model_test._detector_lock:
+            model_test.detector.setInput(blob, "data")
+            return model_test.detector.forward("detection_out")
+
+    return {
+        "detector_prepare": time_stage(prepare, repeat),
+        "detector_forward": time_stage(forward, repeat),
+        "get_bbox": time_stage(lambda: model_test.get_bbox(frame), repeat),
+    }
+
+
+def model_stages(detector, frame, bbox, entry, repeat):
+    """Crop, tensor conversion and forward for one model."""
+    model_test = detector.model_test
+    cropper = detector.image_cropper
+    h_input, w_input, _, scale = entry["spec"]
+    crop_args = (frame, bbox, scale, w_input, h_input, scale is not None)
+    crop = cropper.crop(*crop_args)
+    key = entry["name"]
+    stages = {
+        f"crop[{key}]": time_stage(lambda: cropper.crop(*crop_args), repeat),
+        f"warp_crop[{key}]": time_stage(lambda: cropper.warp_crop(*crop_args), repeat),
+    }
+
+    model = model_test.registry.get(entry["path"])
+    if hasattr(model_test, "device"):
+        import torch
+        from Silent_Face_Anti_Spoofing.src.data_io import transform as trans
+        to_tensor = trans.ToTensor()
+
+        def convert():
+            return torch.stack([to_tensor(crop)]).to(model_test.device)
+
+        batch = convert()
+
+        def forward():
+            with torch.no_grad():
+                return model(batch)
+    else:
+        from Silent_Face_Anti_Spoofing.src.onnx_predict import to_blob
+
+        def convert():
+            return to_blob([crop])
+
+        batch = convert()
+
+        def forward():
+            return model_test._forward(model, batch)
+
+    stages[f"to_tensor[{key}]"] = time_stage(convert, repeat)
+    stages[f"forward[{key}]"] = time_stage(forward, repeat)
+    stages[f"predict[{key}]"] = time_stage(lambda: model_test.predict(crop, entry["path"]), repeat)
+    return stages
+
+
+def run(args):
+    # keep detector prints out of the report
+    real_stdout = sys.stdout
+    sys.stdout = sys.stderr
+    from anti_spoof_detector import anti_spoof_detector as detector
+    sys.stdout = real_stdout
+    if not detector.is_available():
+        raise SystemExit("Anti-spoof detection is not available")
+
+    model_test = detector.model_test
+    entries = model_test.registry.scan(detector.model_dir, model_test.model_extensions)
+    results = {"load": {}, "inputs": {}}
+    for entry in entries:
+        results["load"][f"model_load[{entry['name']}]"] = time_stage(
+            lambda: model_test._load_model(entry["path"]), args.load_repeat, warmup=0)
+
+    for label, frame in load_inputs(args.images, args.sizes):
+        height, width = frame.shape[:2]
+        stages = {
+            "frame_resize_3_4": time_stage(lambda: cv2.resize(frame, (int(height * 3 / 4), height)), args.repeat),
+        }
+        stages.update(detector_stages(model_test, frame, args.repeat))
+        bbox = model_test.get_bbox(frame)
+        for entry in entries:
+            stages.update(model_stages(detector, frame, bbox, entry, args.repeat))
+
+        sys.stdout = sys.stderr
+        try:
+            stages["ensemble"] = time_stage(lambda: detector.detect_spoof(frame), args.repeat)
+        finally:
+            sys.stdout = real_stdout
+        results["inputs"][label] = {"shape": list(frame.shape), "stages": stages}
+        print(f"{label:<28} get_bbox p50 {stages['get_bbox']['p50_ms']:.2f} ms, "
+              f"ensemble p50 {stages['ensemble']['p50_ms']:.2f} / p95 {stages['ensemble']['p95_ms']:.2f} ms")
+
+    results["meta"] = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "torch": sys.modules["torch"].__version__ if "torch" in sys.modules else None,
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "config": {name: os.environ.get(name) for name in CONFIG_ENV},
+    }
+    return results
+
+
+def compare(base, current):
+    """Print p50/p95 of every stage present in both runs."""
+    print(f"\n{'input / stage':<60}{'p50 base':>10}{'p50 new':>10}{'Δ%':>8}{'p95 base':>10}{'p95 new':>10}{'Δ%':>8}")
+
+    def row(name, old, new):
+        def delta(key):
+            return (new[key] - old[key]) / old[key] * 100.0 if old[key] else 0.0
+        print(f"{name:<60}{old['p50_ms']:>10.2f}{new['p50_ms']:>10.2f}{delta('p50_ms'):>+8.1f}"
+              f"{old['p95_ms']:>10.2f}{new['p95_ms']:>10.2f}{delta('p95_ms'):>+8.1f}")
+
+    for stage, new in current["load"].items():
+        if stage in base.get("load", {}):
+            row(stage, base["load"][stage], new)
+    for label, data in current["inputs"].items():
+        old_stages = base.get("inputs", {}).get(label, {}).get("stages", {})
+        for stage, new in data["stages"].items():
+            if stage in old_stages:
+                row(f"{label} {stage}", old_stages[stage], new)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="liveness stage micro-benchmark")
+    parser.add_argument("--images", default=SAMPLE_DIR, help="directory of test images")
+    parser.add_argument("--sizes", nargs="*", default=SYNTHETIC_SIZES,
+                        help="synthetic frame sizes as WIDTHxHEIGHT")
+    parser.add_argument("--repeat", type=int, default=30, help="timed calls per stage")
+    parser.add_argument("--load_repeat", type=int, default=3, help="timed model loads per model")
+    parser.add_argument("--output", default="liveness_bench.json", help="where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="earlier JSON results to diff against")
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
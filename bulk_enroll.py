@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Bulk student enrolment for semester onboarding.
+
+Takes a CSV roster (``studentId``, ``name`` and optionally ``image``) and a
+folder or ZIP of face photos, computes the encodings in a process pool,
+rejects faces that match another row of the batch or an already registered
+student in one vectorized pass, and writes the rest with ``insert_many`` in
+chunks. Every row gets a status in the report.
+
+    python bulk_enroll.py --roster students.csv --images photos.zip --report report.csv
+    python bulk_enroll.py --roster students.csv --images photos/ --dry-run
+
+Images are looked up by the ``image`` column, or as ``<studentId>.jpg|.jpeg|.png``.
+The photos are trusted (registrar/ID photos), so there is no liveness check;
+the server's /student/register/bulk endpoint is therefore admin-only.
+"""
+
+import argparse
+import csv
+import datetime
+import itertools
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from face_index import (FACE_ENCODER_JITTERS, FACE_ENCODER_MODEL, MATCH_THRESHOLD, EmbeddingIndex,
+                        embedding_document_fields, find_embeddings)
+
+try:
+    from pymongo.errors import BulkWriteError
+except ImportError:
+    class BulkWriteError(Exception):
+        details = {}
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+INSERT_CHUNK = 500
+# images read and handed to the pool at a time, so a large ZIP is never held in memory whole
+ENCODE_CHUNK = 64
+
+# report statuses
+ENROLLED = "enrolled"
+WOULD_ENROLL = "would_enroll"
+MISSING_FIELDS = "missing_fields"
+MISSING_IMAGE = "missing_image"
+UNREADABLE_IMAGE = "unreadable_image"
+NO_FACE = "no_face"
+MULTIPLE_FACES = "multiple_faces"
+DUPLICATE_STUDENT_ID = "duplicate_student_id"
+DUPLICATE_IN_BATCH = "duplicate_face_in_batch"
+DUPLICATE_REGISTERED = "duplicate_face_registered"
+ERROR = "error"
+
+
+def load_roster(roster):
+    """Rows of a CSV roster (path or text file object) as dicts with studentId, name, image."""
+    if isinstance(roster, str):
+        with open(roster, newline="", encoding="utf-8-sig") as f:
+            return load_roster(f)
+    rows = []
+    for row in csv.DictReader(roster):
+        row = {(key or "").strip(): (value or "").strip() for key, value in row.items()}
+        rows.append({"studentId": row.get("studentId", ""), "name": row.get("name", ""),
+                     "image": row.get("image", "")})
+    return rows
+
+
+class ImageSource:
+    """Face photos in a folder or a ZIP archive, looked up by file name (case-insensitive)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = None
+        self._names = {}
+        if zipfile.is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+            members = [info.filename for info in self._zip.infolist() if not info.is_dir()]
+        else:
+            members = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+        for member in members:
+            self._names.setdefault(os.path.basename(member).lower(), member)
+
+    def find(self, row):
+        """Member/path of the row's image, or None."""
+        if row["image"]:
+            return self._names.get(os.path.basename(row["image"]).lower())
+        for extension in IMAGE_EXTENSIONS:
+            member = self._names.get(f"{row['studentId']}{extension}".lower())
+            if member:
+                return member
+        return None
+
+    def job(self, member):
+        """What a pool worker needs to read the image: bytes from a ZIP, or a file path."""
+        return self._zip.read(member) if self._zip is not None else member
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+def encode_image(job):
+    """
+    Pool worker: (row index, image bytes or path) -> (row index, status, encoding, detail).
+    Exactly one face must be found.
+    """
+    import cv2
+    import face_recognition
+
+    index, source = job
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            image = cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_COLOR)
+        else:
+            image = cv2.imread(source, cv2.IMREAD_COLOR)
+        if image is None:
+            return index, UNREADABLE_IMAGE, None, ""
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        locations = face_recognition.face_locations(rgb)
+        if not locations:
+            return index, NO_FACE, None, ""
+        if len(locations) > 1:
+            return index, MULTIPLE_FACES, None, f"{len(locations)} faces"
+        encoding = face_recognition.face_encodings(rgb, known_face_locations=locations, num_jitters=FACE_ENCODER_JITTERS,
+                                                   model=FACE_ENCODER_MODEL)[0]
+        return index, None, encoding.astype(np.float32), ""
+    except Exception as e:
+        return index, ERROR, None, str(e)
+
+
+def image_jobs(rows, source, report):
+    """
+    Pool jobs (row index, image bytes or path) of the rows that have an image, read lazily.
+    Rows without one are marked MISSING_IMAGE before the first job is produced.
+    """
+    members = []
+    for index, row in enumerate(rows):
+        if report[index]["status"]:
+            continue
+        member = source.find(row)
+        if member is None:
+            report[index]["status"] = MISSING_IMAGE
+            continue
+        report[index]["image"] = os.path.basename(member)
+        members.append((index, member))
+    return ((index, source.job(member)) for index, member in members)
+
+
+def encode_rows(rows, source, report, workers, chunk_size=ENCODE_CHUNK):
+    """Encode every row that has an image; fills ``report`` for rows that fail. Returns {row index: encoding}."""
+    jobs = image_jobs(rows, source, report)
+    encodings = {}
+    # spawn, not fork: the server process has model and scheduler threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        # one chunk of images in flight at a time, so memory stays flat on large archives
+        while True:
+            chunk = list(itertools.islice(jobs, chunk_size))
+            if not chunk:
+                break
+            for index, status, encoding, detail in pool.map(encode_image, chunk, chunksize=4):
+                if status:
+                    report[index].update(status=status, detail=detail)
+                else:
+                    encodings[index] = encoding
+    return encodings
+
+
+def dedup(rows, encodings, report, collection, threshold):
+    """
+    Mark rows whose face matches an earlier row of the batch or a registered student.
+    One (M, M) distance matrix for the batch and one index search against the gallery.
+    """
+    indices = sorted(encodings)
+    if not indices:
+        return []
+    matrix = np.stack([encodings[index] for index in indices])
+
+    # in-batch: the first occurrence wins
+    squared = np.einsum("ij,ij->i", matrix, matrix)
+    distances = np.sqrt(np.maximum(squared[:, None] + squared[None, :] - 2.0 * matrix @ matrix.T, 0.0))
+    np.fill_diagonal(distances, np.inf)
+    duplicate_of = {}
+    for i in range(len(indices)):
+        if i in duplicate_of:
+            continue
+        for j in np.flatnonzero(distances[i, i + 1:] < threshold) + i + 1:
+            duplicate_of.setdefault(int(j), i)
+
+    # against the registered students, in one batched search
+    gallery = EmbeddingIndex(key_field="studentId", name_field="name")
+    if collection is not None:
+        gallery.build(find_embeddings(collection, {}, ("studentId", "name")))
+    matches = gallery.search(matrix, threshold) if len(gallery) else [None] * len(indices)
+
+    accepted = []
+    for position, index in enumerate(indices):
+        if position in duplicate_of:
+            first = rows[indices[duplicate_of[position]]]["studentId"]
+            report[index].update(status=DUPLICATE_IN_BATCH, detail=f"same face as {first}")
+        elif matches[position] is not None:
+            match = matches[position]
+            report[index].update(status=DUPLICATE_REGISTERED,
+                                 detail=f"registered as {match['studentId']} (distance {match['distance']:.3f})")
+        else:
+            accepted.append(index)
+    return accepted
+
+
+def enroll(rows, images, collection=None, workers=None, threshold=MATCH_THRESHOLD,
+           dry_run=False, binary_embeddings=True, progress=None):
+    """
+    Enrol ``rows`` (from load_roster) with photos from ``images`` (folder or ZIP path).
+
+    Returns:
+        list of per-row report dicts: row, studentId, name, image, status, detail.
+    """
+    started = time.time()
+    report = [{"row": index + 2, "studentId": row["studentId"], "name": row["name"],
+               "image": row["image"], "status": "", "detail": ""} for index, row in enumerate(rows)]
+
+    seen_ids = set()
+    for index, row in enumerate(rows):
+        if not row["studentId"] or not row["name"]:
+            report[index]["status"] = MISSING_FIELDS
+        elif row["studentId"] in seen_ids:
+            report[index].update(status=DUPLICATE_STUDENT_ID, detail="repeated in roster")
+        seen_ids.add(row["studentId"])
+    if collection is not None and seen_ids:
+        existing = {doc["studentId"] for doc in collection.find(
+            {"studentId": {"$in": list(seen_ids)}}, {"studentId": 1})}
+        for index, row in enumerate(rows):
+            if not report[index]["status"] and row["studentId"] in existing:
+                report[index].update(status=DUPLICATE_STUDENT_ID, detail="already registered")
+
+    source = ImageSource(images)
+    try:
+        if progress:
+            progress("encoding", 0, len(rows))
+        encodings = encode_rows(rows, source, report, workers or os.cpu_count())
+    finally:
+        source.close()
+    encoded = time.time()
+
+    accepted = dedup(rows, encodings, report, collection, threshold)
+    deduped = time.time()
+
+    now = datetime.datetime.now()
+    documents = [{
+        "studentId": rows[index]["studentId"],
+        "name": rows[index]["name"],
+        "Classrooms": [],
+        **embedding_document_fields(encodings[index], binary=binary_embeddings),
+        "created_at": now,
+    } for index in accepted]
+    for start in range(0, len(documents), INSERT_CHUNK):
+        chunk = accepted[start:start + INSERT_CHUNK]
+        if dry_run or collection is None:
+            for index in chunk:
+                report[index]["status"] = WOULD_ENROLL
+            continue
+        try:
+            collection.insert_many(documents[start:start + INSERT_CHUNK], ordered=False)
+            for index in chunk:
+                report[index]["status"] = ENROLLED
+        except BulkWriteError as e:
+            # unordered: everything but the reported rows was written
+            failed = {error["index"]: error.get("errmsg", "") for error in e.details.get("writeErrors", [])}
+            for position, index in enumerate(chunk):
+                if position in failed:
+                    report[index].update(status=ERROR, detail=failed[position])
+                else:
+                    report[index]["status"] = ENROLLED
+        except Exception as e:
+            for index in chunk:
+                report[index].update(status=ERROR, detail=str(e))
+        if progress:
+            progress("inserting", min(start + INSERT_CHUNK, len(documents)), len(documents))
+
+    print(f"✅ Bulk enrolment: {len(rows)} rows, {len(encodings)} encoded in {encoded - started:.1f}s, "
+          f"dedup {deduped - encoded:.2f}s, {len(accepted)} {'to insert' if dry_run else 'inserted'} "
+          f"in {time.time() - deduped:.1f}s")
+    return report
+
+
+def summarize(report):
+    summary = {}
+    for entry in report:
+        summary[entry["status"]] = summary.get(entry["status"], 0) + 1
+    return summary
+
+
+def write_report(report, output):
+    with open(output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["row", "studentId", "name", "image", "status", "detail"])
+        writer.writeheader()
+        writer.writerows(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bulk student enrolment")
+    parser.add_argument("--roster", required=True, help="CSV with studentId,name[,image]")
+    parser.add_argument("--images", required=True, help="folder or ZIP of face photos")
+    parser.add_argument("--report", default="enrolment_report.csv", help="per-row report (CSV)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="encoding processes")
+    parser.add_argument("--threshold", type=float, default=MATCH_THRESHOLD, help="duplicate face distance")
+    parser.add_argument("--mongodb_uri", default=os.environ.get("MONGODB_URI"),
+                        help="MongoDB connection string (default: $MONGODB_URI)")
+    parser.add_argument("--database", default="face_verification_db", help="database name")
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true",
+                        help="encode and dedup against the database, insert nothing")
+    parser.add_argument("--no-binary", dest="binary", action="store_false",
+                        help="store only the legacy embedding list")
+    args = parser.parse_args()
+
+    collection = None
+    if args.mongodb_uri:
+        from pymongo import MongoClient
+        collection = MongoClient(args.mongodb_uri, tls=True, tlsAllowInvalidCertificates=True)[args.database]["users"]
+    elif not args.dry_run:
+        raise SystemExit("Set MONGODB_URI or pass --mongodb_uri (or use --dry-run)")
+
+    rows = load_roster(args.roster)
+    report = enroll(rows, args.images, collection, args.workers, args.threshold,
+                    dry_run=args.dry_run, binary_embeddings=args.binary)
+    write_report(report, args.report)
+    print(f"{summarize(report)}")
+    print(f"Wrote {args.report}")
+
+
+if __name__ == "__main__":
+    main()
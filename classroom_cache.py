@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Per-attendance-session classroom galleries.
+
+When an attendance session is first seen (or pre-warmed through
+/attendance/prepare) its classroom roster is read once from the shared
+``classrooms`` collection and kept as an EmbeddingIndex together with the
+teacher's location, so /student/attend needs neither ``classroom_students``
+in the request body nor a per-request attendance lookup. Sessions are
+re-checked for ``endedAt`` at most every ``check_s`` seconds and dropped
+once the teacher ends them; a roster is re-read for a student it does not
+know at most as often. The cache is per process, like the galleries.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from face_index import EmbeddingIndex
+
+try:
+    from bson import ObjectId
+except ImportError:
+    ObjectId = None
+
+
+class ClassroomSession:
+    """Cached state of one attendance session."""
+
+    __slots__ = ("attendance_id", "classroom_id", "latitude", "longitude", "gallery",
+                 "ended", "loaded_at", "checked_at")
+
+    def __init__(self, attendance_id, classroom_id=None, latitude=None, longitude=None):
+        self.attendance_id = attendance_id
+        self.classroom_id = classroom_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.gallery = EmbeddingIndex(key_field="studentId", name_field="name")
+        self.ended = False
+        self.loaded_at = 0.0
+        self.checked_at = 0.0
+
+    def __contains__(self, student_id) -> bool:
+        return student_id in self.gallery
+
+    def __len__(self) -> int:
+        return len(self.gallery)
+
+
+class ClassroomGalleryCache:
+    """
+    LRU of ClassroomSession keyed by attendance id.
+
+    Args:
+        db: pymongo database holding ``attendances`` and ``classrooms`` (or None).
+        check_s (float): minimum seconds between ``endedAt`` checks (and roster reloads) of a session.
+        max_sessions (int): sessions kept before the least recently used is dropped.
+    """
+
+    def __init__(self, db, check_s: float = 15.0, max_sessions: int = 256):
+        self.db = db
+        self.check_s = check_s
+        self.max_sessions = max(1, int(max_sessions))
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._loads = 0
+        self._expired = 0
+
+    def _find_attendance(self, attendance_id, projection):
+        return self.db["attendances"].find_one({"_id": ObjectId(attendance_id)}, projection)
+
+    def _load_roster(self, session):
+        classroom = self.db["classrooms"].find_one({"_id": session.classroom_id}, {"ClassroomStudents": 1})
+        students = (classroom or {}).get("ClassroomStudents") or []
+        session.gallery.build(students)
+        session.loaded_at = time.time()
+
+    def _load(self, attendance_id) -> Optional[ClassroomSession]:
+        record = self._find_attendance(attendance_id, {"classroom": 1, "latitude": 1, "longitude": 1, "endedAt": 1})
+        if record is None:
+            return None
+        session = ClassroomSession(attendance_id, record.get("classroom"),
+                                   record.get("latitude"), record.get("longitude"))
+        session.ended = record.get("endedAt") is not None
+        if not session.ended:
+            started = time.time()
+            self._load_roster(session)
+            print(f"✅ Classroom gallery for attendance {attendance_id}: {len(session)} students "
+                  f"in {(time.time() - started) * 1000:.1f} ms")
+        session.checked_at = time.time()
+        self._loads += 1
+        return session
+
+    def get(self, attendance_id, force: bool = False) -> Optional[ClassroomSession]:
+        """
+        The session for ``attendance_id``, loading it on first use; None if it does
+        not exist or cannot be read. Ended sessions come back with ``ended`` set and
+        no roster.
+        """
+        if self.db is None or ObjectId is None or not attendance_id:
+            return None
+        with self._lock:
+            session = self._sessions.get(attendance_id)
+            if session is not None:
+                self._sessions.move_to_end(attendance_id)
+        try:
+            if session is None or force:
+                session = self._load(attendance_id)
+                if session is None:
+                    return None
+                with self._lock:
+                    self._sessions[attendance_id] = session
+                    self._sessions.move_to_end(attendance_id)
+                    while len(self._sessions) > self.max_sessions:
+                        self._sessions.popitem(last=False)
+                return session
+
+            self._hits += 1
+            if not session.ended and time.time() - session.checked_at >= self.check_s:
+                record = self._find_attendance(attendance_id, {"endedAt": 1})
+                session.checked_at = time.time()
+                if record is None or record.get("endedAt") is not None:
+                    # ended (or deleted): keep a marker without the roster
+                    session.ended = True
+                    session.gallery = EmbeddingIndex(key_field="studentId", name_field="name")
+                    self._expired += 1
+                    print(f"🧹 Attendance {attendance_id} ended, classroom gallery dropped")
+            return session
+        except Exception as e:
+            print(f"❌ Error loading attendance session {attendance_id}: {e}")
+            return None
+
+    def refresh_roster(self, session: ClassroomSession) -> ClassroomSession:
+        """
+        Re-read the roster, e.g. for a student who joined the class after the session was cached.
+        At most once per ``check_s`` per session, so requests with unknown student ids cannot
+        turn every attendance into a roster reload.
+        """
+        if session.ended or self.db is None or time.time() - session.loaded_at < self.check_s:
+            return session
+        try:
+            self._load_roster(session)
+        except Exception as e:
+            print(f"❌ Error reloading classroom {session.classroom_id}: {e}")
+            session.loaded_at = time.time()  # back off like after a successful reload
+        return session
+
+    def prepare(self, attendance_id) -> Optional[ClassroomSession]:
+        """(Re)load ``attendance_id`` now, so the first student of the session does not pay for it."""
+        return self.get(attendance_id, force=True)
+
+    def invalidate(self, attendance_id):
+        with self._lock:
+            self._sessions.pop(attendance_id, None)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            active = sum(1 for session in self._sessions.values() if not session.ended)
+            return {
+                "sessions": len(self._sessions),
+                "active_sessions": active,
+                "hits": self._hits,
+                "loads": self._loads,
+                "expired": self._expired,
+            }
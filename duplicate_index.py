@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent approximate-nearest-neighbour index for the registration duplicate check.
+
+IVF layout: the embeddings present at the last compaction are partitioned by
+k-means into ~sqrt(N) lists, and a query only scores the lists of its
+``nprobe`` nearest centroids. (A BallTree was measured first and was slower
+than a flat BLAS scan on 128-d embeddings, so it was not worth its keep.) The
+compacted index is saved to disk (``db/`` in the container) as an ``.npz`` of
+plain arrays plus JSON metadata, never pickled, so a worker starts from the
+file instead of re-reading the collection. Registrations made
+since then go into a small exact delta buffer, replaced or removed rows are
+tombstoned, and once either grows past ``compact_ratio`` of the index it is
+re-partitioned from the live rows and saved again. Candidates are re-ranked
+with exact distances against the match threshold.
+
+Other workers' registrations are picked up before every check with one
+``_id`` range query, embeddings rewritten in place (reembed.py) by their
+``embeddingUpdatedAt`` stamp, which is saved with the index so a stale file
+is caught up too, and a document count mismatch (deletes, manual edits)
+triggers a full rebuild.
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from face_index import EmbeddingIndex, EMBEDDING_DIM, MATCH_THRESHOLD, decode_embedding, find_embeddings
+
+try:
+    from bson import ObjectId
+except ImportError:
+    ObjectId = None
+
+INDEX_VERSION = 3
+# below this many rows a flat scan is as fast as probing lists
+MIN_IVF_ROWS = 2048
+# candidates whose distance is recomputed exactly (float64) before the threshold test
+RERANK = 4
+# ObjectIds from different processes are only ordered to the second, so the
+# catch-up query re-reads a short window and skips what it already knows
+CATCHUP_SLACK = datetime.timedelta(seconds=120)
+
+
+def _id_to_json(_id):
+    """Document ``_id`` as a JSON value (ObjectIds as ``{"$oid": hex}``, like extended JSON)."""
+    if ObjectId is not None and isinstance(_id, ObjectId):
+        return {"$oid": str(_id)}
+    return _id
+
+
+def _id_from_json(value):
+    if isinstance(value, dict) and "$oid" in value and ObjectId is not None:
+        return ObjectId(value["$oid"])
+    return value
+
+
+def _nearest_centroid(vectors, centroids, chunk=8192):
+    """Index of the nearest centroid for every row of ``vectors``."""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        block = vectors[start:start + chunk]
+        # |v|^2 is the same for every centroid, so it can be left out of the argmin
+        assign[start:start + chunk] = (centroid_norms[None, :] - 2.0 * block @ centroids.T).argmin(axis=1)
+    return assign
+
+
+def train_ivf(vectors, nlist, iterations=10, sample=20000, seed=0):
+    """
+    k-means (Lloyd) centroids on a sample of ``vectors`` and the inverted lists.
+
+    Returns:
+        (centroids, order, offsets): rows of list ``c`` are ``order[offsets[c]:offsets[c + 1]]``.
+    """
+    rng = np.random.RandomState(seed)
+    train = vectors[rng.choice(len(vectors), min(sample, len(vectors)), replace=False)]
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest_centroid(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, train)
+        counts = np.bincount(assign, minlength=nlist)
+        filled = counts > 0
+        # empty lists keep their old centroid
+        centroids[filled] = sums[filled] / counts[filled, None]
+    assign = _nearest_centroid(vectors, centroids)
+    order = np.argsort(assign, kind="stable")
+    offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+    return centroids, order, offsets
+
+
+class DuplicateIndex:
+    """
+    IVF lists + delta buffer + tombstones over one collection's embeddings.
+
+    Args:
+        collection: pymongo collection (or None when the database is down).
+        path (str): file the compacted index is saved to.
+        key_field (str): unique key of a document (``studentId``, ``teacherName``).
+        name_field (str): display name of a document.
+        nprobe (int): inverted lists scored per query.
+        compact_ratio (float): compact once delta or tombstones exceed this share of the index.
+        min_compact (int): ... but never for fewer rows than this.
+        updated_field (str): optional indexed embedding-modified field (EMBEDDING_UPDATED_FIELD),
+            to pick up embeddings rewritten in place (reembed.py).
+        label (str): used in log lines.
+    """
+
+    def __init__(self, collection, path: str, key_field: str, name_field: str, nprobe: int = 8,
+                 compact_ratio: float = 0.1, min_compact: int = 256, updated_field: Optional[str] = None,
+                 label: str = "face"):
+        self.collection = collection
+        self.path = path
+        self.key_field = key_field
+        self.name_field = name_field
+        self.nprobe = max(1, int(nprobe))
+        self.compact_ratio = compact_ratio
+        self.min_compact = min_compact
+        self.label = label
+        self.updated_field = updated_field
+        self._fields = (key_field, name_field, updated_field) if updated_field else (key_field, name_field)
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self._set_base([], [], [], np.zeros((0, EMBEDDING_DIM), dtype=np.float32))
+        self._ids_by_key = {}
+        self._skipped = set()
+        self._doc_count = 0
+        self._watermark = None
+        self._updated = None
+
+    def __len__(self) -> int:
+        return len(self._base_keys) - len(self._tombstones) + len(self._delta)
+
+    # ---- building and persistence -------------------------------------------------
+
+    def _partition(self):
+        if len(self._base) >= MIN_IVF_ROWS:
+            self._ivf = train_ivf(self._base, int(np.sqrt(len(self._base))))
+        else:
+            self._ivf = None
+
+    def _set_base(self, keys, names, ids, vectors, ivf=None):
+        self._base = np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        self._base_keys, self._base_names, self._base_ids = keys, names, ids
+        self._base_rows = {key: row for row, key in enumerate(keys)}
+        self._tombstones = set()
+        self._dead = np.zeros(len(keys), dtype=bool)
+        self._base_norms = np.einsum("ij,ij->i", self._base, self._base)
+        self._delta = EmbeddingIndex(key_field=self.key_field, name_field=self.name_field)
+        if ivf is None:
+            self._partition()
+        else:
+            self._ivf = ivf
+        self._centroid_norms = np.einsum("ij,ij->i", self._ivf[0], self._ivf[0]) if self._ivf is not None else None
+
+    def _see(self, _id):
+        if ObjectId is not None and isinstance(_id, ObjectId):
+            seen = _id.generation_time
+            if self._watermark is None or seen > self._watermark:
+                self._watermark = seen
+
+    def _see_updated(self, doc):
+        updated = doc.get(self.updated_field) if self.updated_field else None
+        if isinstance(updated, datetime.datetime) and (self._updated is None or updated > self._updated):
+            self._updated = updated
+
+    def build(self, documents):
+        """Replace the contents with ``documents`` (Mongo docs with an embedding in either format)."""
+        with self._lock:
+            self._reset()
+            rows = {}
+            for doc in documents:
+                self._doc_count += 1
+                self._see(doc.get("_id"))
+                self._see_updated(doc)
+                embedding, key = decode_embedding(doc), doc.get(self.key_field)
+                if embedding is None or embedding.shape != (EMBEDDING_DIM,) or key is None:
+                    self._skipped.add(doc.get("_id"))
+                    continue
+                # later duplicates of a key win, like add() would
+                rows[key] = (doc.get(self.name_field), doc.get("_id"), embedding)
+            keys = list(rows)
+            self._set_base(keys, [rows[k][0] for k in keys], [rows[k][1] for k in keys],
+                           [rows[k][2] for k in keys])
+            self._ids_by_key = {key: rows[key][1] for key in keys}
+            self._loaded = True
+        return self
+
+    def save(self):
+        """
+        Atomically write the compacted index to ``path``: one ``.npz`` archive with the
+        vectors and lists as plain arrays and the rows and sync state as a JSON entry.
+        """
+        with self._lock:
+            arrays = {"base": self._base}
+            if self._ivf is not None:
+                arrays["centroids"], arrays["order"], arrays["offsets"] = self._ivf
+            meta = {
+                "version": INDEX_VERSION,
+                "key_field": self.key_field,
+                "keys": self._base_keys,
+                "names": self._base_names,
+                "ids": [_id_to_json(_id) for _id in self._base_ids],
+                "skipped": [_id_to_json(_id) for _id in self._skipped],
+                "doc_count": self._doc_count,
+                "watermark": self._watermark.isoformat() if self._watermark is not None else None,
+                "updated": self._updated.isoformat() if self._updated is not None else None,
+            }
+        arrays["meta"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> bool:
+        """Load a saved index; False if there is none or it does not fit this code."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            # no pickled objects: a tampered file can only fail to load
+            with np.load(self.path, allow_pickle=False) as data:
+                meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+                if meta.get("version") != INDEX_VERSION or meta.get("key_field") != self.key_field:
+                    return False
+                base = data["base"]
+                ivf = (data["centroids"], data["order"], data["offsets"]) if "centroids" in data.files else None
+            ids = [_id_from_json(value) for value in meta["ids"]]
+            skipped = {_id_from_json(value) for value in meta["skipped"]}
+            watermark = meta["watermark"]
+            watermark = datetime.datetime.fromisoformat(watermark) if watermark is not None else None
+            updated = meta["updated"]
+            updated = datetime.datetime.fromisoformat(updated) if updated is not None else None
+            if base.shape != (len(ids), EMBEDDING_DIM) or not len(meta["keys"]) == len(meta["names"]) == len(ids):
+                raise ValueError("rows do not match the stored vectors")
+        except Exception as e:
+            print(f"Could not read {self.label} duplicate index {self.path}: {e}")
+            return False
+        with self._lock:
+            self._reset()
+            self._set_base(meta["keys"], meta["names"], ids, base, ivf)
+            self._ids_by_key = dict(zip(self._base_keys, self._base_ids))
+            self._skipped = skipped
+            self._doc_count = meta["doc_count"]
+            self._watermark = watermark
+            self._updated = updated
+            self._loaded = True
+        return True
+
+    # ---- updates ------------------------------------------------------------------
+
+    def add(self, key, name, embedding, _id=None, counted: bool = True):
+        """Insert (or replace) one registration; ``counted`` adds it to the expected document count."""
+        with self._lock:
+            if key in self._base_rows:
+                self._tombstone(key)
+            self._delta.add(key, name, embedding, _id)
+            self._ids_by_key[key] = _id
+            if counted:
+                self._doc_count += 1
+            self._see(_id)
+            self._maybe_compact()
+
+    def remove(self, key) -> bool:
+        """Tombstone ``key``; the row is dropped for good at the next compaction."""
+        with self._lock:
+            removed = self._delta.remove(key)
+            if key in self._base_rows and key not in self._tombstones:
+                self._tombstone(key)
+                removed = True
+            if removed:
+                self._ids_by_key.pop(key, None)
+                self._maybe_compact()
+            return removed
+
+    def _tombstone(self, key):
+        self._tombstones.add(key)
+        self._dead[self._base_rows[key]] = True
+
+    def _maybe_compact(self):
+        limit = max(self.min_compact, self.compact_ratio * len(self._base_keys))
+        if len(self._delta) > limit or len(self._tombstones) > limit:
+            self.compact()
+
+    def compact(self):
+        """Fold the delta into the lists, drop tombstoned rows, re-partition and save."""
+        with self._lock:
+            started = time.time()
+            live = np.flatnonzero(~self._dead)
+            delta_keys, delta_names, delta_ids, delta_vectors = self._delta.snapshot()
+            keys = [self._base_keys[row] for row in live] + delta_keys
+            names = [self._base_names[row] for row in live] + delta_names
+            ids = [self._base_ids[row] for row in live] + delta_ids
+            vectors = np.concatenate([self._base[live], delta_vectors])
+            self._set_base(keys, names, ids, vectors)
+            print(f"✅ {self.label} duplicate index compacted: {len(keys)} embeddings "
+                  f"in {time.time() - started:.2f}s")
+        try:
+            self.save()
+        except Exception as e:
+            print(f"Could not save {self.label} duplicate index {self.path}: {e}")
+
+    # ---- queries ------------------------------------------------------------------
+
+    def search(self, embedding, threshold: float = MATCH_THRESHOLD) -> Optional[dict]:
+        """Closest live registration within ``threshold`` (exact distance), or None."""
+        query = np.asarray(embedding, dtype=np.float32).reshape(1, EMBEDDING_DIM)
+        with self._lock:
+            best = self._delta.best_match(query, threshold)
+            if len(self._base_keys):
+                if self._ivf is not None:
+                    centroids, order, offsets = self._ivf
+                    probes = np.argsort(self._centroid_norms - 2.0 * centroids @ query[0])[:self.nprobe]
+                    rows = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probes])
+                else:
+                    rows = np.arange(len(self._base_keys))
+                rows = rows[~self._dead[rows]]
+                if len(rows):
+                    # float32 ranking of the candidates, then exact distances for the closest few
+                    approx = self._base_norms[rows] - 2.0 * self._base[rows] @ query[0]
+                    rows = rows[np.argsort(approx)[:RERANK]]
+                    distances = np.linalg.norm(self._base[rows].astype(np.float64) - query.astype(np.float64), axis=1)
+                    column = int(distances.argmin())
+                    distance = float(distances[column])
+                    if distance < threshold and (best is None or distance < best["distance"]):
+                        row = rows[column]
+                        best = {
+                            self.key_field: self._base_keys[row],
+                            self.name_field: self._base_names[row],
+                            "_id": self._base_ids[row],
+                            "distance": distance,
+                        }
+        return best
+
+    # ---- keeping up with the collection ---------------------------------------------
+
+    def sync(self):
+        """
+        Load or build on first use, then catch up with registrations made by other workers
+        and with embeddings rewritten in place.
+        """
+        if self.collection is None:
+            return
+        with self._lock:
+            if not self._loaded:
+                started = time.time()
+                if self.load():
+                    print(f"✅ {self.label} duplicate index loaded: {len(self)} embeddings "
+                          f"in {time.time() - started:.2f}s")
+                else:
+                    self.build(find_embeddings(self.collection, {}, self._fields))
+                    print(f"✅ {self.label} duplicate index built: {len(self)} embeddings "
+                          f"in {time.time() - started:.2f}s")
+                    try:
+                        self.save()
+                    except Exception as e:
+                        print(f"Could not save {self.label} duplicate index {self.path}: {e}")
+
+            query = {}
+            if self._watermark is not None and ObjectId is not None:
+                query = {"_id": {"$gte": ObjectId.from_datetime(self._watermark - CATCHUP_SLACK)}}
+            if query:
+                for doc in find_embeddings(self.collection, query, self._fields):
+                    _id, key = doc.get("_id"), doc.get(self.key_field)
+                    if _id in self._skipped or (key is not None and self._ids_by_key.get(key) == _id):
+                        continue
+                    embedding = decode_embedding(doc)
+                    if embedding is None or embedding.shape != (EMBEDDING_DIM,) or key is None:
+                        self._skipped.add(_id)
+                        self._doc_count += 1
+                        continue
+                    self.add(key, doc.get(self.name_field), embedding, _id)
+
+            if self.updated_field and not self._catch_up_rewrites():
+                return
+
+            count = self.collection.estimated_document_count()
+            if count != self._doc_count:
+                # documents were deleted or rewritten outside the registration path
+                self._rebuild(f"{count} documents")
+
+    def _catch_up_rewrites(self) -> bool:
+        """
+        Replace embeddings rewritten in place (same ``_id``, e.g. by reembed.py) since the newest
+        ``updated_field`` seen, which the ``_id`` catch-up and the document count cannot notice.
+        False if that took a full rebuild.
+        """
+        # $gte: stamps are stored to the millisecond, so one equal to the newest seen may be new
+        query = ({self.updated_field: {"$gte": self._updated}} if self._updated is not None
+                 else {self.updated_field: {"$exists": True}})
+        changed = self.collection.count_documents(query)
+        if not changed:
+            return True
+        if changed > max(self.min_compact, self.compact_ratio * len(self)):
+            # a re-embedding run: one rebuild instead of replacing row by row
+            self._rebuild(f"{changed} embeddings rewritten")
+            return False
+        for doc in find_embeddings(self.collection, query, self._fields):
+            self._see_updated(doc)
+            _id, key = doc.get("_id"), doc.get(self.key_field)
+            embedding = decode_embedding(doc)
+            if embedding is None or embedding.shape != (EMBEDDING_DIM,) or key is None:
+                continue
+            # a known document (or one skipped for its old embedding) is already counted
+            counted = self._ids_by_key.get(key) != _id and _id not in self._skipped
+            self._skipped.discard(_id)
+            self.add(key, doc.get(self.name_field), embedding, _id, counted=counted)
+        return True
+
+    def _rebuild(self, reason):
+        started = time.time()
+        self.build(find_embeddings(self.collection, {}, self._fields))
+        print(f"✅ {self.label} duplicate index rebuilt ({reason}) in {time.time() - started:.2f}s")
+        try:
+            self.save()
+        except Exception as e:
+            print(f"Could not save {self.label} duplicate index {self.path}: {e}")
+
+    def find_duplicate(self, embedding, threshold: float = MATCH_THRESHOLD) -> Optional[dict]:
+        """``sync`` then ``search``: the registration duplicate check."""
+        self.sync()
+        return self.search(embedding, threshold)
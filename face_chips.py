@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Face chips kept at registration so embeddings can be recomputed later.
+
+A chip is the registered face box padded by half its size on every side
+(enough context for dlib to re-fit landmarks and re-align), downscaled to at
+most ``CHIP_MAX_SIDE`` px and JPEG-encoded, a few KB per person. It is stored
+in GridFS or a local directory; the registering document gets a small
+``faceChip`` reference (store, ref, face box inside the chip) that
+reembed.py follows.
+"""
+
+import os
+import re
+from typing import Optional
+
+import cv2
+import numpy as np
+
+CHIP_FIELD = "faceChip"
+CHIP_PADDING = 0.5
+CHIP_MAX_SIDE = 224
+CHIP_JPEG_QUALITY = 90
+
+
+def make_chip(frame, face_location, padding: float = CHIP_PADDING, max_side: int = CHIP_MAX_SIDE,
+              quality: int = CHIP_JPEG_QUALITY):
+    """
+    JPEG chip around ``face_location`` ((top, right, bottom, left) in ``frame``).
+
+    Returns:
+        (jpeg bytes, face location inside the chip) or None if encoding failed.
+    """
+    top, right, bottom, left = (int(v) for v in face_location)
+    height, width = frame.shape[:2]
+    pad_y, pad_x = int((bottom - top) * padding), int((right - left) * padding)
+    y1, y2 = max(0, top - pad_y), min(height, bottom + pad_y)
+    x1, x2 = max(0, left - pad_x), min(width, right + pad_x)
+    chip = frame[y1:y2, x1:x2]
+    scale = min(1.0, max_side / max(chip.shape[:2]))
+    if scale < 1.0:
+        chip = cv2.resize(chip, (max(1, round(chip.shape[1] * scale)), max(1, round(chip.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA)
+    ok, jpeg = cv2.imencode(".jpg", chip, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        return None
+    box = [round((top - y1) * scale), round((right - x1) * scale),
+           round((bottom - y1) * scale), round((left - x1) * scale)]
+    return jpeg.tobytes(), box
+
+
+def decode_chip(data):
+    """BGR image of a stored chip."""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+class LocalChipStore:
+    """Chips as ``<directory>/<collection>/<key>.jpg``."""
+
+    name = "local"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def put(self, collection, key, data, metadata=None):
+        safe_key = re.sub(r"[^\w.-]", "_", str(key))
+        ref = os.path.join(collection, f"{safe_key}.jpg")
+        path = os.path.join(self.directory, ref)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return ref
+
+    def get(self, ref):
+        with open(os.path.join(self.directory, ref), "rb") as f:
+            return f.read()
+
+
+class GridFSChipStore:
+    """Chips in the ``face_chips`` GridFS bucket of the application database."""
+
+    name = "gridfs"
+
+    def __init__(self, db, bucket="face_chips"):
+        import gridfs
+        self.fs = gridfs.GridFS(db, collection=bucket)
+
+    def put(self, collection, key, data, metadata=None):
+        return self.fs.put(data, filename=f"{collection}/{key}", contentType="image/jpeg",
+                           metadata=dict(metadata or {}, collection=collection, key=key))
+
+    def get(self, ref):
+        return self.fs.get(ref).read()
+
+
+def open_chip_store(kind: str, db=None, directory: str = "db/face_chips"):
+    """``gridfs`` / ``local`` store, or None for ``off`` (or GridFS without a database)."""
+    kind = (kind or "off").lower()
+    if kind == "gridfs":
+        return GridFSChipStore(db) if db is not None else None
+    if kind == "local":
+        return LocalChipStore(directory)
+    return None
+
+
+def store_chip(store, collection, key, frame, face_location, metadata=None) -> Optional[dict]:
+    """Save the chip of a registration; returns the ``faceChip`` reference for its document, or None."""
+    chip = make_chip(frame, face_location)
+    if chip is None:
+        return None
+    data, box = chip
+    ref = store.put(collection, key, data, metadata)
+    return {"store": store.name, "ref": ref, "box": box, "bytes": len(data)}
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Decode-once request frames.
+
+A Frame is built once per request from the upload and handed to every stage
+(liveness, recognition, face chips, quality checks). Derived images are
+computed on first use and kept for the rest of the request, so the BGR->RGB
+conversion, the detector-sized copy, the detector output and the per-model
+face crops are each produced at most once even when several stages (or the
+multi-face check and its single-face fallback) need them.
+
+Frames are per request and not shared between threads, so the views are
+cached without locking. Stages still accept plain BGR arrays (scripts,
+tests); Frame.wrap turns those into a throwaway Frame.
+
+A Frame also carries the request's admission Deadline (admission.py), so the
+stages it is handed to can stop once the request can no longer be answered
+in time.
+"""
+
+import cv2
+import numpy as np
+
+from face_upload import decode_frame
+from performance_optimizations import image_hash
+
+
+class Frame:
+    """
+    Decoded image of one request with lazily cached views.
+
+    Args:
+        bgr: decoded BGR image (not modified by any stage).
+        scale: original image pixels per frame pixel (reduced JPEG decode).
+        deadline: admission.Deadline of the request, or None for no time limit.
+    """
+
+    __slots__ = ("bgr", "scale", "deadline", "_views")
+
+    def __init__(self, bgr: np.ndarray, scale: int = 1, deadline=None):
+        self.bgr = bgr
+        self.scale = scale
+        self.deadline = deadline
+        self._views = {}
+
+    @classmethod
+    def wrap(cls, image) -> "Frame":
+        """``image`` itself if it is a Frame, else a Frame around the BGR array."""
+        return image if isinstance(image, cls) else cls(image)
+
+    @classmethod
+    def from_upload(cls, image_data, target_side: int = 0, deadline=None):
+        """Frame of an uploaded image (see face_upload.decode_frame), or None if it cannot be decoded."""
+        bgr, scale = decode_frame(image_data, target_side=target_side, return_scale=True)
+        return cls(bgr, scale, deadline) if bgr is not None else None
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    @property
+    def height(self) -> int:
+        return self.bgr.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.bgr.shape[1]
+
+    def cached(self, key, compute):
+        """``compute()`` the first time ``key`` is asked for, the stored result afterwards."""
+        try:
+            return self._views[key]
+        except KeyError:
+            value = self._views[key] = compute()
+            return value
+
+    @property
+    def rgb(self) -> np.ndarray:
+        """RGB copy, for face_recognition/dlib."""
+        return self.cached("rgb", lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB))
+
+    @property
+    def gray(self) -> np.ndarray:
+        """Grayscale copy, for the Haar/quality checks."""
+        return self.cached("gray", lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY))
+
+    @property
+    def hash(self) -> str:
+        """Content hash (performance_optimizations.image_hash) for the encoding cache."""
+        return self.cached("hash", lambda: image_hash(self.bgr))
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory embedding index for 1:N face matching.
+
+All embeddings live in one contiguous float32 (N, 128) matrix with parallel
+arrays for the key (e.g. studentId), display name and Mongo _id, so a lookup
+is a single vectorized distance computation instead of a Python loop over
+the collection. Rows are added/replaced incrementally on registration.
+"""
+
+import datetime
+import os
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from bson.binary import Binary
+except ImportError:
+    Binary = None
+
+EMBEDDING_DIM = 128
+# face_recognition's usual tolerance is 0.6; this service has always matched at 0.3
+MATCH_THRESHOLD = 0.3
+
+# Encoder settings of face_recognition.face_encodings, shared by the server (app.encode_faces),
+# bulk_enroll.py and reembed.py: stored and live embeddings must come from the same encoder for
+# MATCH_THRESHOLD to hold, so change them together with a reembed.py run
+FACE_ENCODER_MODEL = os.environ.get('FACE_ENCODER_MODEL', 'small')
+FACE_ENCODER_JITTERS = int(os.environ.get('FACE_ENCODER_JITTERS', '1'))
+
+# Embedding storage. Legacy documents hold a list of 128 BSON doubles (the Node
+# backend still reads it); the compact format is one Binary blob: a 4-byte
+# header (magic, format version, reserved) and little-endian float32 values,
+# readable with np.frombuffer without going through Python floats.
+EMBEDDING_FIELD = "embedding"
+EMBEDDING_BINARY_FIELD = "embedding_f32"
+EMBEDDING_FORMAT_VERSION = 1
+# Set whenever a document's embedding is written (not by the Node backend's own updates), so the
+# galleries can tell a re-embedded collection from one whose other fields changed
+EMBEDDING_UPDATED_FIELD = "embeddingUpdatedAt"
+_EMBEDDING_MAGIC = b"FE"
+_EMBEDDING_HEADER = 4
+
+
+def encode_embedding(embedding):
+    """Compact stored form of ``embedding`` (BSON Binary when bson is available)."""
+    header = _EMBEDDING_MAGIC + bytes([EMBEDDING_FORMAT_VERSION, 0])
+    payload = header + np.asarray(embedding, dtype="<f4").tobytes()
+    return Binary(payload) if Binary is not None else payload
+
+
+def decode_embedding(document) -> Optional[np.ndarray]:
+    """float32 embedding of a document in either format, or None if it has none (or an unknown version)."""
+    blob = document.get(EMBEDDING_BINARY_FIELD)
+    if blob is not None:
+        if len(blob) < _EMBEDDING_HEADER or bytes(blob[:2]) != _EMBEDDING_MAGIC or blob[2] != EMBEDDING_FORMAT_VERSION:
+            return None
+        return np.frombuffer(blob, dtype="<f4", offset=_EMBEDDING_HEADER)
+    embedding = document.get(EMBEDDING_FIELD)
+    if embedding is None:
+        return None
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def embedding_document_fields(embedding, binary: bool = True) -> dict:
+    """
+    Stored embedding fields of a new or re-embedded document: the legacy list, plus the
+    compact blob if ``binary``, stamped with EMBEDDING_UPDATED_FIELD.
+    """
+    fields = {EMBEDDING_FIELD: np.asarray(embedding, dtype=np.float64).tolist()}
+    if binary:
+        fields[EMBEDDING_BINARY_FIELD] = encode_embedding(embedding)
+    fields[EMBEDDING_UPDATED_FIELD] = datetime.datetime.utcnow()
+    return fields
+
+
+def find_embeddings(collection, query: dict, fields: Iterable[str]):
+    """
+    Documents matching ``query`` with ``fields`` and their embedding, fetching only the
+    compact blob for migrated documents and the legacy list for the rest.
+    """
+    projection = {field: 1 for field in fields}
+    binary_query = dict(query, **{EMBEDDING_BINARY_FIELD: {"$exists": True}})
+    yield from collection.find(binary_query, dict(projection, **{EMBEDDING_BINARY_FIELD: 1}))
+    legacy_query = dict(query, **{EMBEDDING_BINARY_FIELD: {"$exists": False}})
+    yield from collection.find(legacy_query, dict(projection, **{EMBEDDING_FIELD: 1}))
+
+
+class EmbeddingIndex:
+    """
+    Thread-safe nearest-neighbour index over face embeddings.
+
+    Args:
+        key_field (str): document field used as the unique key (``studentId``, ``teacherName``).
+        name_field (str): document field returned as the display name.
+        dim (int): embedding size.
+    """
+
+    def __init__(self, key_field: str = "studentId", name_field: str = "name", dim: int = EMBEDDING_DIM):
+        self.key_field = key_field
+        self.name_field = name_field
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._embeddings = np.zeros((0, dim), dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._size = 0
+        self._keys: List[str] = []
+        self._names: List[str] = []
+        self._ids: List[object] = []
+        self._rows = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, key) -> bool:
+        return key in self._rows
+
+    def _reserve(self, size: int):
+        # amortized growth so registrations do not copy the matrix every time
+        if size <= len(self._embeddings):
+            return
+        capacity = max(size, 2 * len(self._embeddings), 64)
+        embeddings = np.zeros((capacity, self.dim), dtype=np.float32)
+        embeddings[:self._size] = self._embeddings[:self._size]
+        norms = np.zeros(capacity, dtype=np.float32)
+        norms[:self._size] = self._norms[:self._size]
+        self._embeddings, self._norms = embeddings, norms
+
+    def build(self, documents: Iterable[dict]) -> "EmbeddingIndex":
+        """Replace the contents with ``documents`` (Mongo docs with an embedding in either format)."""
+        keys, names, ids, vectors = [], [], [], []
+        for doc in documents:
+            embedding = decode_embedding(doc)
+            if embedding is None or embedding.shape != (self.dim,) or doc.get(self.key_field) is None:
+                continue
+            keys.append(doc[self.key_field])
+            names.append(doc.get(self.name_field))
+            ids.append(doc.get("_id"))
+            vectors.append(embedding)
+        embeddings = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            self._embeddings = embeddings
+            self._norms = np.einsum("ij,ij->i", embeddings, embeddings)
+            self._size = len(keys)
+            self._keys, self._names, self._ids = keys, names, ids
+            # later duplicates of a key win, like add() would
+            self._rows = {key: row for row, key in enumerate(keys)}
+        return self
+
+    def add(self, key, name, embedding, _id=None):
+        """Add one embedding, replacing the row of an existing ``key``."""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                row = self._size
+                self._reserve(row + 1)
+                self._size += 1
+                self._keys.append(key)
+                self._names.append(name)
+                self._ids.append(_id)
+                self._rows[key] = row
+            else:
+                self._names[row] = name
+                self._ids[row] = _id
+            self._embeddings[row] = vector
+            self._norms[row] = vector @ vector
+
+    def remove(self, key) -> bool:
+        """Drop ``key`` by moving the last row into its place."""
+        with self._lock:
+            row = self._rows.pop(key, None)
+            if row is None:
+                return False
+            last = self._size - 1
+            if row != last:
+                self._embeddings[row] = self._embeddings[last]
+                self._norms[row] = self._norms[last]
+                self._keys[row], self._names[row], self._ids[row] = self._keys[last], self._names[last], self._ids[last]
+                self._rows[self._keys[row]] = row
+            self._keys.pop()
+            self._names.pop()
+            self._ids.pop()
+            self._size = last
+            return True
+
+    def snapshot(self) -> Tuple[list, list, list, np.ndarray]:
+        """Copies of (keys, names, ids, embeddings) in row order."""
+        with self._lock:
+            return (list(self._keys), list(self._names), list(self._ids),
+                    self._embeddings[:self._size].copy())
+
+    def distances(self, queries, keys: Optional[Iterable] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Euclidean distances between every query and the indexed (or only ``keys``') embeddings.
+
+        Returns:
+            (distances, rows): (M, K) float32 distances and the K index rows they refer to.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            if keys is None:
+                rows = np.arange(self._size)
+                embeddings, norms = self._embeddings[:self._size], self._norms[:self._size]
+            else:
+                rows = np.array([self._rows[key] for key in keys if key in self._rows], dtype=int)
+                embeddings, norms = self._embeddings[rows], self._norms[rows]
+            # |q - e|^2 = |q|^2 + |e|^2 - 2 q.e in one matrix product
+            squared = (queries * queries).sum(axis=1)[:, None] + norms[None, :] - 2.0 * queries @ embeddings.T
+        return np.sqrt(np.maximum(squared, 0.0)), rows
+
+    def search(self, queries, threshold: float = MATCH_THRESHOLD, keys: Optional[Iterable] = None) -> List[Optional[dict]]:
+        """
+        Nearest indexed face for each query embedding, if closer than ``threshold``.
+
+        Returns:
+            List[Optional[dict]]: per query ``{key_field, name_field, "_id", "distance"}`` or None.
+        """
+        with self._lock:
+            # same lock as distances() so rows cannot move under a concurrent remove()
+            distances, rows = self.distances(queries, keys)
+            if distances.shape[1] == 0:
+                return [None] * len(distances)
+            matches = []
+            for query, column in enumerate(distances.argmin(axis=1)):
+                distance = float(distances[query, column])
+                row = rows[column]
+                if distance >= threshold:
+                    matches.append(None)
+                    continue
+                matches.append({
+                    self.key_field: self._keys[row],
+                    self.name_field: self._names[row],
+                    "_id": self._ids[row],
+                    "distance": distance,
+                })
+        return matches
+
+    def best_match(self, queries, threshold: float = MATCH_THRESHOLD, keys: Optional[Iterable] = None) -> Optional[dict]:
+        """Closest match over all query embeddings (e.g. every face in a frame), or None."""
+        matches = [match for match in self.search(queries, threshold, keys) if match is not None]
+        return min(matches, key=lambda match: match["distance"]) if matches else None
+
+
+def collection_signature(collection, updated_field: Optional[str] = None) -> tuple:
+    """
+    Cheap change signature of a collection: the estimated document count and the newest ``_id``
+    (inserts and deletes), plus the newest ``updated_field`` if one is given (rewrites in place).
+    """
+    count = collection.estimated_document_count()
+    last = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    signature = (count, last["_id"] if last else None)
+    if not updated_field:
+        return signature
+    newest = collection.find_one(
+        {updated_field: {"$exists": True}}, {updated_field: 1}, sort=[(updated_field, -1)])
+    return signature + (newest.get(updated_field) if newest else None,)
+
+
+class CollectionWatch:
+    """
+    Tells whether ``collection_signature`` moved since the last look, checking at most every
+    ``check_s`` seconds; for caches of single documents that cannot afford a read per lookup.
+
+    Args:
+        collection: pymongo collection (or None when the database is down).
+        check_s (float): minimum seconds between signature checks.
+        updated_field (str): optional indexed embedding-modified field (EMBEDDING_UPDATED_FIELD).
+        label (str): used in log lines.
+    """
+
+    def __init__(self, collection, check_s: float = 60.0, updated_field: Optional[str] = None,
+                 label: str = "face"):
+        self.collection = collection
+        self.check_s = check_s
+        self.updated_field = updated_field
+        self.label = label
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def changed(self) -> bool:
+        """True once per signature change (not on the first check, which only records it)."""
+        if self.collection is None or time.time() - self._checked_at < self.check_s:
+            return False
+        with self._lock:
+            now = time.time()
+            if now - self._checked_at < self.check_s:
+                return False
+            self._checked_at = now
+            try:
+                signature = collection_signature(self.collection, self.updated_field)
+            except Exception as e:
+                print(f"Database error during {self.label} change check: {e}")
+                return False
+            changed = self._signature is not None and signature != self._signature
+            self._signature = signature
+            return changed
+
+
+class CollectionGallery:
+    """
+    Process-wide EmbeddingIndex over a Mongo collection.
+
+    Loaded on first use (per process: gunicorn --preload forks after import),
+    grown in place by ``add`` on registration, and rebuilt when the
+    collection's signature (``collection_signature``) changes, checked at
+    most every ``check_s`` seconds. Use a field written only with the embedding
+    (EMBEDDING_UPDATED_FIELD), not a general ``updatedAt`` that other writers
+    bump, or unrelated updates rebuild the gallery.
+
+    Args:
+        collection: pymongo collection (or None when the database is down).
+        key_field (str): unique key of a document.
+        name_field (str): display name of a document.
+        check_s (float): minimum seconds between signature checks.
+        updated_field (str): optional indexed embedding-modified field (EMBEDDING_UPDATED_FIELD).
+        label (str): used in log lines.
+    """
+
+    def __init__(self, collection, key_field: str, name_field: str, check_s: float = 60.0,
+                 updated_field: Optional[str] = None, label: str = "face"):
+        self.collection = collection
+        self.index = EmbeddingIndex(key_field=key_field, name_field=name_field)
+        self.check_s = check_s
+        self.updated_field = updated_field
+        self.label = label
+        self._fields = (key_field, name_field)
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current_signature(self):
+        return collection_signature(self.collection, self.updated_field)
+
+    def get(self) -> EmbeddingIndex:
+        """The index, (re)built from the collection if it is missing or stale."""
+        if self.collection is None or (self._signature is not None and
+                                       time.time() - self._checked_at < self.check_s):
+            return self.index
+        with self._lock:
+            now = time.time()
+            if self._signature is not None and now - self._checked_at < self.check_s:
+                return self.index
+            try:
+                signature = self._current_signature()
+                if signature != self._signature:
+                    started = time.time()
+                    self.index.build(find_embeddings(self.collection, {}, self._fields))
+                    print(f"✅ {self.label} gallery built: {len(self.index)} embeddings "
+                          f"in {time.time() - started:.2f}s")
+                self._signature, self._checked_at = signature, now
+            except Exception as e:
+                print(f"Database error during {self.label} gallery build: {e}")
+        return self.index
+
+    def add(self, key, name, embedding, _id=None):
+        """Add a freshly registered document without reloading the collection."""
+        with self._lock:
+            self.index.add(key, name, embedding, _id)
+            if self.collection is None or self._signature is None:
+                # not loaded yet: the first get() reads the new document anyway
+                return
+            try:
+                # our own insert must not look like a change made elsewhere
+                self._signature = self._current_signature()
+            except Exception as e:
+                print(f"Database error during {self.label} gallery check: {e}")
+
+    def fetch_missing(self, keys: Iterable):
+        """Load ``keys`` not in the index yet (registered by another worker since the last check)."""
+        missing = [key for key in keys if key not in self.index]
+        if not missing or self.collection is None:
+            return
+        try:
+            for doc in find_embeddings(self.collection, {self.index.key_field: {"$in": missing}}, self._fields):
+                embedding = decode_embedding(doc)
+                if embedding is not None and embedding.shape == (self.index.dim,):
+                    self.index.add(doc[self.index.key_field], doc.get(self.index.name_field),
+                                   embedding, doc["_id"])
+        except Exception as e:
+            print(f"Database error during {self.label} fetch: {e}")
+
+    def invalidate(self):
+        """Force a rebuild on the next ``get``."""
+        with self._lock:
+            self._signature = None
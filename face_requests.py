@@ -0,0 +1,586 @@
+# -*- coding: utf-8 -*-
+"""
+Request logic of the face endpoints, shared by both front ends.
+
+Validation, the order of the checks, the user-facing messages and the status
+codes of /student/attend, /student/join, /student/register, /teacher/register
+and /teacher/login live here once. Each handler takes the parsed upload and
+a FaceIO, and returns ``(body, status)``. The FaceIO does the database reads
+and writes and runs the CPU stages:
+
+* app.FaceIO calls pymongo and the pipeline directly (Flask, sync);
+* asgi_app.AsyncFaceIO uses Motor and runs the stages on the face executor.
+
+The handlers are coroutines so that the asyncio front end can await its I/O.
+Under Flask nothing they await ever suspends, so ``run_sync`` drives them to
+completion in the request thread without an event loop.
+"""
+
+import datetime
+import traceback
+from math import radians, cos, sin, sqrt, atan2
+
+# Students must be within this many meters of the teacher to attend
+ATTEND_RADIUS_M = 100
+
+
+class FaceIO:
+    """
+    Database access and pipeline stages used by the handlers. Every method is a coroutine.
+
+    ``has_database`` tells whether registrations can be saved.
+    """
+
+    has_database = False
+
+    async def decode(self, image_data):
+        """The request Frame, or None if undecodable (raises on a malformed data URL)."""
+        raise NotImplementedError
+
+    async def classroom_session(self, attendance_id):
+        """Cached ClassroomSession of ``attendance_id`` (classroom_cache.py), or None."""
+        raise NotImplementedError
+
+    async def refresh_roster(self, session):
+        """Re-read the roster of a cached session (rate-limited by the cache)."""
+        raise NotImplementedError
+
+    async def attendance_location(self, attendance_id):
+        """(latitude, longitude) of the teacher from the attendance record, (None, None) if unknown."""
+        raise NotImplementedError
+
+    async def student_exists(self, student_id) -> bool:
+        raise NotImplementedError
+
+    async def teacher_exists(self, teacher_name) -> bool:
+        raise NotImplementedError
+
+    async def recognize_student(self, frame, student_id, classroom_gallery=None):
+        """(name, matched user, liveness result) of app.recognize_face_with_liveness."""
+        raise NotImplementedError
+
+    async def recognize_teacher(self, frame, teacher_name):
+        """(name, matched teacher, liveness result) of app.recognize_teacher_with_liveness."""
+        raise NotImplementedError
+
+    async def verify_liveness(self, frame):
+        """(is_live, confidence, message, face location) of app.verify_liveness_first."""
+        raise NotImplementedError
+
+    async def encode(self, frame, face_location):
+        """(encodings, locations) at the liveness box (or re-detected when there is none)."""
+        raise NotImplementedError
+
+    async def find_duplicate(self, kind, embedding):
+        """Closest registered 'student' or 'teacher' within the match threshold, or None."""
+        raise NotImplementedError
+
+    async def save_student(self, student_id, name, embedding, frame, face_location):
+        """Insert a new user and add it to the galleries; returns the inserted _id or None."""
+        raise NotImplementedError
+
+    async def save_teacher(self, teacher_name, embedding, frame, face_location):
+        """Insert a new teacher and add it to the galleries; returns the inserted _id or None."""
+        raise NotImplementedError
+
+
+def run_sync(coroutine):
+    """Result of a handler whose I/O never suspends (app.FaceIO), without an event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration as done:
+        return done.value
+    coroutine.close()
+    raise RuntimeError("face request handler suspended outside an event loop")
+
+
+def has_image(image_data):
+    return image_data is not None and len(image_data) > 0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    R = 6371000  # Earth radius in meters
+    try:
+        phi1, phi2 = radians(lat1), radians(lat2)
+        delta_phi = radians(lat2 - lat1)
+        delta_lambda = radians(lon2 - lon1)
+        a = sin(delta_phi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(delta_lambda / 2) ** 2
+        c = 2 * atan2(sqrt(a), sqrt(1 - a))
+        return R * c
+    except Exception:
+        return float('inf')
+
+
+def as_float(value):
+    """Coordinates from form fields and query strings arrive as text."""
+    try:
+        return float(value) if value is not None and value != '' else None
+    except (TypeError, ValueError):
+        return None
+
+
+def liveness_check(liveness_result):
+    is_live, confidence, message = liveness_result
+    return {"is_live": bool(is_live), "confidence": float(confidence), "message": str(message)}
+
+
+def spoof_response(liveness_result):
+    return {
+        "success": False,
+        "verified": False,
+        "message": f"{liveness_result[2]}",
+        "liveness_check": liveness_check(liveness_result)
+    }, 401
+
+
+async def attend_class(upload, io: FaceIO):
+    try:
+        data = upload.data
+        studentId = data.get('studentId')
+        image_data = upload.image
+        classroom_students = data.get('classroom_students')
+        attendance_id = data.get('attendance_id')
+
+        # Student location
+        longitude = as_float(data.get('longitude'))
+        latitude = as_float(data.get('latitude'))
+
+        teacher_latitude = None
+        teacher_longitude = None
+
+        # Cached session: teacher location and classroom roster without a database round trip
+        session = await io.classroom_session(attendance_id)
+        if session is not None and session.ended and not classroom_students:
+            return {
+                "success": False,
+                "verified": False,
+                "message": "Ирцийн бүртгэл дууссан байна"
+            }, 400
+        if session is not None and not session.ended:
+            teacher_latitude = session.latitude
+            teacher_longitude = session.longitude
+        else:
+            session = None
+
+        # Fetch teacher location from attendance record in database
+        if session is None and attendance_id:
+            teacher_latitude, teacher_longitude = await io.attendance_location(attendance_id)
+
+        # Fallback: Try to get from request if not in database
+        if teacher_latitude is None or teacher_longitude is None:
+            teacher_latitude = as_float(data.get('teacher_latitude'))
+            teacher_longitude = as_float(data.get('teacher_longitude'))
+            print(f"ℹ️ Using teacher location from request: lat={teacher_latitude}, lon={teacher_longitude}")
+
+        # Check for required fields with detailed error messages
+        missing_fields = []
+        if not studentId:
+            missing_fields.append("studentId")
+        if not has_image(image_data):
+            missing_fields.append("image_base64")
+        if not classroom_students and session is None:
+            missing_fields.append("classroom_students")
+        if latitude is None:
+            missing_fields.append("student latitude")
+        if longitude is None:
+            missing_fields.append("student longitude")
+        if teacher_latitude is None:
+            missing_fields.append("teacher latitude")
+        if teacher_longitude is None:
+            missing_fields.append("teacher longitude")
+
+        if missing_fields:
+            print(f"❌ Missing fields: {missing_fields}")
+            if "teacher latitude" in missing_fields or "teacher longitude" in missing_fields:
+                message = "Багшийн байршил олдсонгүй. Багш анги эхлүүлсэн эсэхээ шалгана уу"
+            elif "student latitude" in missing_fields or "student longitude" in missing_fields:
+                message = "Байршлын мэдээллийн зөвшөөрлийг өгнө үү"
+            else:
+                message = f"Дутуу мэдээлэл: {', '.join(missing_fields)}"
+            return {"success": False, "message": message}, 400
+
+        # Check if student is part of the classroom
+        if session is not None:
+            if studentId not in session:
+                # may have joined the class after the session was cached
+                await io.refresh_roster(session)
+            is_member = studentId in session
+        else:
+            student_ids = [student.get('studentId') for student in classroom_students if isinstance(student, dict)]
+            is_member = studentId in student_ids
+
+        if not is_member:
+            return {
+                "success": False,
+                "verified": False,
+                "message": f"Та ангид байхгүй байна. Та эхлээд ангидаа элсээрэй"
+            }, 403
+
+        # Location check with dynamic teacher location
+        distance = haversine(teacher_latitude, teacher_longitude, latitude, longitude)
+        if distance > ATTEND_RADIUS_M:
+            return {
+                "success": False,
+                "verified": False,
+                "message": f"Та одоогоор ангидаа байхгүй байна. Сургуульдаа яваарай (Settings-ээсээ location зөвшөөрөл өгсөн эсэхээ шалгана уу)"
+            }, 403
+
+        try:
+            frame = await io.decode(image_data)
+        except Exception:
+            return {"success": False, "message": "Failed to decode image"}, 400
+        if frame is None:
+            return {"success": False, "message": "Failed to decode image"}, 400
+
+        # Face Recognition with Liveness Detection (liveness checked first)
+        name, matched_user, liveness_result = await io.recognize_student(
+            frame, studentId, session.gallery if session is not None else None)
+
+        if name == 'spoof_detected':
+            return spoof_response(liveness_result)
+
+        # No recognizable face in frame
+        if name in ['unknown_person', 'no_persons_found'] or not matched_user:
+            return {
+                "success": False,
+                "verified": False,
+                "message": "Ангийн сурагчдын дунд царай танигдаагүй байна"
+            }, 401
+
+        # Face mismatch
+        if matched_user.get('studentId') != studentId:
+            return {
+                "success": False,
+                "verified": False,
+                "message": f"Таны бүртгүүлсэн царай болон дугаар таарахгүй байна"
+            }, 403
+
+        response_data = {
+            "success": True,
+            "verified": True,
+            "message": "Student verified successfully",
+            "studentId": studentId,
+            "name": matched_user.get('name', name),
+            "distance_from_teacher": round(distance, 2)
+        }
+        if liveness_result:
+            response_data["liveness_check"] = liveness_check(liveness_result)
+        return response_data, 200
+
+    except Exception as e:
+        traceback.print_exc()
+        return {"success": False, "message": f"Internal Server Error: {str(e)}"}, 500
+
+
+async def student_join(upload, io: FaceIO):
+    try:
+        data = upload.data
+        studentId = data.get('studentId')
+        image_data = upload.image
+
+        if not studentId:
+            return {"success": False, "message": "Missing studentId"}, 400
+        if not has_image(image_data):
+            return {"success": False, "message": "Missing face image for verification"}, 400
+
+        # Check if student exists in the database
+        if not await io.student_exists(studentId):
+            return {
+                "success": False,
+                "verified": False,
+                "message": "Та хараахан бүртгүүлээгүй байна"
+            }, 404
+
+        try:
+            frame = await io.decode(image_data)
+        except Exception as e:
+            print(f"Image decoding error: {e}")
+            return {"success": False, "message": f"Failed to decode image: {str(e)}"}, 400
+        if frame is None:
+            return {"success": False, "message": "Decoded image is empty or invalid"}, 400
+
+        # Verify face with liveness check first
+        name, matched_user, liveness_result = await io.recognize_student(frame, studentId)
+
+        if name == 'spoof_detected':
+            return spoof_response(liveness_result)
+        if name == 'no_persons_found':
+            return {
+                "success": False,
+                "verified": False,
+                "message": "Өгөгдсөн зурагнаас царай олдсонгүй"
+            }, 400
+        elif name == 'unknown_person':
+            return {"success": False, "verified": False, "message": "Царайг таньсангүй"}, 401
+
+        # If face is detected, but the user does not match, handle the mismatch
+        if not matched_user or matched_user.get('studentId') != studentId:
+            return {
+                "success": False,
+                "verified": False,
+                "message": "Илэрсэн царай нь өгсөн оюутны дугаартай таарахгүй байна"
+            }, 403
+
+        return {
+            "success": True,
+            "verified": True,
+            "message": f"Та ангидаа амжилттай элслээ",
+            "name": matched_user.get('name', name)
+        }, 200
+
+    except Exception as e:
+        print(f"General error: {str(e)}")
+        return {"success": False, "message": f"An error occurred: {str(e)}"}, 500
+
+
+async def live_registration_face(io: FaceIO, frame, log_prefix):
+    """
+    Liveness then encoding of a registration photo.
+    Returns (encoding, face location, None) or (None, None, error response).
+    """
+    try:
+        is_live, confidence, message, face_location = await io.verify_liveness(frame)
+    except Exception as e:
+        print(f"{log_prefix}Liveness detection error: {e}")
+        return None, None, ({
+            "success": False,
+            "message": "Liveness detection failed. Please try again with a live camera feed.",
+            "error": str(e)
+        }, 500)
+    if not is_live:
+        print(f"{log_prefix}Liveness check failed: {message}")
+        return None, None, ({
+            "success": False,
+            "message": f"{message}",
+            "liveness_check": liveness_check((is_live, confidence, message))
+        }, 400)
+    print(f"{log_prefix}Liveness check passed: {message}")
+
+    # Only proceed with face encoding if liveness passed
+    try:
+        face_encodings, encoded_locations = await io.encode(frame, face_location)
+    except Exception as e:
+        print(f"{log_prefix}Error during face encoding: {e}")
+        return None, None, ({"success": False, "message": "Face recognition failed"}, 500)
+    if not face_encodings:
+        print(f"{log_prefix}No face detected in image")
+        return None, None, ({"success": False, "message": "Зураг дээр ямар ч царай илэрсэнгүй"}, 400)
+    return face_encodings[0], encoded_locations[0], None
+
+
+async def register_student(upload, io: FaceIO, face_recognition_available=True):
+    try:
+        if not face_recognition_available:
+            print("Face recognition not available")
+            return {
+                "success": False,
+                "message": "Царай таних боломжгүй. Админтай холбогдоно уу."
+            }, 503
+
+        data = upload.data
+        if not data:
+            return {"success": False, "message": "Invalid or missing JSON data"}, 400
+
+        studentId = data.get('studentId')
+        studentName = data.get('studentName')
+        image_data = upload.image
+        if not studentId or not studentName or not has_image(image_data):
+            print("Missing fields in request")
+            return {"success": False, "message": "Missing required fields"}, 400
+
+        # Check if studentId already exists
+        if io.has_database:
+            try:
+                if await io.student_exists(studentId):
+                    print("User already exists:", studentId)
+                    return {"success": False, "message": "Өгөгдсөн ID-тай хэрэглэгч аль хэдийн байна"}, 409
+            except Exception as e:
+                print(f"Database error during user check: {e}")
+                return {"success": False, "message": "Database connection error"}, 500
+
+        if isinstance(image_data, str) and ',' not in image_data:
+            print("Invalid image format, missing comma")
+            return {"success": False, "message": "Invalid image format"}, 400
+        try:
+            frame = await io.decode(image_data)
+        except Exception as e:
+            print(f"Error decoding image: {e}")
+            return {"success": False, "message": "Failed to decode image"}, 400
+        if frame is None:
+            print("Failed to decode image into frame")
+            return {"success": False, "message": "Failed to decode image"}, 400
+
+        # Check for liveness FIRST during registration
+        new_face_encoding, face_location, error = await live_registration_face(io, frame, "")
+        if error is not None:
+            return error
+
+        # Check for duplicate face (find closest match)
+        if io.has_database:
+            try:
+                closest_match = await io.find_duplicate('student', new_face_encoding)
+                if closest_match:
+                    print(f"Duplicate face detected. Closest match with studentId: {closest_match['studentId']} (distance: {closest_match['distance']})")
+                    return {
+                        "success": False,
+                        "message": f"Таны царайг {closest_match['studentId']} дор аль хэдийн бүртгүүлсэн байна."
+                    }, 409
+            except Exception as e:
+                print(f"Error checking duplicate faces: {e}")
+                return {"success": False, "message": "Error checking duplicate faces"}, 500
+
+        if not io.has_database:
+            print(f"No database connection, user {studentName} not saved")
+            return {"success": False, "message": "Database not connected"}, 500
+
+        try:
+            inserted_id = await io.save_student(studentId, studentName, new_face_encoding, frame, face_location)
+        except Exception as e:
+            print(f"Database error during user save: {e}")
+            return {"success": False, "message": "Failed to save user to database"}, 500
+        if not inserted_id:
+            print(f"User {studentName} save returned no inserted_id")
+            return {"success": False, "message": "Failed to save user to database"}, 500
+
+        print(f"User {studentName} registered successfully")
+        return {
+            "success": True,
+            "message": f"Хэрэглэгч {studentName} та амжилттай бүртгүүллээ!"
+        }, 200
+
+    except Exception:
+        traceback.print_exc()
+        return {"success": False, "message": "Internal Server Error"}, 500
+
+
+async def register_teacher(upload, io: FaceIO):
+    try:
+        data = upload.data
+        teacherName = data.get("teacherName")
+        image_data = upload.image
+
+        if not teacherName or not has_image(image_data):
+            return {"success": False, "message": "Missing required fields"}, 400
+        if isinstance(image_data, str) and ',' not in image_data:
+            return {"success": False, "message": "Invalid image format"}, 400
+
+        try:
+            frame = await io.decode(image_data)
+        except Exception as e:
+            print(f"Image decoding error: {e}")
+            return {"success": False, "message": "Failed to decode image"}, 400
+        if frame is None:
+            return {"success": False, "message": "Failed to decode image"}, 400
+
+        # Check for liveness FIRST during teacher registration
+        new_face_encoding, face_location, error = await live_registration_face(io, frame, "Teacher registration - ")
+        if error is not None:
+            return error
+
+        # Check if teacher name already exists
+        if await io.teacher_exists(teacherName):
+            return {"success": False, "message": "Багшийн нэр аль хэдийн бүртгэгдсэн байна"}, 409
+
+        try:
+            closest_match = await io.find_duplicate('teacher', new_face_encoding)
+            if closest_match:
+                print(f"Duplicate face detected. Closest match with teacher: {closest_match['teacherName']} (distance: {closest_match['distance']:.4f})")
+                return {
+                    "success": False,
+                    "message": f"{closest_match['teacherName']} багшийн нэрээр царай бүртгэлтэй байна. Давхар бүртгэл хийх боломжгүй."
+                }, 409
+        except Exception as e:
+            print(f"Error during face duplication check: {e}")
+            return {"success": False, "message": "Face duplication check failed"}, 500
+
+        if not await io.save_teacher(teacherName, new_face_encoding, frame, face_location):
+            return {"success": False, "message": "Failed to save teacher"}, 500
+
+        return {
+            "success": True,
+            "message": f"{teacherName} та багшаар амжилттай бүртгүүллээ!"
+        }, 200
+
+    except Exception:
+        traceback.print_exc()
+        return {"success": False, "message": "Internal Server Error"}, 500
+
+
+async def login_teacher(upload, io: FaceIO):
+    try:
+        data = upload.data
+        teacherName = data.get("teacherName")
+        image_data = upload.image
+
+        if not teacherName or not has_image(image_data):
+            print(f"❌ Missing fields - teacherName: {bool(teacherName)}, image: {has_image(image_data)}")
+            return {"success": False, "message": "Missing required fields"}, 400
+
+        try:
+            frame = await io.decode(image_data)
+        except Exception as e:
+            print(f"❌ Image decoding error: {e}")
+            return {"success": False, "message": "Failed to decode image"}, 400
+        if frame is None:
+            print("❌ Frame is None after decoding")
+            return {"success": False, "message": "Failed to decode image"}, 400
+
+        # Teacher login with liveness check first
+        name, matched_teacher, liveness_result = await io.recognize_teacher(frame, teacherName)
+
+        if name == 'spoof_detected':
+            print(f"❌ Teacher login - spoof detected")
+            return spoof_response(liveness_result)
+        if name in ['unknown_teacher', 'no_persons_found']:
+            print(f"❌ Face not recognized - returning 401")
+            return {"success": False, "verified": False, "message": "Ийм царай олдсонгүй"}, 401
+
+        # Check teacher name match
+        if matched_teacher['teacherName'] != teacherName:
+            print(f"❌ Teacher name mismatch - provided={teacherName}, matched={matched_teacher['teacherName']}")
+            return {
+                "success": False,
+                "verified": False,
+                "message": "Царай нь заасан багшийн нэртэй таарахгүй байна"
+            }, 403
+
+        print(f"✅ Login successful for {teacherName}")
+        response_data = {
+            "success": True,
+            "verified": True,
+            "teacherId": str(matched_teacher['_id']),
+            "teacherName": matched_teacher['teacherName'],
+            "message": f"Тавтай морил, {matched_teacher['teacherName']}!"
+        }
+        if liveness_result:
+            response_data["liveness_check"] = liveness_check(liveness_result)
+        return response_data, 200
+
+    except Exception as e:
+        print(f"❌ Exception in teacher login: {e}")
+        traceback.print_exc()
+        return {"success": False, "message": "Internal Server Error"}, 500
+
+
+def new_student_document(student_id, name, embedding_fields, chip_fields):
+    return {
+        "studentId": student_id,
+        "name": name,
+        "Classrooms": [],
+        **embedding_fields,
+        **chip_fields,
+        "created_at": datetime.datetime.now()
+    }
+
+
+def new_teacher_document(teacher_name, embedding_fields, chip_fields):
+    now = datetime.datetime.utcnow()
+    return {
+        "teacherName": teacher_name,
+        **embedding_fields,
+        **chip_fields,
+        "Classrooms": [],
+        "attendanceHistory": [],
+        "createdAt": now,
+        "updatedAt": now
+    }
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Face image uploads in JSON or binary form.
+
+Every face endpoint accepts:
+
+* ``application/json`` with the image as a ``data:`` URL in ``image_base64``
+  (the original mode, still used by the web frontend);
+* ``multipart/form-data`` with the JPEG as file part ``image`` and the other
+  fields as form fields (or as JSON in a ``metadata`` field);
+* a raw ``image/jpeg`` (or ``application/octet-stream``) body, with the other
+  fields in the query string or as JSON in the ``X-Face-Metadata`` header.
+
+Binary uploads skip the base64 inflation (about a third of the payload) and
+the intermediate str/bytes copies: a raw body is read from the request stream
+into one preallocated buffer that goes straight to ``cv2.imdecode``. The size
+limit is checked against Content-Length before anything is read, and while
+reading raw and JSON bodies sent without one (multipart needs a length).
+"""
+
+import base64
+import json
+
+import cv2
+import numpy as np
+
+from performance_optimizations import decode_image_reduced
+
+IMAGE_FIELD = "image"
+METADATA_FIELD = "metadata"
+METADATA_HEADER = "X-Face-Metadata"
+RAW_IMAGE_TYPES = ("image/jpeg", "image/jpg", "image/png", "application/octet-stream")
+READ_CHUNK = 64 * 1024
+
+
+class UploadError(Exception):
+    """Rejected upload; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class FaceUpload:
+    """Request fields and the image (data URL str or uint8 buffer) of a face request."""
+
+    __slots__ = ("data", "image", "mode", "size")
+
+    def __init__(self, data, image, mode, size):
+        self.data = data
+        self.image = image
+        self.mode = mode
+        self.size = size
+
+
+def _read_stream(stream, length, max_bytes):
+    """Request body as a uint8 array, read into a single buffer when the length is known."""
+    if length is not None:
+        buffer = np.empty(length, dtype=np.uint8)
+        view = memoryview(buffer)
+        received = 0
+        while received < length:
+            if hasattr(stream, "readinto"):
+                count = stream.readinto(view[received:])
+            else:
+                chunk = stream.read(min(READ_CHUNK, length - received))
+                count = len(chunk)
+                view[received:received + count] = chunk
+            if not count:
+                raise UploadError("Incomplete image upload")
+            received += count
+        return buffer
+
+    # chunked transfer: enforce the limit while reading
+    body = bytearray()
+    while True:
+        chunk = stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        body += chunk
+        if len(body) > max_bytes:
+            raise UploadError(f"Upload exceeds {max_bytes // 1024} KB", 413)
+    return np.frombuffer(body, dtype=np.uint8)
+
+
+def _metadata(text):
+    if not text:
+        return {}
+    try:
+        metadata = json.loads(text)
+    except ValueError:
+        raise UploadError("Invalid metadata JSON")
+    if not isinstance(metadata, dict):
+        raise UploadError("Metadata must be a JSON object")
+    return metadata
+
+
+def read_face_upload(request, max_bytes):
+    """
+    Parse a face request in any of the supported forms.
+
+    Raises:
+        UploadError: payload over ``max_bytes`` (413), missing length for a
+        multipart body (411) or malformed metadata (400).
+    """
+    length = request.content_length
+    if length is not None and length > max_bytes:
+        raise UploadError(f"Upload exceeds {max_bytes // 1024} KB", 413)
+    mimetype = request.mimetype
+
+    if mimetype == "multipart/form-data":
+        if length is None:
+            # the form parser would buffer an unbounded body
+            raise UploadError("Content-Length required", 411)
+        data = _metadata(request.form.get(METADATA_FIELD))
+        data.update((key, value) for key, value in request.form.items() if key != METADATA_FIELD)
+        part = request.files.get(IMAGE_FIELD)
+        image = np.frombuffer(part.read(), dtype=np.uint8) if part is not None else None
+        return FaceUpload(data, image, "multipart", length)
+
+    if mimetype in RAW_IMAGE_TYPES:
+        data = _metadata(request.headers.get(METADATA_HEADER))
+        data.update(request.args.items())
+        image = _read_stream(request.stream, length, max_bytes)
+        return FaceUpload(data, image if image.size else None, "raw", image.size)
+
+    # JSON (also when the client sends no or a wrong Content-Type, like get_json(force=True))
+    if length is None:
+        # chunked JSON: get_json would buffer the whole body, so read it within the limit first
+        body = _read_stream(request.stream, None, max_bytes)
+        length = body.size
+        try:
+            data = json.loads(body.tobytes())
+        except ValueError:
+            data = None
+    else:
+        data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    return FaceUpload(data, data.get("image_base64"), "json", length)
+
+
+def decode_frame(image, flags=cv2.IMREAD_COLOR, target_side=0, return_scale=False):
+    """
+    BGR frame of an uploaded image: a ``data:`` URL (JSON mode) or the encoded
+    bytes (binary modes). None if OpenCV cannot decode it.
+
+    With ``target_side``, a JPEG whose longer side is at least twice that is
+    decoded at 1/2, 1/4 or 1/8 scale, the smallest that stays at or above it.
+    With ``return_scale``, returns (frame, scale) where original coordinates
+    are frame coordinates times ``scale``.
+
+    Raises:
+        ValueError: a data URL without the ``,`` separator or with invalid base64.
+    """
+    if isinstance(image, str):
+        header, encoded = image.split(",", 1)
+        image = np.frombuffer(base64.b64decode(encoded), dtype=np.uint8)
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        image = np.frombuffer(image, dtype=np.uint8)
+    if target_side and flags == cv2.IMREAD_COLOR:
+        frame, scale = decode_image_reduced(image, target_side)
+    else:
+        frame, scale = cv2.imdecode(image, flags), 1
+    return (frame, scale) if return_scale else frame
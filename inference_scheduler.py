@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-request micro-batching for MiniFASNet liveness inference.
+
+Concurrent callers hand in their per-model 80x80 crops; a single worker thread
+collects them for up to ``window_ms`` (or until ``max_batch`` requests are
+queued), runs one batched forward per model and hands every caller back its
+own softmax row. Callers block, so ``check_face_liveness`` stays synchronous.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+
+class _PendingRequest:
+    __slots__ = ("crops", "results", "error", "done", "enqueued_at")
+
+    def __init__(self, crops: Dict[str, np.ndarray]):
+        self.crops = crops
+        self.results = {}
+        self.error = None
+        self.done = threading.Event()
+        self.enqueued_at = time.time()
+
+
+class InferenceScheduler:
+    """
+    Micro-batching front end for ``AntiSpoofPredict.predict_batch``.
+
+    Args:
+        predictor: object exposing ``predict_batch(imgs, model_path)``.
+        window_ms (float): how long to wait for more callers after the first one.
+        max_batch (int): flush as soon as this many requests are collected.
+        timeout (float): seconds a caller waits for its result before giving up.
+    """
+
+    def __init__(self, predictor, window_ms: float = 8.0, max_batch: int = 16, timeout: float = 10.0):
+        self.predictor = predictor
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._requests = 0
+        self._batches = 0
+        self._max_queue_depth = 0
+        self._total_wait = 0.0
+        self._total_forward = 0.0
+        self._worker = None
+        self._worker_pid = None
+        self._worker_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # Started lazily and per process: gunicorn --preload forks after import,
+        # and threads do not survive the fork.
+        pid = os.getpid()
+        if self._worker_pid == pid and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker_pid != pid or not self._worker.is_alive():
+                self._queue = queue.Queue()
+                self._worker = threading.Thread(target=self._run, name="liveness-batcher", daemon=True)
+                self._worker.start()
+                self._worker_pid = pid
+
+    def predict(self, crops: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Score one face. ``crops`` maps model path -> crop for that model.
+
+        Returns:
+            Dict[str, np.ndarray]: model path -> (1, 3) softmax row.
+        """
+        return self.predict_many([crops])[0]
+
+    def predict_many(self, faces: List[Dict[str, np.ndarray]]) -> List[Dict[str, np.ndarray]]:
+        """
+        Score several faces of one frame; they are queued together so they share
+        the same batched forward (up to ``max_batch``).
+
+        Returns:
+            List[Dict[str, np.ndarray]]: per face, model path -> (1, 3) softmax row.
+        """
+        self._ensure_worker()
+        requests = [_PendingRequest(crops) for crops in faces]
+        for request in requests:
+            self._queue.put(request)
+        with self._stats_lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        deadline = time.time() + self.timeout
+        for request in requests:
+            if not request.done.wait(max(0.0, deadline - time.time())):
+                raise TimeoutError("Liveness batch did not complete in time")
+            if request.error is not None:
+                raise request.error
+        return [request.results for request in requests]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        flush_at = time.time() + self.window
+        while len(batch) < self.max_batch:
+            remaining = flush_at - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.time()
+            try:
+                by_model = {}
+                for request in batch:
+                    for model_path, crop in request.crops.items():
+                        by_model.setdefault(model_path, []).append(request)
+
+                for model_path, requests in by_model.items():
+                    probs = self.predictor.predict_batch(
+                        [request.crops[model_path] for request in requests], model_path
+                    )
+                    for row, request in enumerate(requests):
+                        request.results[model_path] = probs[row:row + 1]
+            except Exception as e:
+                print(f"❌ Liveness batch failed: {e}")
+                for request in batch:
+                    request.error = e
+            finished = time.time()
+
+            with self._stats_lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._total_wait += sum(started - request.enqueued_at for request in batch)
+                self._total_forward += finished - started
+
+            for request in batch:
+                request.done.set()
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            batches = self._batches
+            requests = self._requests
+            return {
+                "window_ms": self.window * 1000.0,
+                "max_batch": self.max_batch,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "requests": requests,
+                "batches": batches,
+                "average_batch_size": requests / batches if batches else 0.0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "average_wait_ms": 1000.0 * self._total_wait / requests if requests else 0.0,
+                "average_forward_ms": 1000.0 * self._total_forward / batches if batches else 0.0,
+            }
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Concurrency load test: many slow uploads at once, plus a /health probe.
+
+Each client opens a connection and sends a face request whose body trickles in
+over --upload-seconds (a phone on a weak connection). Meanwhile /health is
+polled; its latency shows whether the server still answers while the uploads
+are in flight. Run it against both serving modes and compare:
+
+    gunicorn --bind 0.0.0.0:8080 --workers 1 --timeout 30 app:app
+    uvicorn asgi_app:app --host 0.0.0.0 --port 8080
+
+    python load_test.py --url http://localhost:8080 --clients 50 --upload-seconds 5 \\
+        --image Silent_Face_Anti_Spoofing/images/sample/image_F1.jpg
+
+A sync worker serves one connection per thread: it blocks on the first slow
+body while the rest queue in the kernel, runs the CPU stages one request at a
+time and answers the probe only between them. The asyncio mode reads every
+upload at once, overlaps the CPU stages on its executor and answers the probe
+from the event loop.
+
+Only the standard library is used, so it runs from any machine.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+def build_body(image_path, endpoint, student_id, raw):
+    """(content type, path suffix, body) of one face request."""
+    with open(image_path, "rb") as f:
+        image = f.read()
+    if endpoint.startswith("/teacher"):
+        fields = {"teacherName": student_id}
+    elif endpoint == "/student/register":
+        fields = {"studentId": student_id, "studentName": student_id}
+    else:
+        fields = {"studentId": student_id}
+    if raw:
+        return "image/jpeg", "?" + "&".join(f"{key}={value}" for key, value in fields.items()), image
+    fields["image_base64"] = "data:image/jpeg;base64," + base64.b64encode(image).decode()
+    return "application/json", "", json.dumps(fields).encode()
+
+
+async def http_request(host, port, method, path, content_type=None, body=b"", pieces=1, duration=0.0,
+                       timeout=120.0):
+    """One HTTP/1.1 request whose body is sent in ``pieces`` over ``duration`` s. Returns (status, seconds)."""
+    started = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        head = f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n"
+        if body:
+            head += f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+        writer.write((head + "\r\n").encode())
+        step = -(-len(body) // pieces) if body else 0
+        for offset in range(0, len(body), step or 1):
+            writer.write(body[offset:offset + step])
+            await writer.drain()
+            if duration and offset + step < len(body):
+                await asyncio.sleep(duration / pieces)
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        status = int(status_line.split()[1]) if status_line else 0
+    finally:
+        writer.close()
+    return status, time.perf_counter() - started
+
+
+async def slow_client(args, host, port, index, results):
+    content_type, query, body = build_body(args.image, args.endpoint, f"loadtest{index:04d}", args.raw)
+    try:
+        status, seconds = await http_request(host, port, "POST", args.endpoint + query, content_type, body,
+                                             pieces=args.pieces, duration=args.upload_seconds, timeout=args.timeout)
+    except Exception as e:
+        status, seconds = f"error: {type(e).__name__}", None
+    results.append((status, seconds))
+
+
+async def probe(host, port, interval, latencies, stop):
+    while not stop.is_set():
+        try:
+            status, seconds = await http_request(host, port, "GET", "/health", timeout=60.0)
+            latencies.append(seconds)
+        except Exception:
+            latencies.append(None)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float("nan")
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    results, latencies = [], []
+    stop = asyncio.Event()
+    prober = asyncio.create_task(probe(host, port, args.probe_interval, latencies, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(slow_client(args, host, port, index, results) for index in range(args.clients)))
+    wall = time.perf_counter() - started
+    stop.set()
+    await prober
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    times = [seconds for _, seconds in results if seconds is not None]
+    probe_times = [seconds for seconds in latencies if seconds is not None]
+    print(f"{args.clients} clients x {args.upload_seconds:.1f}s uploads to {args.endpoint} "
+          f"({'raw JPEG' if args.raw else 'JSON'}): wall {wall:.1f}s")
+    print(f"  statuses: {statuses}")
+    if times:
+        print(f"  request time: p50 {statistics.median(times):.2f}s, p95 {percentile(times, 0.95):.2f}s, "
+              f"max {max(times):.2f}s")
+    if probe_times:
+        print(f"  /health during load: {len(probe_times)} probes, p50 {statistics.median(probe_times) * 1000:.0f} ms, "
+              f"p95 {percentile(probe_times, 0.95) * 1000:.0f} ms, max {max(probe_times) * 1000:.0f} ms, "
+              f"{len(latencies) - len(probe_times)} failed")
+    # ideal: every upload overlaps, so the wall time is one upload plus the queued CPU work
+    print(f"  concurrency achieved: {sum(times) / wall:.1f} requests in flight on average" if times else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="slow-upload concurrency load test")
+    parser.add_argument("--url", default="http://localhost:8080", help="server base URL")
+    parser.add_argument("--endpoint", default="/student/join",
+                        choices=["/student/attend", "/student/join", "/student/register",
+                                 "/teacher/register", "/teacher/login"])
+    parser.add_argument("--image", default="Silent_Face_Anti_Spoofing/images/sample/image_F1.jpg",
+                        help="JPEG sent by every client")
+    parser.add_argument("--clients", type=int, default=50, help="concurrent slow uploads")
+    parser.add_argument("--upload-seconds", dest="upload_seconds", type=float, default=5.0,
+                        help="time each body takes to arrive")
+    parser.add_argument("--pieces", type=int, default=20, help="writes per body")
+    parser.add_argument("--raw", action="store_true", help="send the JPEG as a raw image/jpeg body")
+    parser.add_argument("--probe-interval", dest="probe_interval", type=float, default=0.5,
+                        help="seconds between /health probes")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request timeout")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Convert stored face embeddings to the compact float32 Binary format.
+
+Adds ``embedding_f32`` to every ``users`` / ``teachers`` document that only
+has the legacy list of doubles, in bulk batches. Documents that are already
+converted are skipped, so the tool can be stopped and re-run at any time.
+The server reads both formats, so it can keep running during the migration.
+
+    python migrate_embeddings.py                      # convert users and teachers
+    python migrate_embeddings.py --dry-run            # only count what would change
+    python migrate_embeddings.py --verify             # check blobs against the lists
+    python migrate_embeddings.py --drop-legacy        # also remove the double lists
+
+--drop-legacy is for after the Node backend has stopped reading ``embedding``
+(it copies it into classrooms when a student joins); leave it off until then.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from pymongo import MongoClient, UpdateOne
+
+from face_index import (EMBEDDING_BINARY_FIELD, EMBEDDING_DIM, EMBEDDING_FIELD,
+                        decode_embedding, encode_embedding)
+
+COLLECTIONS = ["users", "teachers"]
+
+
+def convert(collection, batch_size, dry_run=False):
+    """Write ``embedding_f32`` for documents that only have the legacy list. Returns (converted, skipped)."""
+    query = {EMBEDDING_BINARY_FIELD: {"$exists": False}, EMBEDDING_FIELD: {"$exists": True}}
+    converted = skipped = 0
+    batch = []
+    for doc in collection.find(query, {EMBEDDING_FIELD: 1}).batch_size(batch_size):
+        embedding = doc.get(EMBEDDING_FIELD)
+        if not isinstance(embedding, list) or len(embedding) != EMBEDDING_DIM:
+            skipped += 1
+            continue
+        batch.append(UpdateOne(
+            # guard against a concurrent re-registration between read and write
+            {"_id": doc["_id"], EMBEDDING_BINARY_FIELD: {"$exists": False}},
+            {"$set": {EMBEDDING_BINARY_FIELD: encode_embedding(embedding)}},
+        ))
+        if len(batch) >= batch_size:
+            converted += flush(collection, batch, dry_run)
+            batch = []
+    if batch:
+        converted += flush(collection, batch, dry_run)
+    return converted, skipped
+
+
+def flush(collection, batch, dry_run):
+    if dry_run:
+        return len(batch)
+    result = collection.bulk_write(batch, ordered=False)
+    print(f"  {collection.name}: +{result.modified_count}")
+    return result.modified_count
+
+
+def verify(collection, batch_size):
+    """Compare every blob with its legacy list (where both exist). Returns (checked, mismatched)."""
+    query = {EMBEDDING_BINARY_FIELD: {"$exists": True}, EMBEDDING_FIELD: {"$exists": True}}
+    checked = mismatched = 0
+    for doc in collection.find(query, {EMBEDDING_FIELD: 1, EMBEDDING_BINARY_FIELD: 1}).batch_size(batch_size):
+        blob = decode_embedding(doc)
+        legacy = np.asarray(doc[EMBEDDING_FIELD], dtype=np.float32)
+        checked += 1
+        if blob is None or blob.shape != legacy.shape or not np.array_equal(blob, legacy):
+            mismatched += 1
+            print(f"  {collection.name} {doc['_id']}: stored blob does not match the embedding list")
+    return checked, mismatched
+
+
+def drop_legacy(collection, dry_run=False):
+    query = {EMBEDDING_BINARY_FIELD: {"$exists": True}, EMBEDDING_FIELD: {"$exists": True}}
+    if dry_run:
+        return collection.count_documents(query)
+    return collection.update_many(query, {"$unset": {EMBEDDING_FIELD: ""}}).modified_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="convert stored embeddings to float32 Binary")
+    parser.add_argument("--mongodb_uri", default=os.environ.get("MONGODB_URI"),
+                        help="MongoDB connection string (default: $MONGODB_URI)")
+    parser.add_argument("--database", default="face_verification_db", help="database name")
+    parser.add_argument("--collections", nargs="+", default=COLLECTIONS, help="collections to convert")
+    parser.add_argument("--batch_size", type=int, default=500, help="documents per bulk write")
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="count only, write nothing")
+    parser.add_argument("--verify", action="store_true", help="check converted blobs against the lists")
+    parser.add_argument("--drop-legacy", dest="drop_legacy", action="store_true",
+                        help="remove the list of doubles from converted documents")
+    args = parser.parse_args()
+    if not args.mongodb_uri:
+        raise SystemExit("Set MONGODB_URI or pass --mongodb_uri")
+
+    db = MongoClient(args.mongodb_uri, tls=True, tlsAllowInvalidCertificates=True)[args.database]
+    for name in args.collections:
+        collection = db[name]
+        started = time.time()
+        converted, skipped = convert(collection, args.batch_size, args.dry_run)
+        verb = "would convert" if args.dry_run else "converted"
+        print(f"✅ {name}: {verb} {converted} documents, skipped {skipped} without a valid embedding "
+              f"in {time.time() - started:.1f}s")
+        if args.verify:
+            checked, mismatched = verify(collection, args.batch_size)
+            print(f"{'✅' if not mismatched else '❌'} {name}: verified {checked} documents, {mismatched} mismatched")
+            if mismatched:
+                continue
+        if args.drop_legacy:
+            removed = drop_legacy(collection, args.dry_run)
+            print(f"🧹 {name}: {'would drop' if args.dry_run else 'dropped'} the legacy list from {removed} documents")
+
+
+if __name__ == "__main__":
+    main()
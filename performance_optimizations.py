@@ -5,15 +5,15 @@ Performance Optimizations for Railway Deployment
 
 import os
 import cv2
+import hashlib
 import numpy as np
 import time
-from functools import lru_cache
+from collections import OrderedDict
 import threading
-from typing import Tuple
+from typing import Any, Hashable, List, Optional, Sequence, Tuple
 
 # Global caches for performance
 _face_cascade_cache = None
-_face_encodings_cache = {}
 
 def get_face_cascade():
     """Get cached face cascade classifier"""
@@ -22,11 +22,121 @@ def get_face_cascade():
         _face_cascade_cache = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
     return _face_cascade_cache
 
-@lru_cache(maxsize=100)
-def cached_face_encoding(image_hash: str, student_id: str):
-    """Cache face encodings to avoid recomputation"""
-    # This is a placeholder - actual implementation would store/retrieve encodings
-    return None
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire ``ttl`` seconds after they were stored.
+
+    Args:
+        maxsize: Entries kept before the least recently used one is evicted
+        ttl: Seconds an entry stays valid
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, self._MISSING)
+            if entry is not self._MISSING:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+            }
+
+# Face encodings by image content: clients retry the same captured frame after a
+# network error or a failed location check, and the dlib encode is the expensive part.
+# Bounded by entry count (a few KB each) and expired after the TTL.
+_face_encodings_cache = TTLCache(
+    maxsize=int(os.environ.get('FACE_ENCODING_CACHE_SIZE', '256')),
+    ttl=float(os.environ.get('FACE_ENCODING_CACHE_TTL_S', '300')),
+)
+
+def image_hash(image: np.ndarray) -> str:
+    """
+    Content hash of a decoded image (pixels, shape and dtype)
+
+    Args:
+        image: Decoded image
+
+    Returns:
+        Hex digest, ~1 ms for a 640x480 frame
+    """
+    digest = hashlib.sha1(f"{image.shape}{image.dtype.str}".encode(), usedforsecurity=False)
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+def _locations_key(face_locations: Optional[Sequence]) -> Optional[tuple]:
+    return tuple(tuple(int(v) for v in location) for location in face_locations) if face_locations else None
+
+def cached_face_encoding(image_hash: str, face_locations: Optional[Sequence] = None):
+    """
+    Face encodings stored for an image, encoded at the same face locations
+
+    Args:
+        image_hash: image_hash() of the frame
+        face_locations: Locations the caller would encode at (None = dlib's own detection)
+
+    Returns:
+        (encodings, face_locations) or None
+    """
+    return _face_encodings_cache.get((image_hash, _locations_key(face_locations)))
+
+def store_face_encoding(image_hash: str, face_locations: Optional[Sequence],
+                        encodings: List[np.ndarray], found_locations: Sequence):
+    """Remember the encodings (and the face locations they were computed at) for an image"""
+    _face_encodings_cache.put((image_hash, _locations_key(face_locations)),
+                              (list(encodings), [tuple(location) for location in found_locations]))
+
+def get_face_encoding_cache_stats() -> dict:
+    return _face_encodings_cache.get_stats()
 
 def optimize_image_for_processing(image: np.ndarray, max_size: int = 640) -> np.ndarray:
     """
@@ -54,19 +164,91 @@ def optimize_image_for_processing(image: np.ndarray, max_size: int = 640) -> np.
     
     return image
 
+# JPEG start-of-frame markers (baseline, progressive, lossless, arithmetic); the others carry no size
+_JPEG_SOF_MARKERS = frozenset((0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF))
+_REDUCED_COLOR_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def jpeg_dimensions(data) -> Optional[Tuple[int, int]]:
+    """
+    (width, height) from a JPEG's frame header, without decoding it
+
+    Args:
+        data: Encoded image (bytes or uint8 array)
+
+    Returns:
+        (width, height), or None if ``data`` is not a JPEG or the header is truncated
+    """
+    view = memoryview(data).cast('B')
+    size = len(view)
+    if size < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    i = 2
+    while i + 4 <= size:
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # markers without a length
+            i += 2
+            continue
+        length = (view[i + 2] << 8) | view[i + 3]
+        if marker in _JPEG_SOF_MARKERS:
+            if i + 9 > size:
+                return None
+            height = (view[i + 5] << 8) | view[i + 6]
+            width = (view[i + 7] << 8) | view[i + 8]
+            return (width, height) if width and height else None
+        if marker == 0xDA:  # start of scan before any frame header
+            return None
+        i += 2 + length
+    return None
+
+def reduced_decode_factor(width: int, height: int, target_side: int) -> int:
+    """Largest JPEG DCT scale (8, 4, 2 or 1) that keeps the longer side at or above ``target_side``"""
+    if target_side <= 0:
+        return 1
+    for factor, _ in _REDUCED_COLOR_FLAGS:
+        if max(width, height) // factor >= target_side:
+            return factor
+    return 1
+
+def decode_image_reduced(data, target_side: int) -> Tuple[Optional[np.ndarray], int]:
+    """
+    Decode a JPEG at 1/2, 1/4 or 1/8 scale in the DCT domain when it is much larger than
+    ``target_side``, instead of decoding full size and shrinking afterwards (see
+    optimize_image_for_processing). Other formats decode at full size.
+
+    Args:
+        data: Encoded image (bytes or uint8 array)
+        target_side: Smallest acceptable longer side of the decoded image
+
+    Returns:
+        (BGR image or None, scale) where original pixel coordinates = decoded coordinates * scale
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    dimensions = jpeg_dimensions(buffer)
+    factor = reduced_decode_factor(*dimensions, target_side) if dimensions else 1
+    if factor == 1:
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR), 1
+    flag = dict(_REDUCED_COLOR_FLAGS)[factor]
+    return cv2.imdecode(buffer, flag), factor
+
 def fast_face_detection(image: np.ndarray) -> bool:
     """
     Fast face detection using OpenCV Haar cascades
     
     Args:
-        image: Input image
+        image: Input image, or a face_frame.Frame (reuses its grayscale view)
         
     Returns:
         True if face detected, False otherwise
     """
     try:
         # Convert to grayscale for faster processing
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = image.gray if not isinstance(image, np.ndarray) else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
         # Use cached face cascade
         face_cascade = get_face_cascade()
@@ -104,7 +286,7 @@ def validate_image_quality(image: np.ndarray) -> Tuple[bool, str]:
     Quick image quality validation
     
     Args:
-        image: Input image
+        image: Input image or face_frame.Frame
         
     Returns:
         Tuple[bool, str]: (is_valid, message)
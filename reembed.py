@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Recompute stored face embeddings from the registration face chips.
+
+Registrations made with FACE_CHIP_STORE=gridfs|local keep a small padded crop
+of the face (see face_chips.py). When the encoder settings change, this tool
+re-encodes every chip in a process pool and writes the new embeddings back
+with bulk updates, tagging each document with ``embeddingVersion``. Documents
+already at the requested version are skipped, so an interrupted run simply
+continues where it stopped.
+
+The encoder settings are FACE_ENCODER_MODEL and FACE_ENCODER_JITTERS
+(face_index.py), the same variables the server encodes live faces with; set
+them to the same values here and on the servers:
+
+    FACE_ENCODER_MODEL=large python reembed.py --version v2-large
+    FACE_ENCODER_MODEL=large python reembed.py --version v2-large --dry-run
+    FACE_ENCODER_JITTERS=5 python reembed.py --version v2-jitter --collections users
+
+Students' embedding copies in ``classrooms.ClassroomStudents`` (read by
+/student/attend) are rewritten along with their user document. Every
+rewritten document gets a new ``embeddingUpdatedAt``, which the running
+servers' student and teacher galleries and duplicate indexes see at their
+next check (a saved duplicate index file is caught up the same way when it is
+loaded). Classroom sessions already cached by a server keep the old copies
+until the session ends.
+
+Documents without a chip are left alone (their owners have to re-register).
+"""
+
+import argparse
+import datetime
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from pymongo import MongoClient, UpdateMany, UpdateOne
+
+from face_chips import CHIP_FIELD, LocalChipStore, decode_chip, open_chip_store
+from face_index import EMBEDDING_BINARY_FIELD, EMBEDDING_FIELD, FACE_ENCODER_JITTERS, FACE_ENCODER_MODEL, embedding_document_fields
+
+COLLECTIONS = ["users", "teachers"]
+# collection -> key field copied into classrooms.ClassroomStudents with the embedding
+CLASSROOM_COPIES = {"users": "studentId"}
+VERSION_FIELD = "embeddingVersion"
+
+
+def encode_chip(job):
+    """
+    Pool worker: (_id, chip JPEG bytes, face box, model, num_jitters) -> (_id, encoding or None, error).
+    The box is passed as a known location, so dlib re-fits the landmarks and re-aligns the chip.
+    """
+    import cv2
+    import face_recognition
+
+    doc_id, data, box, model, num_jitters = job
+    try:
+        chip = decode_chip(data)
+        if chip is None:
+            return doc_id, None, "unreadable chip"
+        rgb = cv2.cvtColor(chip, cv2.COLOR_BGR2RGB)
+        encodings = face_recognition.face_encodings(rgb, known_face_locations=[tuple(box)],
+                                                    num_jitters=num_jitters, model=model)
+        if not encodings:
+            return doc_id, None, "no encoding"
+        return doc_id, encodings[0].astype(np.float32), ""
+    except Exception as e:
+        return doc_id, None, str(e)
+
+
+def load_jobs(collection, stores, version, batch_size, model, num_jitters, keys):
+    """
+    Pending documents of ``collection`` as encode_chip jobs; chips are read here, in the main process.
+    ``keys`` is filled with _id -> classroom copy key (studentId) for collections that have copies.
+    """
+    key_field = CLASSROOM_COPIES.get(collection.name)
+    query = {CHIP_FIELD: {"$exists": True}, VERSION_FIELD: {"$ne": version}}
+    projection = {CHIP_FIELD: 1, key_field: 1} if key_field else {CHIP_FIELD: 1}
+    for doc in collection.find(query, projection).batch_size(batch_size):
+        chip = doc[CHIP_FIELD]
+        store = stores.get(chip.get("store"))
+        if store is None:
+            print(f"  {collection.name} {doc['_id']}: no {chip.get('store')} chip store configured, skipped")
+            continue
+        try:
+            data = store.get(chip["ref"])
+        except Exception as e:
+            print(f"  {collection.name} {doc['_id']}: cannot read chip {chip.get('ref')}: {e}")
+            continue
+        if key_field and doc.get(key_field) is not None:
+            keys[doc["_id"]] = doc[key_field]
+        yield doc["_id"], data, chip["box"], model, num_jitters
+
+
+def embedding_update(encoding, version, binary=True):
+    """
+    Update document replacing a document's embedding with ``encoding``. Without ``binary`` the
+    old blob is removed too: decode_embedding reads the blob before the list, so leaving it
+    would keep every reader on the old embedding.
+    """
+    update = {"$set": dict(embedding_document_fields(encoding, binary=binary),
+                           **{VERSION_FIELD: version, "updatedAt": datetime.datetime.utcnow()})}
+    if not binary:
+        update["$unset"] = {EMBEDDING_BINARY_FIELD: ""}
+    return update
+
+
+def classroom_copy_update(key_field, key, fields):
+    """Rewrite the ClassroomStudents embedding copies of ``key`` in every classroom it belongs to."""
+    return UpdateMany(
+        {f"ClassroomStudents.{key_field}": key},
+        {"$set": {f"ClassroomStudents.$[member].{EMBEDDING_FIELD}": fields[EMBEDDING_FIELD]}},
+        array_filters=[{f"member.{key_field}": key}])
+
+
+def reembed(collection, stores, version, workers, batch_size, model=FACE_ENCODER_MODEL,
+            num_jitters=FACE_ENCODER_JITTERS, dry_run=False, binary=True):
+    """Re-encode the pending chips of ``collection`` (and its classroom copies). Returns (updated, failed)."""
+    updated = failed = 0
+    keys = {}
+    key_field = CLASSROOM_COPIES.get(collection.name)
+    classrooms = collection.database["classrooms"]
+    jobs = load_jobs(collection, stores, version, batch_size, model, num_jitters, keys)
+    # spawn, not fork: dlib is not fork-safe once it has loaded its models
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        # one batch of chips in flight at a time, so memory stays flat on large collections
+        while True:
+            chunk = list(itertools.islice(jobs, batch_size))
+            if not chunk:
+                break
+            batch, copies = [], []
+            for doc_id, encoding, error in pool.map(encode_chip, chunk, chunksize=8):
+                key = keys.pop(doc_id, None)
+                if encoding is None:
+                    failed += 1
+                    print(f"  {collection.name} {doc_id}: {error}")
+                    continue
+                update = embedding_update(encoding, version, binary)
+                batch.append(UpdateOne({"_id": doc_id}, update))
+                if key is not None:
+                    copies.append(classroom_copy_update(key_field, key, update["$set"]))
+            # classroom copies first: a document only counts as done (embeddingVersion) once its
+            # copies are rewritten, so an interrupted run redoes both
+            if copies:
+                flush(classrooms, copies, dry_run)
+            if batch:
+                updated += flush(collection, batch, dry_run)
+    return updated, failed
+
+
+def flush(collection, batch, dry_run):
+    if dry_run:
+        return len(batch)
+    result = collection.bulk_write(batch, ordered=False)
+    print(f"  {collection.name}: +{result.modified_count}")
+    return result.modified_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="recompute embeddings from the stored face chips")
+    parser.add_argument("--version", required=True, help="tag written to embeddingVersion, e.g. v2-large")
+    parser.add_argument("--mongodb_uri", default=os.environ.get("MONGODB_URI"),
+                        help="MongoDB connection string (default: $MONGODB_URI)")
+    parser.add_argument("--database", default="face_verification_db", help="database name")
+    parser.add_argument("--collections", nargs="+", default=COLLECTIONS, help="collections to re-embed")
+    parser.add_argument("--chip_dir", default=os.environ.get("FACE_CHIP_DIR", "db/face_chips"),
+                        help="directory of local face chips")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="encoding processes")
+    parser.add_argument("--batch_size", type=int, default=500, help="documents per bulk write")
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="encode, write nothing")
+    parser.add_argument("--no-binary", dest="binary", action="store_false",
+                        help="store only the legacy embedding list (and drop existing blobs)")
+    args = parser.parse_args()
+    if not args.mongodb_uri:
+        raise SystemExit("Set MONGODB_URI or pass --mongodb_uri")
+
+    db = MongoClient(args.mongodb_uri, tls=True, tlsAllowInvalidCertificates=True)[args.database]
+    stores = {"gridfs": open_chip_store("gridfs", db), "local": LocalChipStore(args.chip_dir)}
+
+    print(f"Encoder: FACE_ENCODER_MODEL={FACE_ENCODER_MODEL}, FACE_ENCODER_JITTERS={FACE_ENCODER_JITTERS} "
+          f"(the servers must run with the same settings)")
+    total = 0
+    for name in args.collections:
+        started = time.time()
+        updated, failed = reembed(db[name], stores, args.version, args.workers, args.batch_size,
+                                  dry_run=args.dry_run, binary=args.binary)
+        total += updated
+        verb = "would re-embed" if args.dry_run else "re-embedded"
+        print(f"{'✅' if not failed else '⚠️'} {name}: {verb} {updated} documents, {failed} failed "
+              f"in {time.time() - started:.1f}s")
+
+    if total and not args.dry_run:
+        print("Running servers pick the new embeddings up at their next gallery and duplicate index check")
+
+if __name__ == "__main__":
+    main()
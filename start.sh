@@ -7,5 +7,12 @@ echo "Starting Face Attendance Service on Railway..."
 PORT=${PORT:-8080}
 echo "Using port: $PORT"
 
-# Start the application using the port from environment
-exec gunicorn --bind 0.0.0.0:$PORT --workers 1 --timeout 30 --preload --max-requests 1000 --max-requests-jitter 100 app:app
+# SERVER_MODE=asgi serves the face endpoints from asyncio (asgi_app.py); uploads are read by the
+# event loop and the CPU stages run on FACE_EXECUTOR_WORKERS threads
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    exec uvicorn asgi_app:app --host 0.0.0.0 --port $PORT --workers 1 --timeout-keep-alive 30
+fi
+
+# Start the application using the port from environment. Face work runs ADMISSION_CONCURRENCY (default 1)
+# requests at a time; the extra threads hold waiting requests where admission control can count and shed them
+exec gunicorn --bind 0.0.0.0:$PORT --workers 1 --threads ${GUNICORN_THREADS:-8} --timeout 30 --preload --max-requests 1000 --max-requests-jitter 100 app:app
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures for the unit tests. Nothing here needs dlib,
+face_recognition, torch or a MongoDB server (collections are replaced by
+FakeCollection); the anti-spoof tests run the ONNX exports through cv2.dnn.
+
+    python -m pytest
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_index import EMBEDDING_DIM  # noqa: E402
+
+
+def _matches(document, query):
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator == "$exists":
+                    if (field in document) != operand:
+                        return False
+                elif operator == "$in":
+                    if value not in operand:
+                        return False
+                elif operator == "$gte":
+                    if value is None or value < operand:
+                        return False
+                else:
+                    raise NotImplementedError(operator)
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    """The pymongo collection calls the galleries and indexes make, over a list of dicts."""
+
+    def __init__(self, documents=()):
+        self.documents = list(documents)
+        self.finds = 0
+
+    def estimated_document_count(self):
+        return len(self.documents)
+
+    def count_documents(self, query):
+        return sum(1 for document in self.documents if _matches(document, query))
+
+    def find(self, query=None, projection=None):
+        self.finds += 1
+        for document in self.documents:
+            if _matches(document, query or {}):
+                if projection:
+                    yield {key: value for key, value in document.items() if key == "_id" or key in projection}
+                else:
+                    yield dict(document)
+
+    def update_one(self, query, update):
+        for document in self.documents:
+            if _matches(document, query):
+                for operator, fields in update.items():
+                    if operator == "$set":
+                        document.update(fields)
+                    elif operator == "$unset":
+                        for field in fields:
+                            document.pop(field, None)
+                    else:
+                        raise NotImplementedError(operator)
+                return
+
+    def find_one(self, query=None, projection=None, sort=None):
+        documents = [document for document in self.documents if _matches(document, query or {})]
+        for field, direction in reversed(sort or []):
+            documents.sort(key=lambda document: document[field], reverse=direction < 0)
+        if not documents:
+            return None
+        return {key: value for key, value in documents[0].items() if not projection or key == "_id" or key in projection}
+
+
+@pytest.fixture
+def rng():
+    return np.random.RandomState(0)
+
+
+@pytest.fixture
+def embeddings(rng):
+    """Factory of ``n`` random embeddings, far apart from each other at MATCH_THRESHOLD."""
+    def make(n):
+        return rng.rand(n, EMBEDDING_DIM).astype(np.float32)
+    return make
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import admission
+from admission import DEFAULT_WORK_S, AdmissionController, Deadline, DeadlineExceeded, request_start
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.time / perf_counter for deadlines and stage timing."""
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(admission.time, "time", lambda: now[0])
+    monkeypatch.setattr(admission.time, "perf_counter", lambda: now[0])
+    return now
+
+
+def finish(controller, endpoint, deadline, clock, **stages):
+    """Run the named stages for the given seconds each, then release the request."""
+    for name, seconds in stages.items():
+        with deadline.stage(name):
+            clock[0] += seconds
+    controller.release(endpoint, deadline)
+
+
+def test_deadline_check_and_stage(clock):
+    deadline = Deadline(10.0, estimates={"liveness": 3.0})
+    with deadline.stage("decode"):
+        clock[0] += 2.0
+    assert deadline.stages == {"decode": 2.0}
+    assert deadline.remaining() == pytest.approx(8.0)
+    clock[0] += 6.0
+    # 2 s left, liveness is expected to take 3
+    with pytest.raises(DeadlineExceeded) as error:
+        with deadline.stage("liveness"):
+            pass
+    assert error.value.stage == "liveness"
+    assert deadline.exceeded == "liveness"
+
+
+def test_nested_stage_is_timed_once(clock):
+    deadline = Deadline(10.0)
+    with deadline.stage("liveness"):
+        clock[0] += 1.0
+        with deadline.stage("liveness"):
+            clock[0] += 1.0
+    assert deadline.stages == {"liveness": 2.0}
+    assert deadline.work() == 2.0
+
+
+def test_admit_within_budget(clock):
+    controller = AdmissionController(concurrency=1, budget_s=10.0)
+    deadline, retry_after = controller.admit("attend")
+    assert deadline is not None and retry_after == 0
+    assert deadline.expires_at == pytest.approx(clock[0] + 10.0)
+    assert controller.get_stats()["in_flight"] == 1
+    controller.release("attend", deadline)
+    assert controller.get_stats()["in_flight"] == 0
+
+
+def test_admit_counts_the_time_already_waited(clock):
+    controller = AdmissionController(concurrency=1, budget_s=10.0)
+    # arrived 9.5 s ago at the proxy: the default 1 s of work cannot fit
+    deadline, retry_after = controller.admit("attend", started_at=clock[0] - 9.5)
+    assert deadline is None and retry_after >= 1
+    assert controller.get_stats()["shed"] == 1
+    # a start time in the future (clock skew) counts as now
+    deadline, _ = controller.admit("attend", started_at=clock[0] + 60)
+    assert deadline.started_at == clock[0]
+
+
+def test_admit_sheds_when_the_queue_cannot_drain_in_time(clock):
+    controller = AdmissionController(concurrency=2, budget_s=5.0)
+    admitted = [controller.admit("attend")[0] for _ in range(9)]
+    assert all(admitted)
+    # 9 s of default work on 2 threads: 4.5 s wait + 1 s of work is past the 5 s budget
+    deadline, retry_after = controller.admit("attend")
+    assert deadline is None
+    assert retry_after == 5
+    assert controller.retry_after() == 5
+    controller.release("attend", admitted[0])
+    assert controller.admit("attend")[0] is not None
+
+
+def test_concurrent_burst_is_shed_past_the_budget():
+    controller = AdmissionController(concurrency=1, budget_s=2.5)
+    arrived = threading.Barrier(16)
+
+    def arrive(_):
+        arrived.wait()
+        return controller.admit("attend")[0]
+
+    with ThreadPoolExecutor(16) as pool:
+        admitted = [deadline for deadline in pool.map(arrive, range(16)) if deadline is not None]
+    # 1 s of default work each on one slot: only the first two can finish within 2.5 s
+    assert len(admitted) == 2
+    stats = controller.get_stats()
+    assert (stats["in_flight"], stats["admitted"], stats["shed"]) == (2, 2, 14)
+
+
+def test_admitted_requests_wait_for_a_work_slot():
+    controller = AdmissionController(concurrency=1, budget_s=10.0)
+    first, _ = controller.admit("attend")
+    second, _ = controller.admit("attend")
+    assert controller.wait_for_slot(first)
+    waited = threading.Event()
+    waiter = threading.Thread(target=lambda: controller.wait_for_slot(second) and waited.set())
+    waiter.start()
+    assert not waited.wait(0.1)
+    # the waiting request is counted in the work ahead of the next arrival
+    assert controller.get_stats()["in_flight"] == 2 and controller.get_stats()["working"] == 1
+    controller.release("attend", first)
+    assert waited.wait(5.0)
+    waiter.join()
+    controller.release("attend", second)
+    assert controller.get_stats()["working"] == 0
+
+
+def test_waiting_for_a_slot_gives_up_at_the_deadline():
+    controller = AdmissionController(concurrency=1, budget_s=10.0)
+    first, _ = controller.admit("attend")
+    assert controller.wait_for_slot(first)
+    late = Deadline(0.05)
+    assert not controller.wait_for_slot(late)
+    assert late.exceeded == "queue"
+    controller.release("attend", late)
+    # a request that never got a slot does not free one
+    assert not controller.wait_for_slot(Deadline(0.05))
+
+
+def test_release_learns_the_stage_latencies(clock):
+    controller = AdmissionController(concurrency=1, budget_s=10.0, alpha=0.5)
+    assert controller.expected_work("register") == DEFAULT_WORK_S
+    deadline, _ = controller.admit("register")
+    finish(controller, "register", deadline, clock, decode=0.2, liveness=2.0)
+    assert controller.expected_work("register") == pytest.approx(2.2)
+    deadline, _ = controller.admit("register")
+    # an admitted request carries the estimates it is checked against
+    assert deadline.estimates == {"decode": pytest.approx(0.2), "liveness": pytest.approx(2.0)}
+    finish(controller, "register", deadline, clock, decode=0.4, liveness=4.0)
+    assert controller.expected_work("register") == pytest.approx(0.3 + 3.0)
+    assert controller.get_stats()["stage_ms"]["register.liveness"] == pytest.approx(3000.0)
+    # other endpoints keep the default
+    assert controller.expected_work("attend") == DEFAULT_WORK_S
+
+
+def test_release_counts_expired_requests(clock):
+    controller = AdmissionController(concurrency=1, budget_s=10.0)
+    deadline, _ = controller.admit("attend")
+    clock[0] += 10.0
+    with pytest.raises(DeadlineExceeded):
+        deadline.check("encode")
+    controller.release("attend", deadline)
+    stats = controller.get_stats()
+    assert stats["deadline_exceeded"] == 1 and stats["in_flight"] == 0
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("t=1700000000.5", 1700000000.5),
+    ("t=1700000000500", 1700000000.5),
+    ("t=1700000000500000", 1700000000.5),
+    ("1700000000", 1700000000.0),
+    (" t=1700000000 ", 1700000000.0),
+    (None, None),
+    ("", None),
+    ("t=soon", None),
+])
+def test_request_start(header, expected):
+    assert request_start(header) == (pytest.approx(expected) if expected is not None else None)
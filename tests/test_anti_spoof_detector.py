@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the ONNX backend on the exported models in Silent_Face_Anti_Spoofing/resources
+(cv2.dnn, no torch); skipped where the exports are missing.
+"""
+
+import importlib
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "Silent_Face_Anti_Spoofing", "resources", "anti_spoof_models")
+
+
+@pytest.fixture
+def detector_module(monkeypatch):
+    if not any(name.endswith(".onnx") for name in os.listdir(MODEL_DIR)):
+        pytest.skip("no ONNX exports (run Silent_Face_Anti_Spoofing/export_onnx.py)")
+    monkeypatch.setenv("ANTI_SPOOF_BACKEND", "onnx")
+    monkeypatch.setenv("LIVENESS_CASCADE", "0")
+    monkeypatch.setenv("LIVENESS_BATCHING", "0")
+    import anti_spoof_detector
+    module = importlib.reload(anti_spoof_detector)
+    if not module.ANTI_SPOOF_AVAILABLE:
+        pytest.skip("anti-spoof libraries not importable")
+    return module
+
+
+@pytest.fixture
+def blank_frame():
+    return np.full((480, 640, 3), 128, dtype=np.uint8)
+
+
+def test_missing_onnxruntime_falls_back_to_cv2(detector_module, monkeypatch):
+    monkeypatch.setattr(detector_module, "ANTI_SPOOF_ONNX_RUNTIME", "onnxruntime")
+    # an ImportError for "import onnxruntime", as on an image built from requirements.txt
+    monkeypatch.setitem(sys.modules, "onnxruntime", None)
+    detector = detector_module.AntiSpoofDetector(model_dir=MODEL_DIR)
+    assert detector.initialized
+    assert detector.model_test.runtime == "cv2"
+    assert detector.model_test.registry.scan(MODEL_DIR, detector.model_test.model_extensions)
+
+
+def test_no_loadable_model_denies_access(detector_module, tmp_path, blank_frame):
+    # a model file the runtime cannot read
+    (tmp_path / "2.7_80x80_MiniFASNetV2.onnx").write_bytes(b"not an onnx graph")
+    detector = detector_module.AntiSpoofDetector(model_dir=str(tmp_path))
+    assert detector.is_available()
+    is_real, confidence, message, _ = detector.detect_spoof_with_bbox(blank_frame)
+    assert not is_real and confidence == 0.0
+
+
+def test_failed_predictions_deny_access(detector_module, tmp_path, blank_frame, monkeypatch):
+    for name in os.listdir(MODEL_DIR):
+        if name.endswith(".onnx"):
+            shutil.copy(os.path.join(MODEL_DIR, name), tmp_path / name)
+    detector = detector_module.AntiSpoofDetector(model_dir=str(tmp_path))
+    monkeypatch.setattr(detector, "_predict_faces", lambda face_crops: [{} for _ in face_crops])
+    is_real, _, message, _ = detector.detect_spoof_with_bbox(blank_frame)
+    assert not is_real
+    assert "denied" in message
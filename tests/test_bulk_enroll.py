@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import io
+import itertools
+import zipfile
+
+from bulk_enroll import MISSING_IMAGE, ImageSource, image_jobs, load_roster
+
+
+ROSTER = "studentId,name,image\ns0,Student 0,\ns1,Student 1,\ns2,Student 2,other.png\n"
+
+
+class CountingSource(ImageSource):
+    reads = 0
+
+    def job(self, member):
+        self.reads += 1
+        return super().job(member)
+
+
+def photos(tmp_path):
+    path = tmp_path / "photos.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("photos/S0.jpg", b"jpeg 0")
+        archive.writestr("photos/other.png", b"png 2")
+    return str(path)
+
+
+def test_image_jobs_read_the_zip_lazily(tmp_path):
+    rows = load_roster(io.StringIO(ROSTER))
+    report = [{"status": "", "image": ""} for _ in rows]
+    source = CountingSource(photos(tmp_path))
+    jobs = image_jobs(rows, source, report)
+    # lookups happen up front, reads only as the pool takes jobs
+    assert [entry["status"] for entry in report] == ["", MISSING_IMAGE, ""]
+    assert [entry["image"] for entry in report] == ["S0.jpg", "", "other.png"]
+    assert source.reads == 0
+    assert list(itertools.islice(jobs, 1)) == [(0, b"jpeg 0")]
+    assert source.reads == 1
+    assert list(jobs) == [(2, b"png 2")]
+    source.close()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from Silent_Face_Anti_Spoofing.src.cascade import (LIVE_LABEL, calibrate_margins, early_exit_label, load_cascade,
+                                                   model_key, order_entries, save_cascade, simulate)
+
+ORDER = ["2.7_80x80_MiniFASNetV2", "4_0_0_80x80_MiniFASNetV1SE"]
+
+
+def softmax_rows(rng, n, live):
+    """(n, 3) probabilities leaning live (label 1) or spoof (label 2) by ``live`` (bool array)."""
+    logits = rng.normal(size=(n, 3))
+    logits[np.arange(n), np.where(live, LIVE_LABEL, 2)] += 3.0
+    probs = np.exp(logits)
+    return probs / probs.sum(axis=1, keepdims=True)
+
+
+@pytest.fixture
+def probs(rng):
+    live = rng.rand(400) < 0.5
+    return {key: softmax_rows(rng, len(live), live) for key in ORDER}
+
+
+def test_model_key_strips_only_model_extensions():
+    assert model_key("resources/anti_spoof_models/2.7_80x80_MiniFASNetV2.pth") == "2.7_80x80_MiniFASNetV2"
+    assert model_key("2.7_80x80_MiniFASNetV2.onnx") == "2.7_80x80_MiniFASNetV2"
+    assert model_key("2.7_80x80_MiniFASNetV2") == "2.7_80x80_MiniFASNetV2"
+
+
+def test_order_entries_puts_unknown_models_last():
+    entries = [{"name": "z.pth"}, {"name": ORDER[1] + ".onnx"}, {"name": ORDER[0] + ".pth"}]
+    assert [entry["name"] for entry in order_entries(entries, ORDER)] == [
+        ORDER[0] + ".pth", ORDER[1] + ".onnx", "z.pth"]
+
+
+def test_early_exit_label():
+    confident_live = np.array([[0.05, 0.9, 0.05]])
+    confident_spoof = np.array([[0.7, 0.1, 0.2]])
+    unsure = np.array([[0.3, 0.5, 0.2]])
+    assert early_exit_label(confident_live, 1, 0.8) == LIVE_LABEL
+    # spoof keeps the spoof class the model leans to
+    assert early_exit_label(confident_spoof, 1, 0.8) == 0
+    assert early_exit_label(unsure, 1, 0.8) is None
+    assert early_exit_label(confident_live, 1, None) is None
+    # the sum is averaged over the models run
+    assert early_exit_label(confident_live * 2, 2, 0.8) == LIVE_LABEL
+
+
+def test_simulate_without_margins_is_the_full_ensemble(probs):
+    labels, models_run = simulate(probs, ORDER, [None])
+    full = np.stack([probs[key] for key in ORDER]).sum(axis=0).argmax(axis=1)
+    np.testing.assert_array_equal(labels, full)
+    assert (models_run == len(ORDER)).all()
+
+
+def test_simulate_exits_early_past_the_margin(probs):
+    labels, models_run = simulate(probs, ORDER, [0.5])
+    # with a 0.5 margin the first model always decides live or spoof on its own
+    assert (models_run == 1).all()
+    first = probs[ORDER[0]][:, LIVE_LABEL] >= 0.5
+    np.testing.assert_array_equal(labels == LIVE_LABEL, first)
+
+
+def test_calibrate_margins_meets_the_target(probs):
+    margins, report = calibrate_margins(probs, ORDER, target_error=0.01)
+    assert len(margins) == len(ORDER) - 1
+    assert report["samples"] == 400
+    assert report["disagreement"] <= 0.01
+    labels, models_run = simulate(probs, ORDER, margins)
+    assert report["average_models_run"] == pytest.approx(models_run.mean())
+
+
+def test_calibrate_margins_zero_error_never_disagrees(probs):
+    margins, report = calibrate_margins(probs, ORDER, target_error=0.0)
+    assert report["disagreement"] == 0.0
+
+
+def test_save_and_load_cascade(tmp_path, probs):
+    margins, report = calibrate_margins(probs, ORDER, target_error=0.02)
+    path = save_cascade(str(tmp_path / "cascade.json"), ORDER, margins, report)
+    cascade = load_cascade(path)
+    assert cascade["order"] == ORDER
+    assert cascade["margins"] == margins
+
+
+def test_load_cascade_missing_or_invalid(tmp_path):
+    assert load_cascade(str(tmp_path / "missing.json")) is None
+    broken = tmp_path / "broken.json"
+    broken.write_text("{not json")
+    assert load_cascade(str(broken)) is None
+    empty = tmp_path / "empty.json"
+    empty.write_text('{"order": [], "margins": []}')
+    assert load_cascade(str(empty)) is None
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import pytest
+from bson import ObjectId
+
+import classroom_cache
+from classroom_cache import ClassroomGalleryCache
+from conftest import FakeCollection
+from face_index import embedding_document_fields
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(classroom_cache.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def school(embeddings):
+    """(db, attendance id, vectors): one open attendance of a two-student classroom."""
+    vectors = embeddings(3)
+    classroom_id, attendance_id = ObjectId(), ObjectId()
+    db = {
+        "classrooms": FakeCollection([{"_id": classroom_id, "ClassroomStudents": [
+            dict({"studentId": f"s{i}", "name": f"Student {i}"}, **embedding_document_fields(vectors[i], binary=False))
+            for i in range(2)]}]),
+        "attendances": FakeCollection([{"_id": attendance_id, "classroom": classroom_id,
+                                        "latitude": 47.9, "longitude": 106.9}]),
+    }
+    return db, str(attendance_id), vectors
+
+
+def join(db, vectors, i):
+    db["classrooms"].documents[0]["ClassroomStudents"].append(
+        dict({"studentId": f"s{i}", "name": f"Student {i}"}, **embedding_document_fields(vectors[i], binary=False)))
+
+
+def test_session_is_loaded_once(school, clock):
+    db, attendance_id, vectors = school
+    cache = ClassroomGalleryCache(db, check_s=15)
+    session = cache.get(attendance_id)
+    assert (session.latitude, session.longitude) == (47.9, 106.9)
+    assert len(session) == 2 and "s1" in session
+    assert cache.get(attendance_id) is session
+    assert cache.get_stats()["loads"] == 1 and cache.get_stats()["hits"] == 1
+
+
+def test_unknown_or_missing_attendance(school):
+    db, _, _ = school
+    cache = ClassroomGalleryCache(db)
+    assert cache.get(str(ObjectId())) is None
+    assert cache.get("") is None
+    assert ClassroomGalleryCache(None).get(str(ObjectId())) is None
+
+
+def test_ended_session_drops_the_roster(school, clock):
+    db, attendance_id, _ = school
+    cache = ClassroomGalleryCache(db, check_s=15)
+    cache.get(attendance_id)
+    db["attendances"].documents[0]["endedAt"] = datetime.datetime.utcnow()
+    assert not cache.get(attendance_id).ended
+    clock[0] += 15
+    session = cache.get(attendance_id)
+    assert session.ended and len(session) == 0
+
+
+def test_refresh_roster_at_most_once_per_check(school, clock):
+    db, attendance_id, vectors = school
+    cache = ClassroomGalleryCache(db, check_s=15)
+    session = cache.get(attendance_id)
+    join(db, vectors, 2)
+    # loaded just now: unknown student ids cannot force a reload
+    assert "s2" not in cache.refresh_roster(session)
+    clock[0] += 15
+    assert "s2" in cache.refresh_roster(session)
+
+
+def test_failed_refresh_backs_off(school, clock):
+    db, attendance_id, vectors = school
+    cache = ClassroomGalleryCache(db, check_s=15)
+    session = cache.get(attendance_id)
+    clock[0] += 15
+    classrooms = db["classrooms"]
+    db["classrooms"] = None  # the roster read fails, like on a lost connection
+    assert len(cache.refresh_roster(session)) == 2
+    db["classrooms"] = classrooms
+    join(db, vectors, 2)
+    assert "s2" not in cache.refresh_roster(session)
+    clock[0] += 15
+    assert "s2" in cache.refresh_roster(session)
+
+
+def test_sessions_are_bounded(school):
+    db, attendance_id, _ = school
+    other = ObjectId()
+    db["attendances"].documents.append(dict(db["attendances"].documents[0], _id=other))
+    cache = ClassroomGalleryCache(db, max_sessions=1)
+    cache.get(attendance_id)
+    cache.get(str(other))
+    assert cache.get_stats()["sessions"] == 1
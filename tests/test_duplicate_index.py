@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+import duplicate_index
+from conftest import FakeCollection
+from duplicate_index import DuplicateIndex, train_ivf
+from face_index import EMBEDDING_UPDATED_FIELD, embedding_document_fields
+
+
+def student(i, vector, binary=True):
+    return dict({"_id": ObjectId(), "studentId": f"s{i}", "name": f"Student {i}"},
+                **embedding_document_fields(vector, binary=binary))
+
+
+def make_index(tmp_path, collection=None, **kwargs):
+    return DuplicateIndex(collection, str(tmp_path / "students.npz"), "studentId", "name",
+                          updated_field=EMBEDDING_UPDATED_FIELD, **kwargs)
+
+
+def re_embed(collection, i, vector):
+    """What reembed.py does to document ``i``: same _id, new embedding and stamp."""
+    collection.documents[i].update(embedding_document_fields(vector, binary=True))
+
+
+@pytest.fixture
+def small_ivf(monkeypatch):
+    # partition even small test sets so the IVF path is exercised
+    monkeypatch.setattr(duplicate_index, "MIN_IVF_ROWS", 64)
+
+
+def test_train_ivf_lists_cover_every_row(embeddings):
+    vectors = embeddings(500)
+    centroids, order, offsets = train_ivf(vectors, 8)
+    assert centroids.shape == (8, vectors.shape[1])
+    assert offsets[0] == 0 and offsets[-1] == len(vectors)
+    assert sorted(order.tolist()) == list(range(len(vectors)))
+
+
+def test_build_and_search(tmp_path, embeddings):
+    vectors = embeddings(20)
+    documents = [student(i, v, binary=i % 2 == 0) for i, v in enumerate(vectors)]
+    documents.append({"_id": ObjectId(), "studentId": "bad", "embedding": [1.0, 2.0]})
+    index = make_index(tmp_path).build(documents)
+    assert len(index) == 20
+    match = index.search(vectors[7] + 0.001)
+    assert match["studentId"] == "s7" and match["_id"] == documents[7]["_id"]
+    assert index.search(vectors[7] + 1.0) is None
+
+
+def test_search_through_the_inverted_lists(tmp_path, embeddings, small_ivf):
+    vectors = embeddings(300)
+    index = make_index(tmp_path, nprobe=64).build([student(i, v) for i, v in enumerate(vectors)])
+    assert index._ivf is not None
+    for i in (0, 150, 299):
+        assert index.search(vectors[i])["studentId"] == f"s{i}"
+
+
+def test_add_replace_and_remove(tmp_path, embeddings):
+    vectors = embeddings(5)
+    index = make_index(tmp_path).build([student(i, v) for i, v in enumerate(vectors[:3])])
+    index.add("s3", "Student 3", vectors[3])
+    assert len(index) == 4
+    assert index.search(vectors[3])["studentId"] == "s3"
+    # re-registering s0 tombstones the old row
+    index.add("s0", "Student 0", vectors[4])
+    assert len(index) == 4
+    assert index.search(vectors[0]) is None
+    assert index.search(vectors[4])["studentId"] == "s0"
+    assert index.remove("s1") and not index.remove("s1")
+    assert index.remove("s3")
+    assert index.search(vectors[1]) is None and index.search(vectors[3]) is None
+    assert len(index) == 2
+
+
+def test_compaction_folds_the_delta_and_saves(tmp_path, embeddings):
+    vectors = embeddings(30)
+    index = make_index(tmp_path, min_compact=4).build([student(i, v) for i, v in enumerate(vectors[:10])])
+    index.remove("s0")
+    for i in range(10, 15):
+        index.add(f"s{i}", f"Student {i}", vectors[i])
+    # the fifth added row passed min_compact
+    assert len(index._delta) == 0 and not index._tombstones
+    assert len(index._base_keys) == 14
+    assert os.path.exists(index.path)
+    assert index.search(vectors[0]) is None
+    assert index.search(vectors[12])["studentId"] == "s12"
+
+
+def test_save_and_load_round_trip(tmp_path, embeddings, small_ivf):
+    vectors = embeddings(100)
+    documents = [student(i, v) for i, v in enumerate(vectors)]
+    documents.append({"_id": ObjectId(), "studentId": "bad"})
+    saved = make_index(tmp_path).build(documents)
+    saved.save()
+    loaded = make_index(tmp_path)
+    assert loaded.load()
+    assert len(loaded) == 100
+    assert loaded._skipped == saved._skipped
+    assert loaded._watermark == saved._watermark
+    assert loaded._doc_count == saved._doc_count
+    np.testing.assert_array_equal(loaded._ivf[0], saved._ivf[0])
+    match = loaded.search(vectors[42])
+    assert match["studentId"] == "s42" and match["_id"] == documents[42]["_id"]
+
+
+def test_load_refuses_pickles_and_other_layouts(tmp_path, embeddings):
+    index = make_index(tmp_path)
+    assert not index.load()
+    with open(index.path, "wb") as f:
+        pickle.dump({"version": 1, "key_field": "studentId"}, f)
+    assert not index.load()
+    make_index(tmp_path).build([student(0, embeddings(1)[0])]).save()
+    teachers = DuplicateIndex(None, index.path, "teacherName", "teacherName")
+    assert not teachers.load()
+
+
+def test_sync_builds_then_catches_up(tmp_path, embeddings):
+    vectors = embeddings(6)
+    collection = FakeCollection([student(i, v) for i, v in enumerate(vectors[:4])])
+    index = make_index(tmp_path, collection)
+    assert index.find_duplicate(vectors[2])["studentId"] == "s2"
+    assert os.path.exists(index.path)
+    # registered by another worker
+    collection.documents.append(student(4, vectors[4], binary=False))
+    assert index.find_duplicate(vectors[4])["studentId"] == "s4"
+    assert len(index) == 5
+
+
+def test_sync_rebuilds_after_a_delete(tmp_path, embeddings):
+    vectors = embeddings(4)
+    collection = FakeCollection([student(i, v) for i, v in enumerate(vectors)])
+    index = make_index(tmp_path, collection)
+    index.sync()
+    del collection.documents[1]
+    assert index.find_duplicate(vectors[1]) is None
+    assert len(index) == 3
+
+
+def test_sync_starts_from_the_saved_file(tmp_path, embeddings, monkeypatch):
+    vectors = embeddings(4)
+    collection = FakeCollection([student(i, v) for i, v in enumerate(vectors)])
+    make_index(tmp_path, collection).sync()
+    restarted = make_index(tmp_path, collection)
+    monkeypatch.setattr(restarted, "build", lambda documents: pytest.fail("rebuilt instead of loading"))
+    assert restarted.find_duplicate(vectors[3])["studentId"] == "s3"
+    assert len(restarted) == 4
+
+
+def test_sync_picks_up_embeddings_rewritten_in_place(tmp_path, embeddings):
+    vectors = embeddings(5)
+    collection = FakeCollection([student(i, v) for i, v in enumerate(vectors[:4])])
+    index = make_index(tmp_path, collection)
+    index.sync()
+    re_embed(collection, 1, vectors[4])
+    assert index.find_duplicate(vectors[1]) is None
+    assert index.find_duplicate(vectors[4])["studentId"] == "s1"
+    assert len(index) == 4
+
+
+def test_sync_rebuilds_after_a_re_embedding_run(tmp_path, embeddings, monkeypatch):
+    vectors = embeddings(20)
+    collection = FakeCollection([student(i, v) for i, v in enumerate(vectors[:10])])
+    index = make_index(tmp_path, collection, min_compact=2)
+    index.sync()
+    for i in range(10):
+        re_embed(collection, i, vectors[10 + i])
+    rebuilt = []
+    build = index.build
+    monkeypatch.setattr(index, "build", lambda documents: rebuilt.append(1) or build(documents))
+    assert index.find_duplicate(vectors[15])["studentId"] == "s5"
+    assert index.find_duplicate(vectors[5]) is None
+    assert rebuilt == [1]
+
+
+def test_a_stale_saved_index_is_caught_up_on_load(tmp_path, embeddings):
+    vectors = embeddings(5)
+    collection = FakeCollection([student(i, v) for i, v in enumerate(vectors[:4])])
+    make_index(tmp_path, collection).sync()
+    # re-embedded while the file was on disk (or re-saved by a server that had not seen it)
+    re_embed(collection, 2, vectors[4])
+    restarted = make_index(tmp_path, collection)
+    assert restarted.find_duplicate(vectors[2]) is None
+    assert restarted.find_duplicate(vectors[4])["studentId"] == "s2"
+    restarted.compact()
+    reloaded = make_index(tmp_path)
+    assert reloaded.load()
+    assert reloaded.search(vectors[2]) is None
+
+
+def test_own_registration_does_not_rebuild(tmp_path, embeddings, monkeypatch):
+    vectors = embeddings(4)
+    collection = FakeCollection([student(i, v) for i, v in enumerate(vectors[:3])])
+    index = make_index(tmp_path, collection)
+    index.sync()
+    document = student(3, vectors[3])
+    collection.documents.append(document)
+    index.add("s3", "Student 3", vectors[3], document["_id"])
+    monkeypatch.setattr(index, "build", lambda documents: pytest.fail("rebuilt after our own registration"))
+    assert index.find_duplicate(vectors[3])["studentId"] == "s3"
+    assert index.find_duplicate(vectors[0])["studentId"] == "s0"
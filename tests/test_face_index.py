@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from conftest import FakeCollection
+from face_index import (CollectionGallery, CollectionWatch, EmbeddingIndex, EMBEDDING_BINARY_FIELD,
+                        EMBEDDING_UPDATED_FIELD, MATCH_THRESHOLD, decode_embedding, embedding_document_fields)
+
+
+def student(i, vector, binary=False, **extra):
+    return dict({"_id": ObjectId(), "studentId": f"s{i}", "name": f"Student {i}"},
+                **embedding_document_fields(vector, binary=binary), **extra)
+
+
+def test_embedding_formats_round_trip(embeddings):
+    vector = embeddings(1)[0]
+    legacy = embedding_document_fields(vector, binary=False)
+    binary = embedding_document_fields(vector, binary=True)
+    assert EMBEDDING_BINARY_FIELD not in legacy
+    assert EMBEDDING_UPDATED_FIELD in legacy and EMBEDDING_UPDATED_FIELD in binary
+    np.testing.assert_allclose(decode_embedding(legacy), vector)
+    np.testing.assert_array_equal(decode_embedding(binary), vector)
+
+
+def test_unknown_binary_version_is_ignored(embeddings):
+    fields = embedding_document_fields(embeddings(1)[0])
+    blob = bytearray(fields[EMBEDDING_BINARY_FIELD])
+    blob[2] = 99
+    assert decode_embedding({EMBEDDING_BINARY_FIELD: bytes(blob)}) is None
+
+
+def test_build_skips_documents_without_a_usable_embedding(embeddings):
+    vectors = embeddings(2)
+    index = EmbeddingIndex().build([
+        student(0, vectors[0]),
+        student(1, vectors[1], binary=True),
+        {"_id": ObjectId(), "studentId": "short", "embedding": [0.1, 0.2]},
+        {"_id": ObjectId(), "studentId": "none"},
+    ])
+    assert len(index) == 2
+    assert "s0" in index and "s1" in index and "short" not in index
+
+
+def test_search_finds_the_nearest_within_threshold(embeddings):
+    vectors = embeddings(3)
+    index = EmbeddingIndex().build([student(i, v) for i, v in enumerate(vectors)])
+    match, = index.search(vectors[1] + 0.001)
+    assert match["studentId"] == "s1"
+    assert match["name"] == "Student 1"
+    assert match["distance"] < MATCH_THRESHOLD
+    assert index.search(vectors[1] + 1.0) == [None]
+
+
+def test_search_restricted_to_keys(embeddings):
+    vectors = embeddings(3)
+    index = EmbeddingIndex().build([student(i, v) for i, v in enumerate(vectors)])
+    assert index.search(vectors[1], keys=["s0", "s2"]) == [None]
+    assert index.search(vectors[1], keys=["s1", "unknown"])[0]["studentId"] == "s1"
+    assert index.search(vectors[1], keys=[]) == [None]
+
+
+def test_best_match_over_several_queries(embeddings):
+    vectors = embeddings(2)
+    index = EmbeddingIndex().build([student(i, v) for i, v in enumerate(vectors)])
+    best = index.best_match(np.stack([vectors[0] + 0.01, vectors[1] + 0.001]))
+    assert best["studentId"] == "s1"
+    assert index.best_match(np.stack([vectors[0] + 1.0])) is None
+
+
+def test_add_grows_and_replaces(embeddings):
+    vectors = embeddings(100)
+    index = EmbeddingIndex()
+    for i, vector in enumerate(vectors):
+        index.add(f"s{i}", f"Student {i}", vector, i)
+    assert len(index) == 100
+    index.add("s5", "Renamed", vectors[99], "new")
+    assert len(index) == 100
+    match = index.best_match(vectors[99], keys=["s5"])
+    assert (match["name"], match["_id"]) == ("Renamed", "new")
+    assert index.best_match(vectors[5]) is None
+
+
+def test_remove_moves_the_last_row(embeddings):
+    vectors = embeddings(3)
+    index = EmbeddingIndex().build([student(i, v) for i, v in enumerate(vectors)])
+    assert index.remove("s0")
+    assert not index.remove("s0")
+    assert len(index) == 2 and "s0" not in index
+    # s2 took row 0 and is still found under its own key
+    assert index.best_match(vectors[2])["studentId"] == "s2"
+    assert index.best_match(vectors[0]) is None
+    keys, names, ids, matrix = index.snapshot()
+    assert keys == ["s2", "s1"]
+    np.testing.assert_array_equal(matrix, vectors[[2, 1]])
+
+
+def test_distances_match_numpy(embeddings):
+    vectors = embeddings(4)
+    index = EmbeddingIndex().build([student(i, v) for i, v in enumerate(vectors)])
+    distances, rows = index.distances(vectors[:2])
+    expected = np.linalg.norm(vectors[:2, None, :] - vectors[None, :, :], axis=2)
+    np.testing.assert_allclose(distances, expected, atol=1e-3)
+    np.testing.assert_array_equal(rows, np.arange(4))
+
+
+@pytest.fixture
+def gallery_collection(embeddings):
+    vectors = embeddings(3)
+    return FakeCollection([student(i, v) for i, v in enumerate(vectors)]), vectors
+
+
+def make_gallery(collection, **kwargs):
+    return CollectionGallery(collection, "studentId", "name", check_s=0.0,
+                             updated_field=EMBEDDING_UPDATED_FIELD, **kwargs)
+
+
+def test_gallery_loads_on_first_get(gallery_collection):
+    collection, vectors = gallery_collection
+    gallery = make_gallery(collection)
+    assert len(gallery.get()) == 3
+    assert gallery.get().best_match(vectors[2])["studentId"] == "s2"
+
+
+def test_gallery_without_database():
+    gallery = CollectionGallery(None, "studentId", "name")
+    assert len(gallery.get()) == 0
+
+
+def test_gallery_keeps_the_index_while_the_signature_holds(gallery_collection):
+    collection, _ = gallery_collection
+    gallery = make_gallery(collection)
+    index = gallery.get()
+    finds = collection.finds
+    # an update that does not touch the embedding (what the Node backend's updatedAt would track)
+    collection.documents[0]["updatedAt"] = datetime.datetime.utcnow()
+    assert gallery.get() is index
+    assert collection.finds == finds
+
+
+def test_gallery_rebuilds_after_a_re_embed(gallery_collection, embeddings):
+    collection, _ = gallery_collection
+    gallery = make_gallery(collection)
+    gallery.get()
+    replacement = embeddings(1)[0]
+    collection.documents[0].update(embedding_document_fields(replacement, binary=False))
+    collection.documents[0][EMBEDDING_UPDATED_FIELD] += datetime.timedelta(seconds=1)
+    assert gallery.get().best_match(replacement)["studentId"] == "s0"
+
+
+def test_gallery_rebuilds_after_a_delete(gallery_collection):
+    collection, vectors = gallery_collection
+    gallery = make_gallery(collection)
+    gallery.get()
+    del collection.documents[1]
+    assert gallery.get().best_match(vectors[1]) is None
+
+
+def test_gallery_add_does_not_trigger_a_rebuild(gallery_collection, embeddings):
+    collection, _ = gallery_collection
+    gallery = make_gallery(collection)
+    gallery.get()
+    vector = embeddings(1)[0]
+    document = student(3, vector)
+    collection.documents.append(document)
+    gallery.add("s3", "Student 3", vector, document["_id"])
+    finds = collection.finds
+    assert gallery.get().best_match(vector)["studentId"] == "s3"
+    assert collection.finds == finds
+
+
+def test_gallery_invalidate_forces_a_rebuild(gallery_collection):
+    collection, _ = gallery_collection
+    gallery = CollectionGallery(collection, "studentId", "name", check_s=3600.0)
+    gallery.get()
+    finds = collection.finds
+    gallery.get()
+    assert collection.finds == finds
+    gallery.invalidate()
+    gallery.get()
+    assert collection.finds > finds
+
+
+def test_gallery_fetch_missing(gallery_collection, embeddings):
+    collection, _ = gallery_collection
+    gallery = CollectionGallery(collection, "studentId", "name", check_s=3600.0)
+    gallery.get()
+    vector = embeddings(1)[0]
+    collection.documents.append(student(9, vector, binary=True))
+    assert gallery.get().best_match(vector) is None
+    gallery.fetch_missing(["s0", "s9"])
+    assert gallery.get().best_match(vector)["studentId"] == "s9"
+
+
+@pytest.fixture
+def watch_clock(monkeypatch):
+    import face_index
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(face_index.time, "time", lambda: now[0])
+    return now
+
+
+def test_watch_reports_each_change_once(gallery_collection, embeddings, watch_clock):
+    collection, _ = gallery_collection
+    watch = CollectionWatch(collection, check_s=60, updated_field=EMBEDDING_UPDATED_FIELD)
+    assert not watch.changed()  # first look only records the signature
+    watch_clock[0] += 60
+    assert not watch.changed()
+    # re-embedded in place: same _ids and count
+    collection.documents[1].update(embedding_document_fields(embeddings(1)[0], binary=False))
+    collection.documents[1][EMBEDDING_UPDATED_FIELD] += datetime.timedelta(seconds=1)
+    watch_clock[0] += 60
+    assert watch.changed()
+    watch_clock[0] += 60
+    assert not watch.changed()
+
+
+def test_watch_sees_deletes_only_after_check_s(gallery_collection, watch_clock):
+    collection, _ = gallery_collection
+    watch = CollectionWatch(collection, check_s=60)
+    watch.changed()
+    del collection.documents[0]
+    watch_clock[0] += 30
+    assert not watch.changed()
+    watch_clock[0] += 30
+    assert watch.changed()
+
+
+def test_watch_ignores_unrelated_updates_and_a_missing_database(gallery_collection, watch_clock):
+    collection, _ = gallery_collection
+    watch = CollectionWatch(collection, check_s=0, updated_field=EMBEDDING_UPDATED_FIELD)
+    watch.changed()
+    collection.documents[0]["updatedAt"] = datetime.datetime.utcnow()
+    assert not watch.changed()
+    assert not CollectionWatch(None).changed()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+import numpy as np
+import pytest
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from face_upload import UploadError, _read_stream, read_face_upload
+
+MAX_BYTES = 1024
+JPEG = b"\xff\xd8" + b"\x00" * 200 + b"\xff\xd9"
+
+
+def make_request(body=b"", content_type="application/json", length=True, **kwargs):
+    """Request over ``body``; ``length=False`` sends it like a chunked upload (no Content-Length)."""
+    environ = EnvironBuilder(method="POST", path="/student/attend", content_type=content_type, **kwargs).get_environ()
+    environ["wsgi.input"] = io.BytesIO(body)
+    if length:
+        environ["CONTENT_LENGTH"] = str(len(body))
+    else:
+        environ.pop("CONTENT_LENGTH", None)
+        environ["wsgi.input_terminated"] = True
+    return Request(environ)
+
+
+def multipart_request(fields, image=None, length=True):
+    builder = EnvironBuilder(method="POST", path="/student/attend",
+                             data=dict(fields, **({"image": (io.BytesIO(image), "face.jpg")} if image else {})))
+    environ = builder.get_environ()
+    if not length:
+        environ.pop("CONTENT_LENGTH", None)
+        environ["wsgi.input_terminated"] = True
+    return Request(environ)
+
+
+@pytest.mark.parametrize("length", [True, False])
+def test_json_upload(length):
+    body = json.dumps({"image_base64": "data:image/jpeg;base64,AAAA", "studentId": "s1"}).encode()
+    upload = read_face_upload(make_request(body, length=length), MAX_BYTES)
+    assert upload.mode == "json"
+    assert upload.data["studentId"] == "s1"
+    assert upload.image == "data:image/jpeg;base64,AAAA"
+    assert upload.size == len(body)
+
+
+@pytest.mark.parametrize("length", [True, False])
+def test_json_over_the_limit(length):
+    body = json.dumps({"image_base64": "x" * 2 * MAX_BYTES}).encode()
+    with pytest.raises(UploadError) as error:
+        read_face_upload(make_request(body, length=length), MAX_BYTES)
+    assert error.value.status == 413
+
+
+@pytest.mark.parametrize("length", [True, False])
+def test_invalid_json_is_an_empty_request(length):
+    upload = read_face_upload(make_request(b"[not json", length=length), MAX_BYTES)
+    assert upload.data == {} and upload.image is None
+
+
+@pytest.mark.parametrize("length", [True, False])
+def test_raw_upload(length):
+    request = make_request(JPEG, "image/jpeg", length=length, query_string={"studentId": "s1"},
+                           headers={"X-Face-Metadata": json.dumps({"attendanceId": "a1", "studentId": "ignored"})})
+    upload = read_face_upload(request, MAX_BYTES)
+    assert upload.mode == "raw"
+    assert upload.data == {"attendanceId": "a1", "studentId": "s1"}
+    assert isinstance(upload.image, np.ndarray) and upload.image.tobytes() == JPEG
+    assert upload.size == len(JPEG)
+
+
+@pytest.mark.parametrize("length", [True, False])
+def test_raw_over_the_limit(length):
+    with pytest.raises(UploadError) as error:
+        read_face_upload(make_request(b"\xff" * (MAX_BYTES + 1), "image/jpeg", length=length), MAX_BYTES)
+    assert error.value.status == 413
+
+
+def test_raw_upload_cut_short():
+    # behind a server werkzeug's LimitedStream reports the disconnect itself; a plain stream ends early
+    with pytest.raises(UploadError) as error:
+        _read_stream(io.BytesIO(JPEG), len(JPEG) + 10, MAX_BYTES)
+    assert error.value.status == 400
+
+
+def test_empty_raw_upload_has_no_image():
+    assert read_face_upload(make_request(b"", "image/jpeg"), MAX_BYTES).image is None
+
+
+@pytest.mark.parametrize("header", ["{not json", "[1, 2]"])
+def test_bad_metadata_header(header):
+    with pytest.raises(UploadError) as error:
+        read_face_upload(make_request(JPEG, "image/jpeg", headers={"X-Face-Metadata": header}), MAX_BYTES)
+    assert error.value.status == 400
+
+
+def test_multipart_upload():
+    upload = read_face_upload(multipart_request(
+        {"metadata": json.dumps({"attendanceId": "a1"}), "studentId": "s1"}, JPEG), MAX_BYTES)
+    assert upload.mode == "multipart"
+    assert upload.data == {"attendanceId": "a1", "studentId": "s1"}
+    assert upload.image.tobytes() == JPEG
+
+
+def test_multipart_without_length_is_refused():
+    with pytest.raises(UploadError) as error:
+        read_face_upload(multipart_request({"studentId": "s1"}, JPEG, length=False), MAX_BYTES)
+    assert error.value.status == 411
+
+
+def test_multipart_over_the_limit():
+    with pytest.raises(UploadError) as error:
+        read_face_upload(multipart_request({"studentId": "s1"}, b"\xff" * (MAX_BYTES + 1)), MAX_BYTES)
+    assert error.value.status == 413
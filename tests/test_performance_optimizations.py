@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import cv2
+import numpy as np
+import pytest
+
+import performance_optimizations
+from performance_optimizations import TTLCache, decode_image_reduced, jpeg_dimensions, reduced_decode_factor
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.monotonic for the cache."""
+    now = [1000.0]
+    monkeypatch.setattr(performance_optimizations.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_ttl_cache_hit_and_miss(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    assert cache.get("a") is None
+    assert cache.get("a", "default") == "default"
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 1)
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_ttl_cache_expires_entries(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.put("a", 1)
+    clock[0] += 9.9
+    assert cache.get("a") == 1
+    clock[0] += 0.2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.get_stats()["expirations"] == 1
+
+
+def test_ttl_cache_put_refreshes_the_ttl(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.put("a", 1)
+    clock[0] += 8
+    cache.put("a", 2)
+    clock[0] += 8
+    assert cache.get("a") == 2
+
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_ttl_cache_caches_falsy_values(clock):
+    cache = TTLCache()
+    cache.put("missing teacher", None)
+    cache.put("zero", 0)
+    assert cache.get("zero", "default") == 0
+    assert cache.get("missing teacher", "default") is None
+
+
+def test_ttl_cache_invalidate_and_clear(clock):
+    cache = TTLCache()
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.invalidate("a")
+    cache.invalidate("unknown")
+    assert cache.get("a") is None and cache.get("b") == 2
+    cache.clear()
+    assert len(cache) == 0
+
+
+def encode(image, ext=".jpg", params=()):
+    ok, data = cv2.imencode(ext, image, list(params))
+    assert ok
+    return data
+
+
+@pytest.fixture
+def photo():
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+    cv2.circle(image, (320, 240), 100, (200, 160, 120), -1)
+    return image
+
+
+def test_jpeg_dimensions(photo):
+    assert jpeg_dimensions(encode(photo)) == (640, 480)
+    assert jpeg_dimensions(encode(photo).tobytes()) == (640, 480)
+    progressive = encode(photo, params=(cv2.IMWRITE_JPEG_PROGRESSIVE, 1))
+    assert jpeg_dimensions(progressive) == (640, 480)
+
+
+def test_jpeg_dimensions_rejects_other_data(photo):
+    assert jpeg_dimensions(encode(photo, ".png")) is None
+    assert jpeg_dimensions(b"") is None
+    assert jpeg_dimensions(b"\xff\xd8") is None
+    # cut before the frame header
+    data = encode(photo).tobytes()
+    sof = data.index(b"\xff\xc0")
+    assert jpeg_dimensions(data[:sof + 6]) is None
+
+
+@pytest.mark.parametrize("width, height, target, factor", [
+    (4000, 3000, 480, 8),
+    (1920, 1080, 480, 4),
+    (1280, 720, 480, 2),
+    (640, 480, 480, 1),
+    (480, 640, 160, 4),
+    (4000, 3000, 0, 1),
+])
+def test_reduced_decode_factor(width, height, target, factor):
+    assert reduced_decode_factor(width, height, target) == factor
+
+
+def test_decode_image_reduced(photo):
+    large = cv2.resize(photo, (1920, 1440))
+    image, scale = decode_image_reduced(encode(large), 480)
+    assert scale == 4
+    assert image.shape == (360, 480, 3)
+    image, scale = decode_image_reduced(encode(large, ".png"), 480)
+    assert scale == 1 and image.shape == (1440, 1920, 3)
+    image, scale = decode_image_reduced(encode(photo), 0)
+    assert scale == 1 and image.shape == (480, 640, 3)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from conftest import FakeCollection
+from face_index import EMBEDDING_BINARY_FIELD, EMBEDDING_FIELD, EMBEDDING_UPDATED_FIELD, decode_embedding, embedding_document_fields
+from reembed import VERSION_FIELD, embedding_update
+
+
+@pytest.fixture
+def binary_document(embeddings):
+    old = embeddings(1)[0]
+    return dict({"_id": ObjectId(), "studentId": "s1"}, **embedding_document_fields(old, binary=True)), old
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_re_embedding_a_binary_document(binary_document, embeddings, binary):
+    document, old = binary_document
+    stamped = document[EMBEDDING_UPDATED_FIELD]
+    collection = FakeCollection([document])
+    new = embeddings(1)[0]
+    collection.update_one({"_id": document["_id"]}, embedding_update(new, "v2", binary=binary))
+    document = collection.documents[0]
+    # every reader (decode_embedding) sees the new embedding, whichever format is kept
+    np.testing.assert_allclose(decode_embedding(document), new, rtol=1e-6)
+    np.testing.assert_allclose(document[EMBEDDING_FIELD], new, rtol=1e-6)
+    assert (EMBEDDING_BINARY_FIELD in document) == binary
+    assert document[VERSION_FIELD] == "v2"
+    assert document[EMBEDDING_UPDATED_FIELD] >= stamped
+    assert not np.allclose(decode_embedding(document), old)
+
+
+def test_binary_update_does_not_unset_anything(embeddings):
+    assert "$unset" not in embedding_update(embeddings(1)[0], "v2", binary=True)